@@ -1,81 +1,115 @@
+import hmac
+import importlib
+import ipaddress
 import os
 from datetime import timedelta
-from flask import Flask, send_from_directory, jsonify, request, session, g
+from flask import Flask, Response, send_from_directory, jsonify, request, session, g
 from flask_cors import CORS
 from database import init_db, close_db, get_db
-
-app = Flask(__name__, static_folder=None)
-CORS(app, supports_credentials=True)
-
-# Session / secret key configuration
-app.secret_key = os.environ.get('FLASK_SECRET_KEY', os.urandom(32))
-app.config['SESSION_COOKIE_HTTPONLY'] = True
-app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'
-app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(hours=8)
+import cache
+import metrics
+import tracing
+import sessions
+import shards
 
 # Parent directory has the frontend files
 FRONTEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 
-# Initialize database on startup
-init_db()
-
-# Register teardown
-app.teardown_appcontext(close_db)
-
-# --- Import and register route blueprints ---
-from routes.companies import bp as companies_bp
-from routes.subnets import bp as subnets_bp
-from routes.hosts import bp as hosts_bp
-from routes.ips import bp as ips_bp
-from routes.vlans import bp as vlans_bp
-from routes.ip_ranges import bp as ip_ranges_bp
-from routes.dhcp import bp as dhcp_bp
-from routes.locations import bp as locations_bp
-from routes.maintenance import bp as maintenance_bp
-from routes.templates import bp as templates_bp
-from routes.audit_log import bp as audit_log_bp
-from routes.settings import bp as settings_bp
-from routes.backup import bp as backup_bp
-from routes.saved_filters import bp as saved_filters_bp
-from routes.ip_history import bp as ip_history_bp
-from routes.auth import bp as auth_bp
-
-app.register_blueprint(companies_bp, url_prefix='/api/v1')
-app.register_blueprint(subnets_bp, url_prefix='/api/v1')
-app.register_blueprint(hosts_bp, url_prefix='/api/v1')
-app.register_blueprint(ips_bp, url_prefix='/api/v1')
-app.register_blueprint(vlans_bp, url_prefix='/api/v1')
-app.register_blueprint(ip_ranges_bp, url_prefix='/api/v1')
-app.register_blueprint(dhcp_bp, url_prefix='/api/v1')
-app.register_blueprint(locations_bp, url_prefix='/api/v1')
-app.register_blueprint(maintenance_bp, url_prefix='/api/v1')
-app.register_blueprint(templates_bp, url_prefix='/api/v1')
-app.register_blueprint(audit_log_bp, url_prefix='/api/v1')
-app.register_blueprint(settings_bp, url_prefix='/api/v1')
-app.register_blueprint(backup_bp, url_prefix='/api/v1')
-app.register_blueprint(saved_filters_bp, url_prefix='/api/v1')
-app.register_blueprint(ip_history_bp, url_prefix='/api/v1')
-app.register_blueprint(auth_bp, url_prefix='/auth')
+# Route modules (each exposing ``bp``) and the prefix they are mounted under
+BLUEPRINTS = (
+    ('routes.companies', '/api/v1'),
+    ('routes.subnets', '/api/v1'),
+    ('routes.hosts', '/api/v1'),
+    ('routes.ips', '/api/v1'),
+    ('routes.vlans', '/api/v1'),
+    ('routes.ip_ranges', '/api/v1'),
+    ('routes.dhcp', '/api/v1'),
+    ('routes.locations', '/api/v1'),
+    ('routes.maintenance', '/api/v1'),
+    ('routes.templates', '/api/v1'),
+    ('routes.audit_log', '/api/v1'),
+    ('routes.settings', '/api/v1'),
+    ('routes.backup', '/api/v1'),
+    ('routes.saved_filters', '/api/v1'),
+    ('routes.ip_history', '/api/v1'),
+    ('routes.events', '/api/v1'),
+    ('routes.export', '/api/v1'),
+    ('routes.integrity', '/api/v1'),
+    ('routes.auth', '/auth'),
+)
+
+
+def create_app(init_schema=True):
+    """Build the Flask application.
+
+    WSGI servers can call this directly (``gunicorn 'app:create_app()'``); the
+    module-level ``app`` is created from it on first access for ``python app.py``
+    and existing ``from app import app`` imports.
+    """
+    app = Flask(__name__, static_folder=None)
+    CORS(app, supports_credentials=True)
+
+    # Request timing hooks must run before the auth gate so rejected requests are counted too
+    metrics.init_app(app)
+    tracing.init_app(app)
+
+    # Session / secret key configuration
+    app.secret_key = os.environ.get('FLASK_SECRET_KEY', os.urandom(32))
+    app.config['SESSION_COOKIE_HTTPONLY'] = True
+    app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'
+    app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(hours=8)
+    sessions.init_app(app)
+
+    # Creates or migrates the schema; a no-op when the stored schema version matches
+    if init_schema:
+        init_db()
+
+    app.teardown_appcontext(close_db)
+
+    # Scheduled online snapshots (see snapshots.py)
+    if os.environ.get('OPENIPAM_SNAPSHOT_INTERVAL_MIN'):
+        import snapshots
+        snapshots.start_scheduler(float(os.environ['OPENIPAM_SNAPSHOT_INTERVAL_MIN']), logger=app.logger)
+
+    for module, prefix in BLUEPRINTS:
+        app.register_blueprint(importlib.import_module(module).bp, url_prefix=prefix)
+
+    app.before_request(require_login)
+    # Company scope validation runs after the auth gate (see shards.py)
+    shards.init_app(app)
+
+    app.add_url_rule('/api/v1/health', view_func=health)
+    app.add_url_rule('/api/v1/ready', view_func=ready)
+    app.add_url_rule('/metrics', view_func=prometheus_metrics)
+    app.add_url_rule('/api/v1/cache', view_func=cache_stats)
+    app.add_url_rule('/api/v1/dashboard', view_func=dashboard)
+    app.add_url_rule('/api/v1/search', view_func=search)
+    app.add_url_rule('/', view_func=serve_index)
+    app.add_url_rule('/styles.css', view_func=serve_css)
+    app.add_url_rule('/modules/<path:filename>', view_func=serve_modules)
+    app.add_url_rule('/<path:filename>', view_func=serve_static)
+    return app
 
 
 # --- Authentication gate ---
-OPEN_PREFIXES = ('/auth/', '/api/v1/health')
-STATIC_EXTENSIONS = ('.css', '.js', '.png', '.jpg', '.svg', '.ico', '.woff', '.woff2', '.ttf', '.wasm')
+OPEN_PREFIXES = ('/auth/', '/api/v1/health', '/api/v1/ready')
+# Scraped without a session; guarded by OPENIPAM_METRICS_TOKEN in prometheus_metrics() when set
+OPEN_PATHS = ('/login.html', '/metrics')
 
-@app.before_request
 def require_login():
     path = request.path
     # Allow auth routes and health check through
     if any(path.startswith(p) for p in OPEN_PREFIXES):
         return None
-    # Allow login.html and its static assets
-    if path == '/login.html':
+    # Allow login.html and the metrics scrape
+    if path in OPEN_PATHS:
+        return None
+    # Allow static file requests through (fonts, css, js needed by login page);
+    # the session backend doesn't load a session for these
+    if sessions.is_static_path(path):
         return None
     # Set current user on g for downstream use
     g.current_user = session.get('user')
-    # Allow static file requests through (fonts, css, js needed by login page)
-    if any(path.endswith(ext) for ext in STATIC_EXTENSIONS):
-        return None
     # Check authentication
     if not session.get('user'):
         # API requests get 401
@@ -86,68 +120,107 @@ def require_login():
     return None
 
 
-# --- Health endpoint ---
-@app.route('/api/v1/health')
+# --- Health and readiness endpoints ---
 def health():
+    """Liveness: the process is up."""
     return jsonify({'status': 'ok', 'version': '1.0.0'})
 
 
+def ready():
+    """Readiness: the app is built and its database answers queries."""
+    try:
+        get_db().execute('SELECT 1').fetchone()
+    except Exception as e:  # driver errors differ per engine
+        return jsonify({'status': 'unavailable', 'error': str(e)}), 503
+    return jsonify({'status': 'ready'})
+
+
+# --- Prometheus metrics endpoint ---
+METRICS_TOKEN = os.environ.get('OPENIPAM_METRICS_TOKEN')
+
+
+def prometheus_metrics():
+    """Prometheus text format; needs ``Authorization: Bearer <token>`` when OPENIPAM_METRICS_TOKEN is set."""
+    if METRICS_TOKEN:
+        supplied = request.headers.get('Authorization', '')
+        if not hmac.compare_digest(supplied.encode(), f'Bearer {METRICS_TOKEN}'.encode()):
+            return jsonify({'error': 'Authentication required'}), 401
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+# --- Response cache statistics ---
+def cache_stats():
+    return jsonify({c.name: c.stats() for c in cache.CACHES})
+
+
 # --- Dashboard endpoint ---
-@app.route('/api/v1/dashboard')
+# Key -> (table, query); with shards enabled, tenant tables are counted in every shard
+DASHBOARD_COUNTS = {
+    'companies': ('companies', 'SELECT COUNT(*) as c FROM companies'),
+    'subnets': ('subnets', 'SELECT COUNT(*) as c FROM subnets'),
+    'hosts': ('hosts', 'SELECT COUNT(*) as c FROM hosts'),
+    'ips': ('ips', 'SELECT COUNT(*) as c FROM ips'),
+    'vlans': ('vlans', 'SELECT COUNT(*) as c FROM vlans'),
+    'dhcpScopes': ('dhcp_scopes', 'SELECT COUNT(*) as c FROM dhcp_scopes'),
+    'dhcpLeases': ('dhcp_leases', "SELECT COUNT(*) as c FROM dhcp_leases WHERE status = 'active'"),
+    'runningHosts': ('hosts', "SELECT COUNT(*) as c FROM hosts WHERE LOWER(state) = 'running'"),
+}
+
+
+@cache.cached(*sorted({table for table, _ in DASHBOARD_COUNTS.values()}))
 def dashboard():
-    db = get_db()
-    stats = {
-        'companies': db.execute('SELECT COUNT(*) as c FROM companies').fetchone()['c'],
-        'subnets': db.execute('SELECT COUNT(*) as c FROM subnets').fetchone()['c'],
-        'hosts': db.execute('SELECT COUNT(*) as c FROM hosts').fetchone()['c'],
-        'ips': db.execute('SELECT COUNT(*) as c FROM ips').fetchone()['c'],
-        'vlans': db.execute('SELECT COUNT(*) as c FROM vlans').fetchone()['c'],
-        'dhcpScopes': db.execute('SELECT COUNT(*) as c FROM dhcp_scopes').fetchone()['c'],
-        'dhcpLeases': db.execute('SELECT COUNT(*) as c FROM dhcp_leases WHERE status = "active"').fetchone()['c'],
-        'runningHosts': db.execute('SELECT COUNT(*) as c FROM hosts WHERE LOWER(state) = "running"').fetchone()['c'],
-    }
+    stats = {key: sum(row['c'] for row in shards.query(table, sql))
+             for key, (table, sql) in DASHBOARD_COUNTS.items()}
     return jsonify(stats)
 
 
 # --- Search endpoint ---
-@app.route('/api/v1/search')
 def search():
     q = request.args.get('q', '').lower().strip()
     if len(q) < 2:
         return jsonify([])
-    db = get_db()
     results = []
     pattern = f'%{q}%'
 
-    for row in db.execute('SELECT id, vmName, operatingSystem, hostType FROM hosts WHERE vmName LIKE ? OR operatingSystem LIKE ? OR description LIKE ? OR serialNumber LIKE ? LIMIT 5', (pattern, pattern, pattern, pattern)):
+    for row in shards.query('hosts', 'SELECT id, vmName, operatingSystem, hostType FROM hosts WHERE vmName LIKE ? OR operatingSystem LIKE ? OR description LIKE ? OR serialNumber LIKE ? LIMIT 5', (pattern, pattern, pattern, pattern))[:5]:
         results.append({'type': 'host', 'id': row['id'], 'title': row['vmName'], 'subtitle': row['operatingSystem'] or row['hostType'], 'icon': '\U0001f4bb', 'page': 'hosts'})
 
-    for row in db.execute('SELECT id, ipAddress, dnsName FROM ips WHERE ipAddress LIKE ? OR dnsName LIKE ? LIMIT 5', (pattern, pattern)):
+    for row in shards.query('ips', 'SELECT id, ipAddress, dnsName FROM ips WHERE ipAddress LIKE ? OR dnsName LIKE ? LIMIT 5', (pattern, pattern))[:5]:
         results.append({'type': 'ip', 'id': row['id'], 'title': row['ipAddress'], 'subtitle': row['dnsName'] or '', 'icon': '\U0001f310', 'page': 'ipam'})
 
-    for row in db.execute('SELECT id, network, cidr, name FROM subnets WHERE network LIKE ? OR name LIKE ? LIMIT 5', (pattern, pattern)):
+    subnet_rows = shards.query('subnets', 'SELECT id, network, cidr, name FROM subnets WHERE network LIKE ? OR name LIKE ? LIMIT 5', (pattern, pattern))[:5]
+    # An exact address also finds the subnets it belongs to
+    try:
+        address = str(ipaddress.ip_address(q))
+    except ValueError:
+        address = None
+    if address:
+        containing = [row for db in shards.connections('subnets') for row in db.containing_subnets(address)]
+        containing.sort(key=lambda row: int(row['cidr'] or 0), reverse=True)
+        subnet_rows = containing[:5] + subnet_rows
+    seen = set()
+    for row in subnet_rows:
+        if row['id'] in seen:
+            continue
+        seen.add(row['id'])
         results.append({'type': 'subnet', 'id': row['id'], 'title': f"{row['network']}/{row['cidr']}", 'subtitle': row['name'] or '', 'icon': '\U0001f517', 'page': 'subnets'})
 
-    for row in db.execute('SELECT id, name, startIP, endIP FROM dhcp_scopes WHERE name LIKE ? OR startIP LIKE ? OR endIP LIKE ? LIMIT 5', (pattern, pattern, pattern)):
+    for row in shards.query('dhcp_scopes', 'SELECT id, name, startIP, endIP FROM dhcp_scopes WHERE name LIKE ? OR startIP LIKE ? OR endIP LIKE ? LIMIT 5', (pattern, pattern, pattern))[:5]:
         results.append({'type': 'dhcp_scope', 'id': row['id'], 'title': row['name'] or f"{row['startIP']} - {row['endIP']}", 'subtitle': f"{row['startIP']} - {row['endIP']}", 'icon': '\U0001f4cb', 'page': 'dhcp'})
 
     return jsonify(results[:20])
 
 
 # --- Serve frontend static files ---
-@app.route('/')
 def serve_index():
     return send_from_directory(FRONTEND_DIR, 'index.html')
 
-@app.route('/styles.css')
 def serve_css():
     return send_from_directory(FRONTEND_DIR, 'styles.css')
 
-@app.route('/modules/<path:filename>')
 def serve_modules(filename):
     return send_from_directory(os.path.join(FRONTEND_DIR, 'modules'), filename)
 
-@app.route('/<path:filename>')
 def serve_static(filename):
     filepath = os.path.join(FRONTEND_DIR, filename)
     if os.path.isfile(filepath):
@@ -155,6 +228,15 @@ def serve_static(filename):
     return send_from_directory(FRONTEND_DIR, 'index.html')
 
 
+def __getattr__(name):
+    # ``app`` is built on first use, so importing this module (e.g. for create_app) is cheap
+    if name == 'app':
+        global app
+        app = create_app()
+        return app
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
-    app.run(host='0.0.0.0', port=port, debug=True)
+    create_app().run(host='0.0.0.0', port=port, debug=True)
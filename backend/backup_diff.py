@@ -0,0 +1,333 @@
+"""Row-level diff between two backups, snapshots or databases.
+
+Shows what restoring a backup (POST /api/v1/backup replaces every table) or a
+snapshot would change before doing it. Each side is a backup file (JSON or
+MessagePack, object or columnar format), a SQLite database or snapshot file,
+a snapshot by name, or the live database:
+
+    python backup_diff.py current backup-monday.json
+    python backup_diff.py snapshot:openipam-20260101T020000Z current --summary
+    python backup_diff.py old.db new.db --tables hosts,ips --ignore updatedAt
+
+Both sides are read table by table in id order and merged like two sorted
+runs. A database side is a cursor walking the primary key index, so only one
+batch of rows per side is held however large the tables are; a backup side is
+parsed whole (as the import does) and only its ids are sorted. Rows with the
+same id are compared as tuples over the columns both sides have, and only the
+changed ones are turned into field-level deltas. JSON columns compare decoded,
+and the generated integer address columns are left out.
+
+Output is one JSON line per added, removed or changed row followed by a
+summary line; the exit status is 0 without differences and 1 with.
+"""
+import argparse
+import gzip
+import heapq
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+from contextlib import ExitStack, closing, contextmanager
+from operator import itemgetter
+from urllib.request import pathname2url
+
+import database
+import formats
+import snapshots
+
+BATCH_ROWS = 1000
+DERIVED_COLUMNS = frozenset(database.INT_COLUMNS.values())
+# Stored as JSON text in the database, objects in an object-format backup
+JSON_COLUMNS = {'reservations': ['json'], 'settings': ['value']}
+
+
+class DiffError(Exception):
+    pass
+
+
+def _picker(columns, wanted):
+    """Function taking a row tuple over ``columns`` to a tuple over ``wanted``."""
+    if columns == wanted:
+        return tuple
+    if not wanted:
+        return lambda values: ()
+    getter = itemgetter(*[columns.index(c) for c in wanted])
+    if len(wanted) == 1:
+        return lambda values: (getter(values),)
+    return getter
+
+
+def _decoded(values, positions):
+    values = list(values)
+    for i in positions:
+        if isinstance(values[i], str):
+            try:
+                values[i] = json.loads(values[i])
+            except ValueError:
+                pass
+    return tuple(values)
+
+
+class BackupSource:
+    """A backup document as produced by GET /backup, in object or columnar format."""
+
+    def __init__(self, document, keys):
+        if not isinstance(document, dict):
+            raise DiffError('A backup must be a JSON object')
+        self.document = document
+        # SQL table name -> backup key (routes.backup.TABLES reversed)
+        self.keys = keys
+        # Checked up front, like the import, so a malformed table fails before any output
+        self.tables = {table: self._items(key) for table, key in keys.items()}
+
+    def _items(self, key):
+        """The rows of one table as objects; a missing table counts as empty."""
+        data = self.document.get(key)
+        if data is None:
+            return []
+        if isinstance(data, dict) and self.document.get('format') == formats.COLUMNAR:
+            try:
+                return formats.expand(data)
+            except ValueError as e:
+                raise DiffError(f'{key}: {e}') from None
+        if not isinstance(data, list):
+            raise DiffError(f'{key}: expected an array of objects')
+        return data
+
+    def rows(self, table):
+        """(columns, iterator of (id, values)) in id order; None if the backup leaves the table alone."""
+        if table == 'settings':
+            settings = self.document.get('settings')
+            if not isinstance(settings, dict):
+                return None
+            return ['value'], iter(sorted((str(k), (v,)) for k, v in settings.items()))
+
+        data = self.tables[table] if table in self.tables else self._items(table)
+        if table == 'reservations':
+            # Opaque documents, stored whole in the json column
+            items = [item for item in data if isinstance(item, dict)]
+            ident = lambda item: item.get('id')  # noqa: E731
+            columns = ['json']
+            pick = lambda item: (item,)  # noqa: E731
+        else:
+            items = [item for item in data if isinstance(item, dict)]
+            names = {}
+            for item in items:
+                names.update(dict.fromkeys(item))
+            ident = lambda item: item.get('id')  # noqa: E731
+            columns = [c for c in names if c != 'id' and c not in DERIVED_COLUMNS]
+            pick = lambda item: tuple(item.get(c) for c in columns)  # noqa: E731
+
+        order = sorted((str(key), n) for n, key in enumerate(map(ident, items)) if key is not None)
+        return columns, ((key, pick(items[n])) for key, n in order)
+
+
+class DatabaseSource:
+    """Tables read in id order from one or more connections (a database file, or the main database and its shards)."""
+
+    def __init__(self, connections, collate=''):
+        # Callable: table name -> connections holding its rows
+        self.connections = connections
+        # Python orders strings by code point: the engine's byte_collation makes ids compare the same way
+        self.collate = collate
+
+    @staticmethod
+    def _stream(db, sql):
+        cur = db.execute(sql)
+        if isinstance(cur, sqlite3.Cursor):
+            cur.row_factory = None
+        while True:
+            rows = cur.fetchmany(BATCH_ROWS)
+            if not rows:
+                return
+            for row in rows:
+                row = tuple(row)
+                yield row[0], row[1:]
+
+    def rows(self, table):
+        dbs = self.connections(table)
+        names = dbs[0].columns(table)
+        if not names:
+            return [], iter(())
+        key = 'key' if table == 'settings' else 'id'
+        columns = [c for c in names if c != key and c not in DERIVED_COLUMNS]
+        sql = (f'SELECT {", ".join([key] + columns)} FROM {table} '
+               f'WHERE {key} IS NOT NULL ORDER BY {key}{self.collate}')
+        streams = [self._stream(db, sql) for db in dbs]
+        if len(streams) == 1:
+            return columns, streams[0]
+        return columns, heapq.merge(*streams, key=itemgetter(0))
+
+
+def _row(key, columns, values, json_positions):
+    return {'id': key, **dict(zip(columns, _decoded(values, json_positions)))}
+
+
+def _diff_table(table, old, new, json_columns, ignore, counts):
+    old_columns, old_rows = old
+    new_columns, new_rows = new
+    shared = [c for c in old_columns if c in new_columns and c not in ignore]
+    old_pick, new_pick = _picker(old_columns, shared), _picker(new_columns, shared)
+    positions = [i for i, c in enumerate(shared) if c in json_columns]
+    old_json = [i for i, c in enumerate(old_columns) if c in json_columns]
+    new_json = [i for i, c in enumerate(new_columns) if c in json_columns]
+    if old_columns and new_columns and old_columns != new_columns:
+        counts['columns'] = {'removed': [c for c in old_columns if c not in new_columns],
+                             'added': [c for c in new_columns if c not in old_columns]}
+
+    o, n = next(old_rows, None), next(new_rows, None)
+    while o is not None or n is not None:
+        if n is None or (o is not None and o[0] < n[0]):
+            counts['removed'] += 1
+            yield {'table': table, 'op': 'removed', 'id': o[0], 'row': _row(o[0], old_columns, o[1], old_json)}
+            o = next(old_rows, None)
+        elif o is None or n[0] < o[0]:
+            counts['added'] += 1
+            yield {'table': table, 'op': 'added', 'id': n[0], 'row': _row(n[0], new_columns, n[1], new_json)}
+            n = next(new_rows, None)
+        else:
+            a, b = old_pick(o[1]), new_pick(n[1])
+            if a != b and positions:
+                a, b = _decoded(a, positions), _decoded(b, positions)
+            if a == b:
+                counts['unchanged'] += 1
+            else:
+                counts['changed'] += 1
+                changes = {shared[i]: [x, y] for i, (x, y) in enumerate(zip(a, b)) if x != y}
+                yield {'table': table, 'op': 'changed', 'id': o[0], 'changes': changes}
+            o, n = next(old_rows, None), next(new_rows, None)
+
+
+def diff(old, new, tables, json_fields=None, ignore=()):
+    """Yield a record per added, removed or changed row of ``tables``, then a summary record.
+
+    ``old`` and ``new`` are BackupSource or DatabaseSource instances. Tables a
+    backup side leaves alone (settings missing from the document) are skipped.
+    """
+    json_fields = {**(json_fields or {}), **JSON_COLUMNS}
+    ignore = set(ignore)
+    summary = {}
+    for table in tables:
+        old_rows, new_rows = old.rows(table), new.rows(table)
+        if old_rows is None or new_rows is None:
+            continue
+        counts = summary[table] = {'added': 0, 'removed': 0, 'changed': 0, 'unchanged': 0}
+        yield from _diff_table(table, old_rows, new_rows, set(json_fields.get(table, ())), ignore, counts)
+    totals = {op: sum(c[op] for c in summary.values()) for op in ('added', 'removed', 'changed', 'unchanged')}
+    yield {'summary': summary, 'total': totals}
+
+
+# --- Command line ---
+
+def open_database(path):
+    """Read-only connection to a SQLite database or decompressed snapshot file."""
+    return sqlite3.connect(f'file:{pathname2url(os.path.abspath(path))}?mode=ro', uri=True, factory=database.Connection)
+
+
+def _live(stack):
+    import shards
+    engine = database.engine
+    if engine.name != 'sqlite':
+        raise DiffError('Diffing the live database from the command line needs the SQLite engine; '
+                        'use POST /api/v1/backup/diff')
+    main = stack.enter_context(closing(open_database(engine.path)))
+    tenants = [stack.enter_context(closing(open_database(engine.shard_path(c))))
+               for c in getattr(engine, 'shard_ids', list)()]
+    return DatabaseSource(lambda table: [main] + (tenants if table in shards.TENANT_TABLES else []))
+
+
+@contextmanager
+def _gunzipped(path):
+    fd, raw_path = tempfile.mkstemp(prefix='.diff-', suffix='.db')
+    try:
+        with os.fdopen(fd, 'wb') as f_out, gzip.open(path, 'rb') as f_in:
+            shutil.copyfileobj(f_in, f_out, 1 << 20)
+        yield raw_path
+    finally:
+        os.remove(raw_path)
+
+
+def _load(path):
+    if path.endswith(('.msgpack', '.mpk')):
+        try:
+            import msgpack
+        except ImportError:
+            raise DiffError('Reading MessagePack backups needs the msgpack package')
+        with open(path, 'rb') as f:
+            return msgpack.unpack(f, raw=False, strict_map_key=False)
+    with open(path) as f:
+        return json.load(f)
+
+
+def open_source(spec, stack, keys, directory=None):
+    """Source for a command-line argument; temporary files and connections are tied to ``stack``."""
+    if spec == 'current':
+        return _live(stack)
+    if spec.startswith('snapshot:'):
+        path = stack.enter_context(snapshots.extracted(spec[len('snapshot:'):], directory))
+    elif not os.path.exists(spec):
+        raise DiffError(f'No such file: {spec}')
+    elif spec.endswith('.gz'):
+        path = stack.enter_context(_gunzipped(spec))
+    elif spec.endswith(('.db', '.sqlite', '.sqlite3')):
+        path = spec
+    else:
+        try:
+            return BackupSource(_load(spec), keys)
+        except ValueError as e:
+            raise DiffError(f'Cannot read backup {spec}: {e}')
+    db = stack.enter_context(closing(open_database(path)))
+    return DatabaseSource(lambda table: [db])
+
+
+def main(argv=None):
+    from routes.backup import TABLES, JSON_FIELDS
+
+    parser = argparse.ArgumentParser(description='Row-level diff between two OpenIPAM backups or snapshots')
+    parser.add_argument('old', help='backup file, .db or .db.gz file, snapshot:NAME or current')
+    parser.add_argument('new', help='same choices as OLD')
+    parser.add_argument('--tables', help='comma-separated table names or backup keys (default: all)')
+    parser.add_argument('--ignore', default='', help='comma-separated columns not compared')
+    parser.add_argument('--summary', action='store_true', help='only print counts per table')
+    parser.add_argument('--dir', default=snapshots.SNAPSHOT_DIR, help='snapshot directory')
+    args = parser.parse_args(argv)
+
+    tables = list(TABLES.values()) + ['settings']
+    if args.tables:
+        wanted = [TABLES.get(t.strip(), t.strip()) for t in args.tables.split(',') if t.strip()]
+        unknown = [t for t in wanted if t not in tables]
+        if unknown:
+            parser.error(f'unknown tables: {", ".join(unknown)}')
+        tables = wanted
+    keys = {table: key for key, table in TABLES.items()}
+
+    try:
+        with ExitStack() as stack:
+            old = open_source(args.old, stack, keys, args.dir)
+            new = open_source(args.new, stack, keys, args.dir)
+            for record in diff(old, new, tables, JSON_FIELDS, [c for c in args.ignore.split(',') if c]):
+                if 'summary' in record:
+                    break
+                if not args.summary:
+                    print(json.dumps(record, default=str))
+    except (DiffError, snapshots.SnapshotError, sqlite3.Error, OSError) as e:
+        print(f'Error: {e}', file=sys.stderr)
+        return 2
+
+    if args.summary:
+        for table, counts in record['summary'].items():
+            if counts['added'] or counts['removed'] or counts['changed']:
+                print(f'{table:22s} +{counts["added"]:<8d} -{counts["removed"]:<8d} ~{counts["changed"]:<8d}')
+        total = record['total']
+        print(f'{"total":22s} +{total["added"]:<8d} -{total["removed"]:<8d} ~{total["changed"]:<8d} '
+              f'({total["unchanged"]} unchanged)')
+    else:
+        print(json.dumps(record, default=str))
+    total = record['total']
+    return 1 if total['added'] or total['removed'] or total['changed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,17 @@
+"""Synthetic data generation and performance benchmarks for the OpenIPAM backend.
+
+Run from the backend directory:
+
+    python -m benchmarks.generate --scale medium
+    python -m benchmarks.harness --scale medium --save benchmarks/baseline-medium.json
+    python -m benchmarks.harness --scale medium --compare benchmarks/baseline-medium.json
+    python -m benchmarks.startup --save benchmarks/startup-baseline.json
+"""
+import os
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(BENCH_DIR, 'data')
+
+
+def default_db_path(scale):
+    return os.path.join(DATA_DIR, f'openipam-{scale}.db')
@@ -0,0 +1,65 @@
+"""Throughput of the batch address functions in ipmath.
+
+Generates seeded random IPv4 addresses (a share of them malformed) and nested
+prefixes, then times each ipmath operation over the whole batch, the way an
+import or conflict check would use them. Run it with and without NumPy
+installed to compare the vectorized and the fallback implementations.
+
+    python -m benchmarks.addresses
+    python -m benchmarks.addresses --addresses 100000 --prefixes 5000
+"""
+import argparse
+import os
+import random
+import sys
+from time import perf_counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ipmath  # noqa: E402
+
+
+def _dataset(addresses, prefixes, invalid, seed):
+    rng = random.Random(seed)
+    texts = [f'10.{rng.randrange(256)}.{rng.randrange(256)}.{rng.randrange(256)}' for _ in range(addresses)]
+    for i in rng.sample(range(addresses), int(addresses * invalid)):
+        texts[i] = rng.choice(('10.0.0.256', '10.0.0', 'host-1', '', '10.00.0.1'))
+    cidrs = []
+    for _ in range(prefixes):
+        length = rng.choice((16, 20, 22, 24, 24, 24, 26, 28))
+        network = (10 << 24 | rng.getrandbits(24)) >> (32 - length) << (32 - length)
+        cidrs.append(f'{network >> 24}.{network >> 16 & 255}.{network >> 8 & 255}.{network & 255}/{length}')
+    return texts, cidrs
+
+
+def _timed(label, func, *args):
+    start = perf_counter()
+    result = func(*args)
+    print(f'  {label:10s} {(perf_counter() - start) * 1000:9.1f} ms')
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark batch IP address math')
+    parser.add_argument('--addresses', type=int, default=1_000_000)
+    parser.add_argument('--prefixes', type=int, default=10_000)
+    parser.add_argument('--invalid', type=float, default=0.01, help='share of malformed addresses')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args(argv)
+
+    texts, cidrs = _dataset(args.addresses, args.prefixes, args.invalid, args.seed)
+    print(f'{args.addresses} addresses, {args.prefixes} prefixes, '
+          f'{"NumPy" if ipmath.available() else "pure Python (NumPy not installed)"}')
+    values, valid = _timed('parse', ipmath.parse, texts)
+    starts, ends, _, _ = _timed('networks', ipmath.networks, cidrs)
+    values = [v for v, ok in zip(values, valid) if ok] if not ipmath.available() else values[valid]
+    owner = _timed('locate', ipmath.locate, values, starts, ends)
+    other = _timed('overlaps', ipmath.overlaps, starts, ends)
+    blocks, _ = _timed('summarize', ipmath.summarize, values, values)
+    _timed('to_text', ipmath.to_text, blocks)
+    print(f'\n{sum(1 for ok in valid if ok)} valid, {sum(1 for o in owner if o != -1)} inside a prefix, '
+          f'{sum(1 for o in other if o != -1)} overlapping prefixes, {len(blocks)} summary blocks')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,249 @@
+"""Seeded generator for realistic OpenIPAM databases at configurable scale.
+
+    python -m benchmarks.generate --scale large --seed 42
+    python -m benchmarks.generate --hosts 5000 --ips 50000 --db /tmp/bench.db
+"""
+import argparse
+import json
+import os
+import random
+import sqlite3
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import init_db  # noqa: E402
+from benchmarks import default_db_path  # noqa: E402
+
+SCALES = {
+    'tiny':   dict(companies=3, supernets=1, subnets=50, hosts=500, ips=5000,
+                   scopes=10, leases=1000, audit=10000),
+    'small':  dict(companies=10, supernets=1, subnets=500, hosts=5000, ips=50000,
+                   scopes=50, leases=10000, audit=100000),
+    'medium': dict(companies=20, supernets=2, subnets=4000, hosts=25000, ips=250000,
+                   scopes=400, leases=50000, audit=1000000),
+    'large':  dict(companies=40, supernets=4, subnets=16000, hosts=100000, ips=1000000,
+                   scopes=2000, leases=200000, audit=5000000),
+}
+
+HOST_TYPES = ['vm', 'vm', 'vm', 'vm', 'physical', 'container', 'firewall', 'router', 'switch',
+              'loadbalancer', 'storage', 'database', 'web', 'app']
+OPERATING_SYSTEMS = ['Ubuntu 22.04', 'Ubuntu 24.04', 'Debian 12', 'RHEL 9', 'Rocky Linux 9',
+                     'Windows Server 2022', 'Windows Server 2019', 'FreeBSD 14', 'VMware ESXi 8']
+STATES = ['running', 'running', 'running', 'stopped', 'suspended']
+VENDORS = ['Dell', 'HPE', 'Lenovo', 'Supermicro', 'Cisco', 'Juniper']
+VLAN_TYPES = ['data', 'voice', 'management', 'dmz', 'guest', 'iot', 'storage', 'backup']
+ACTIONS = ['create', 'update', 'delete', 'assign', 'release']
+ENTITY_TYPES = ['host', 'ip', 'subnet', 'vlan', 'company', 'dhcp_scope']
+
+BATCH = 10000
+
+
+def _ip(n):
+    return f'{(n >> 24) & 255}.{(n >> 16) & 255}.{(n >> 8) & 255}.{n & 255}'
+
+
+class Generator:
+    def __init__(self, path, seed, counts):
+        self.path = path
+        self.rng = random.Random(seed)
+        self.counts = counts
+        self.base_time = datetime(2024, 1, 1)
+        self.company_ids = []
+        self.subnets = []      # (id, network_int, cidr)
+        self.host_ids = []
+        self.scope_ids = []
+
+    def _id(self):
+        return f'{self.rng.getrandbits(48):012x}'
+
+    def _ts(self, max_days=700):
+        dt = self.base_time + timedelta(seconds=self.rng.randrange(max_days * 86400))
+        return dt.isoformat() + 'Z'
+
+    def _insert(self, db, table, cols, rows):
+        sql = f'INSERT INTO {table} ({",".join(cols)}) VALUES ({",".join("?" * len(cols))})'
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= BATCH:
+                db.executemany(sql, batch)
+                batch.clear()
+        if batch:
+            db.executemany(sql, batch)
+
+    def run(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        init_db(self.path)
+        db = sqlite3.connect(self.path)
+        db.execute('PRAGMA synchronous = OFF')
+        steps = [
+            ('companies', self.companies), ('locations', self.locations), ('vlans', self.vlans),
+            ('subnets', self.subnet_rows), ('hosts', self.hosts), ('ips', self.ips),
+            ('dhcp', self.dhcp), ('audit_log', self.audit), ('misc', self.misc),
+        ]
+        for name, step in steps:
+            start = time.perf_counter()
+            step(db)
+            db.commit()
+            print(f'  {name:<10} {time.perf_counter() - start:7.2f}s', flush=True)
+        db.execute('ANALYZE')
+        db.commit()
+        db.close()
+
+    def companies(self, db):
+        self.company_ids = [self._id() for _ in range(self.counts['companies'])]
+        self._insert(db, 'companies', ('id', 'name', 'code', 'contact', 'email', 'color', 'createdAt', 'updatedAt'), (
+            (cid, f'Company {i}', f'C{i:03d}', f'Contact {i}', f'noc{i}@example.com',
+             f'#{self.rng.randrange(0xffffff):06x}', self._ts(), self._ts())
+            for i, cid in enumerate(self.company_ids)))
+
+    def locations(self, db):
+        self.location_ids = [self._id() for _ in range(max(4, self.counts['companies'] * 4))]
+        self._insert(db, 'locations', ('id', 'type', 'name', 'datacenter', 'building', 'room', 'rackUnits', 'createdAt', 'updatedAt'), (
+            (lid, 'rack', f'Rack {i}', f'DC{i % 5}', f'B{i % 3}', f'R{i % 7}', 42, self._ts(), self._ts())
+            for i, lid in enumerate(self.location_ids)))
+
+    def vlans(self, db):
+        self.vlan_ids = []
+        rows = []
+        for cid in self.company_ids:
+            for v in range(1, 21):
+                vid = self._id()
+                self.vlan_ids.append(vid)
+                rows.append((vid, v * 10, f'VLAN {v * 10}', self.rng.choice(VLAN_TYPES), cid, self._ts(), self._ts()))
+        self._insert(db, 'vlans', ('id', 'vlanId', 'name', 'type', 'companyId', 'createdAt', 'updatedAt'), rows)
+
+    def subnet_rows(self, db):
+        """Split one or more /8 supernets into /24 subnets spread over all companies."""
+        per_supernet = -(-self.counts['subnets'] // self.counts['supernets'])
+        rows = []
+        for s in range(self.counts['supernets']):
+            base = (10 + s) << 24
+            for k in range(min(per_supernet, 65536)):
+                if len(self.subnets) >= self.counts['subnets']:
+                    break
+                net = base + (k << 8)
+                sid = self._id()
+                self.subnets.append((sid, net, 24))
+                rows.append((sid, self.rng.choice(self.company_ids), _ip(net), 24, f'Subnet {_ip(net)}',
+                             self.rng.choice(self.vlan_ids), _ip(net + 1), '10.0.0.53,10.0.0.54',
+                             self._ts(), self._ts()))
+        self._insert(db, 'subnets', ('id', 'companyId', 'network', 'cidr', 'name', 'vlanId', 'gateway',
+                                     'dnsServers', 'createdAt', 'updatedAt'), rows)
+
+    def hosts(self, db):
+        rng = self.rng
+        self.host_ids = [self._id() for _ in range(self.counts['hosts'])]
+
+        def rows():
+            for i, hid in enumerate(self.host_ids):
+                mem = rng.choice((2, 4, 8, 16, 32, 64, 128))
+                disk = rng.choice((20, 40, 80, 160, 500, 1000))
+                yield (hid, rng.choice(self.company_ids), f'host-{i:06d}', rng.choice(HOST_TYPES),
+                       f'Synthetic host {i}', f'SN{rng.getrandbits(40):010X}', rng.choice(OPERATING_SYSTEMS),
+                       round(mem * rng.random(), 2), mem, mem, f'node{i % 64:02d}', disk,
+                       round(disk * rng.random(), 1), rng.choice(STATES), rng.choice((1, 2, 4, 8, 16)),
+                       rng.choice(VENDORS), rng.choice(self.location_ids), self._ts(), self._ts())
+        self._insert(db, 'hosts', ('id', 'companyId', 'vmName', 'hostType', 'description', 'serialNumber',
+                                   'operatingSystem', 'memoryUsedGB', 'memoryAvailableGB', 'memoryTotalGB',
+                                   'node', 'diskSizeGB', 'diskUsedGB', 'state', 'cpuCount', 'vendor',
+                                   'locationId', 'createdAt', 'updatedAt'), rows())
+
+    def ips(self, db):
+        """Fill subnets with host addresses; roughly 60% are assigned to a host."""
+        rng = self.rng
+        total = self.counts['ips']
+        per_subnet = max(1, min(254, -(-total // max(1, len(self.subnets)))))
+
+        def rows():
+            made = 0
+            for sid, net, _cidr in self.subnets:
+                for h in range(1, per_subnet + 1):
+                    if made >= total:
+                        return
+                    made += 1
+                    assigned = self.host_ids and rng.random() < 0.6
+                    yield (self._id(), _ip(net + h), sid, rng.choice(self.host_ids) if assigned else None,
+                           'assigned' if assigned else 'available',
+                           f'h{made}.example.internal' if assigned else None,
+                           ':'.join(f'{rng.randrange(256):02x}' for _ in range(6)) if assigned else None,
+                           self._ts(), self._ts())
+        self._insert(db, 'ips', ('id', 'ipAddress', 'subnetId', 'hostId', 'status', 'dnsName', 'macAddress',
+                                 'createdAt', 'updatedAt'), rows())
+
+    def dhcp(self, db):
+        rng = self.rng
+        scope_rows = []
+        for sid, net, _cidr in rng.sample(self.subnets, min(self.counts['scopes'], len(self.subnets))):
+            scope_id = self._id()
+            self.scope_ids.append((scope_id, net))
+            scope_rows.append((scope_id, f'Scope {_ip(net)}', sid, _ip(net + 100), _ip(net + 250), 86400,
+                               '10.0.0.53', _ip(net + 1), 'example.internal', 1, self._ts(), self._ts()))
+        self._insert(db, 'dhcp_scopes', ('id', 'name', 'subnetId', 'startIP', 'endIP', 'leaseTime', 'dns',
+                                         'gateway', 'domain', 'enabled', 'createdAt', 'updatedAt'), scope_rows)
+        if not self.scope_ids:
+            return
+
+        def leases():
+            for i in range(self.counts['leases']):
+                scope_id, net = self.scope_ids[i % len(self.scope_ids)]
+                start = self._ts()
+                yield (self._id(), scope_id, _ip(net + 100 + (i // len(self.scope_ids)) % 150),
+                       ':'.join(f'{rng.randrange(256):02x}' for _ in range(6)), f'client-{i}',
+                       rng.choice(('active', 'active', 'active', 'expired')), start, start, start, start)
+        self._insert(db, 'dhcp_leases', ('id', 'scopeId', 'ipAddress', 'macAddress', 'hostname', 'status',
+                                         'startTime', 'endTime', 'createdAt', 'updatedAt'), leases())
+
+    def audit(self, db):
+        rng = self.rng
+
+        def rows():
+            for i in range(self.counts['audit']):
+                entity = rng.choice(ENTITY_TYPES)
+                yield (self._id(), self._ts(), rng.choice(ACTIONS), entity, self._id(),
+                       f'Synthetic {entity} change {i}', None,
+                       json.dumps({'field': 'value', 'n': i}), f'user{i % 50}@example.com', f'User {i % 50}')
+        self._insert(db, 'audit_log', ('id', 'timestamp', 'action', 'entityType', 'entityId', 'details',
+                                       'oldValue', 'newValue', 'userId', 'userName'), rows())
+
+    def misc(self, db):
+        self._insert(db, 'subnet_templates', ('id', 'name', 'description', 'cidr', 'vlanType', 'ranges',
+                                              'reservations', 'isBuiltIn', 'isCustom', 'createdAt'), (
+            (self._id(), f'Branch office {i}', 'Synthetic template', 24, 'data',
+             json.dumps([{'name': 'Servers', 'start': 10, 'end': 50, 'purpose': 'servers'}]),
+             json.dumps([{'offset': 1, 'description': 'Gateway'}]), 0, 1, self._ts())
+            for i in range(6)))
+        self._insert(db, 'settings', ('key', 'value'), (
+            ('companyName', json.dumps('Benchmark Corp')), ('theme', json.dumps('dark'))))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generate a synthetic OpenIPAM database')
+    parser.add_argument('--scale', choices=sorted(SCALES), default='small')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--db', help='output path (default: benchmarks/data/openipam-<scale>.db)')
+    for key in SCALES['tiny']:
+        parser.add_argument(f'--{key}', type=int, help=f'override the number of {key}')
+    args = parser.parse_args(argv)
+
+    counts = dict(SCALES[args.scale])
+    for key in counts:
+        if getattr(args, key) is not None:
+            counts[key] = getattr(args, key)
+    path = args.db or default_db_path(args.scale)
+
+    print(f'Generating {args.scale} dataset (seed {args.seed}) -> {path}')
+    print('  ' + ', '.join(f'{k}={v}' for k, v in counts.items()))
+    start = time.perf_counter()
+    Generator(path, args.seed, counts).run()
+    size_mb = os.path.getsize(path) / 1048576
+    print(f'Done in {time.perf_counter() - start:.1f}s ({size_mb:.1f} MB)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,237 @@
+"""Endpoint benchmark harness driven through Flask's test client.
+
+Every GET route registered on the app is exercised (item routes with a real
+id from the dataset), followed by a create/update/delete cycle per entity
+blueprint. Results are p50/p99 latency, throughput and peak RSS per endpoint.
+
+    python -m benchmarks.harness --scale small --save benchmarks/baseline-small.json
+    python -m benchmarks.harness --scale small --compare benchmarks/baseline-small.json --threshold 0.25
+
+With --compare the process exits with status 1 when any endpoint regresses
+beyond the threshold.
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import sqlite3
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks import default_db_path  # noqa: E402
+
+# Destructive or non-data endpoints that must not run against the dataset
+SKIP_ENDPOINTS = {
+    'static', 'serve_index', 'serve_css', 'serve_modules', 'serve_static', 'prometheus_metrics',
+    # Server-Sent Events: the response never ends
+    'events.event_stream',
+    'backup.import_backup', 'backup.sync_table',
+    'audit_log.clear_audit_log', 'ip_history.clear_ip_history',
+}
+
+# Blueprint item routes -> table that supplies a sample id
+ITEM_TABLES = {
+    'companies': 'companies', 'subnets': 'subnets', 'hosts': 'hosts', 'ips': 'ips', 'vlans': 'vlans',
+    'ip_ranges': 'ip_ranges', 'locations': 'locations', 'maintenance': 'maintenance_windows',
+    'templates': 'subnet_templates', 'audit_log': 'audit_log', 'saved_filters': 'saved_filters',
+    'ip_history': 'ip_history', 'dhcp/scopes': 'dhcp_scopes', 'dhcp/leases': 'dhcp_leases',
+    'dhcp/reservations': 'dhcp_reservations',
+}
+
+# Payloads for the write cycle: collection path -> (create body, update body)
+WRITE_CYCLES = {
+    'companies': ({'name': 'Bench Co', 'code': 'BENCH'}, {'name': 'Bench Co 2'}),
+    'subnets': ({'network': '192.168.250.0', 'cidr': 24, 'name': 'bench'}, {'name': 'bench-2'}),
+    'hosts': ({'vmName': 'bench-host', 'state': 'running'}, {'state': 'stopped'}),
+    'ips': ({'ipAddress': '192.168.250.10', 'status': 'available'}, {'status': 'reserved'}),
+    'vlans': ({'vlanId': 4000, 'name': 'bench'}, {'name': 'bench-2'}),
+    'ip_ranges': ({'startIP': '192.168.250.10', 'endIP': '192.168.250.20'}, {'name': 'bench'}),
+    'locations': ({'name': 'Bench rack'}, {'name': 'Bench rack 2'}),
+    'maintenance': ({'title': 'bench window'}, {'title': 'bench window 2'}),
+    'templates': ({'name': 'bench template', 'cidr': 24}, {'name': 'bench template 2'}),
+    'saved_filters': ({'name': 'bench', 'page': 'hosts', 'filters': {}}, {'name': 'bench 2'}),
+    'dhcp/scopes': ({'name': 'bench', 'startIP': '192.168.250.100', 'endIP': '192.168.250.200'}, {'name': 'bench 2'}),
+    'dhcp/leases': ({'ipAddress': '192.168.250.101'}, {'status': 'expired'}),
+    'dhcp/reservations': ({'ipAddress': '192.168.250.102'}, {'hostname': 'bench'}),
+}
+
+BENCH_USER = {'email': 'bench@example.com', 'displayName': 'Benchmark'}
+# Absolute slack so sub-millisecond endpoints don't flap on scheduler noise
+NOISE_FLOOR_MS = 2.0
+
+
+def _peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1048576 if sys.platform == 'darwin' else 1024)
+
+
+def _percentile(samples, pct):
+    ordered = sorted(samples)
+    k = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * (len(ordered) - 1)))))
+    return ordered[k]
+
+
+class Harness:
+    def __init__(self, app, db_path, iterations, time_budget):
+        self.app = app
+        self.db_path = db_path
+        self.iterations = iterations
+        self.time_budget = time_budget
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess['user'] = BENCH_USER
+        self.results = {}
+
+    def _sample_id(self, table):
+        db = sqlite3.connect(self.db_path)
+        try:
+            row = db.execute(f'SELECT id FROM {table} LIMIT 1 OFFSET (SELECT COUNT(*) / 2 FROM {table})').fetchone()
+        finally:
+            db.close()
+        return row[0] if row else None
+
+    def measure(self, name, call):
+        samples = []
+        response_bytes = 0
+        deadline = time.perf_counter() + self.time_budget
+        for _ in range(self.iterations):
+            start = time.perf_counter()
+            resp = call()
+            body = resp.get_data()
+            samples.append((time.perf_counter() - start) * 1000)
+            response_bytes = len(body)
+            if resp.status_code >= 500:
+                raise RuntimeError(f'{name} returned {resp.status_code}')
+            if time.perf_counter() > deadline and len(samples) >= 3:
+                break
+        total_s = sum(samples) / 1000
+        self.results[name] = {
+            'p50_ms': round(_percentile(samples, 50), 3),
+            'p99_ms': round(_percentile(samples, 99), 3),
+            'throughput_rps': round(len(samples) / total_s, 2) if total_s else None,
+            'samples': len(samples),
+            'response_bytes': response_bytes,
+            'peak_rss_mb': round(_peak_rss_mb(), 1),
+        }
+        r = self.results[name]
+        print(f'  {name:<48} p50 {r["p50_ms"]:9.2f} ms  p99 {r["p99_ms"]:9.2f} ms  '
+              f'{r["throughput_rps"] or 0:9.1f} rps  {response_bytes / 1024:10.1f} KiB', flush=True)
+
+    def run_reads(self):
+        for rule in sorted(self.app.url_map.iter_rules(), key=lambda r: r.rule):
+            if rule.endpoint in SKIP_ENDPOINTS or 'GET' not in rule.methods:
+                continue
+            if not rule.rule.startswith('/api/'):
+                continue
+            path = rule.rule
+            if rule.arguments:
+                if rule.arguments != {'id'}:
+                    continue
+                collection = path[len('/api/v1/'):].rsplit('/', 1)[0]
+                table = ITEM_TABLES.get(collection)
+                sample = self._sample_id(table) if table else None
+                if not sample:
+                    continue
+                path = path.replace('<id>', sample)
+            elif rule.endpoint == 'search':
+                path += '?q=host-00'
+            self.measure(f'GET {rule.rule}', lambda p=path: self.client.get(p))
+
+    def run_writes(self):
+        for collection, (create_body, update_body) in WRITE_CYCLES.items():
+            base = f'/api/v1/{collection}'
+            created = []
+
+            def create(body=create_body):
+                resp = self.client.post(base, json=body)
+                created.append(resp.get_json().get('id'))
+                return resp
+
+            self.measure(f'POST {base}', create)
+            self.measure(f'PUT {base}/<id>', lambda: self.client.put(f'{base}/{created[0]}', json=update_body))
+            pending = list(created)
+            self.measure(f'DELETE {base}/<id>',
+                         lambda: self.client.delete(f'{base}/{pending.pop() if pending else created[0]}'))
+
+
+def compare(results, baseline, threshold):
+    """Return a list of regressions of p50/p99 latency beyond ``threshold`` (a fraction)."""
+    regressions = []
+    for name, base in baseline.get('endpoints', {}).items():
+        cur = results.get(name)
+        if not cur:
+            continue
+        for key in ('p50_ms', 'p99_ms'):
+            limit = base[key] * (1 + threshold) + NOISE_FLOOR_MS
+            if cur[key] > limit:
+                regressions.append(f'{name} {key}: {base[key]:.2f} -> {cur[key]:.2f} ms (limit {limit:.2f})')
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark every OpenIPAM endpoint')
+    parser.add_argument('--scale', default='small', help='dataset scale generated by benchmarks.generate')
+    parser.add_argument('--db', help='database path (default: benchmarks/data/openipam-<scale>.db)')
+    parser.add_argument('--iterations', type=int, default=30)
+    parser.add_argument('--time-budget', type=float, default=10.0, help='max seconds per endpoint')
+    parser.add_argument('--no-writes', action='store_true', help='skip the create/update/delete cycle')
+    parser.add_argument('--save', help='write results as a JSON baseline')
+    parser.add_argument('--compare', help='baseline JSON to compare against')
+    parser.add_argument('--threshold', type=float, default=0.25, help='allowed regression (0.25 = 25%%)')
+    args = parser.parse_args(argv)
+
+    db_path = os.path.abspath(args.db or default_db_path(args.scale))
+    if not os.path.exists(db_path):
+        parser.error(f'{db_path} does not exist; run python -m benchmarks.generate --scale {args.scale}')
+    os.environ['OPENIPAM_DB_PATH'] = db_path
+
+    import_start = time.perf_counter()
+    from app import app
+    import database
+    print(f'App import: {(time.perf_counter() - import_start) * 1000:.0f} ms; dataset {db_path}')
+
+    harness = Harness(app, db_path, args.iterations, args.time_budget)
+    wall = time.perf_counter()
+    harness.run_reads()
+    if not args.no_writes:
+        harness.run_writes()
+    report = {
+        'meta': {
+            'scale': args.scale,
+            'timestamp': datetime.utcnow().isoformat() + 'Z',
+            'python': platform.python_version(),
+            'engine': database.engine.name,
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'iterations': args.iterations,
+            'wall_seconds': round(time.perf_counter() - wall, 2),
+            'peak_rss_mb': round(_peak_rss_mb(), 1),
+        },
+        'endpoints': harness.results,
+    }
+    print(f'Peak RSS {report["meta"]["peak_rss_mb"]} MB, wall {report["meta"]["wall_seconds"]} s')
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print(f'Baseline written to {args.save}')
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(harness.results, baseline, args.threshold)
+        if regressions:
+            print(f'\n{len(regressions)} regression(s) beyond {args.threshold:.0%}:')
+            for line in regressions:
+                print(f'  {line}')
+            return 1
+        print(f'\nNo regressions beyond {args.threshold:.0%}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,327 @@
+"""Multi-client load simulator reproducing the browser's polling and sync pattern.
+
+Each simulated tab behaves like modules/db.js + modules/api.js in server mode:
+
+  * on load: GET /api/v1/health, then GET /api/v1/backup (DB._loadFromBackend)
+  * every 30 s and on every window focus: GET /api/v1/backup (DB._startAutoRefresh)
+  * on each edit: PUT /api/v1/sync/<table> with the whole table (DB._pushToBackend),
+    followed by PUT /api/v1/sync/audit_log with the last 500 audit entries (AuditLog.log)
+
+The number of clients is ramped through the stages given by --clients and the
+report shows throughput, tail latency and lock-contention errors per stage.
+
+    python -m benchmarks.loadsim --url http://127.0.0.1:5000 --secret-key "$FLASK_SECRET_KEY" \\
+        --clients 1,5,10,25,50 --duration 60 --time-scale 10
+
+--secret-key mints a signed-cookie session and so needs the server running with
+OPENIPAM_SESSION_BACKEND=cookie; with server-side sessions pass --cookie instead.
+
+WARNING: sync requests replace whole tables, exactly as the browser does. Run
+against a disposable database (see benchmarks.generate), never production.
+"""
+import argparse
+import json
+import random
+import re
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from datetime import datetime
+
+POLL_INTERVAL = 30.0
+AUDIT_MAX_ENTRIES = 500
+
+# Relative weight of the table touched by an edit, roughly matching UI usage
+EDIT_TABLES = {
+    'hosts': 30, 'ips': 30, 'subnets': 10, 'dhcp_leases': 8, 'dhcp_reservations': 4,
+    'companies': 3, 'vlans': 5, 'ip_ranges': 5, 'locations': 3, 'maintenance_windows': 2,
+}
+BACKUP_KEYS = {
+    'companies': 'companies', 'subnets': 'subnets', 'hosts': 'hosts', 'ips': 'ips', 'vlans': 'vlans',
+    'ip_ranges': 'ipRanges', 'locations': 'locations', 'maintenance_windows': 'maintenanceWindows',
+    'dhcp_leases': 'dhcpLeases', 'dhcp_reservations': 'dhcpReservations',
+}
+_LOCKED_RE = re.compile(rb'database is locked|database table is locked')
+_DB_ERRORS_RE = re.compile(r'^openipam_db_errors_total\{[^}]*error="OperationalError"[^}]*\}\s+(\S+)', re.M)
+
+
+def _percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))]
+
+
+class Snapshot:
+    """Shared, periodically refreshed copy of the server data used to build sync bodies.
+
+    Bodies are spliced from pre-serialized rows so the load generator does not
+    re-encode a million-row table for every simulated edit.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.lock = threading.Lock()
+        self.tables = {}
+        self.audit = []
+        self.refreshed = 0.0
+
+    def refresh(self):
+        status, body, _ = self.client.request('GET', '/api/v1/backup')
+        if status != 200:
+            raise RuntimeError(f'GET /api/v1/backup returned {status}')
+        backup = json.loads(body)
+        tables = {}
+        for table, key in BACKUP_KEYS.items():
+            rows = backup.get(key) or []
+            rest = ','.join(json.dumps(r) for r in rows[1:])
+            tables[table] = (rows[0] if rows else None, rest)
+        audit = [json.dumps(r) for r in (backup.get('auditLog') or [])[:AUDIT_MAX_ENTRIES - 1]]
+        with self.lock:
+            self.tables = tables
+            self.audit = audit
+            self.refreshed = time.monotonic()
+
+    def sync_body(self, table, user):
+        with self.lock:
+            first, rest = self.tables.get(table, (None, ''))
+        if first is None:
+            return None
+        row = dict(first)
+        now = datetime.utcnow().isoformat() + 'Z'
+        row['updatedAt'] = now
+        if 'description' in row:
+            row['description'] = f'edited by {user} at {now}'
+        head = json.dumps(row)
+        return ('{"data":[' + head + (',' + rest if rest else '') + ']}').encode()
+
+    def audit_body(self, user, table):
+        """New entry prepended to the newest entries, capped like AuditLog.log() does."""
+        with self.lock:
+            audit = self.audit
+        entry = {
+            'id': f'{random.getrandbits(48):012x}', 'timestamp': datetime.utcnow().isoformat() + 'Z',
+            'action': 'update', 'entityType': table, 'entityId': '', 'details': f'{user} edited {table}',
+            'userId': user, 'userName': user,
+        }
+        return ('{"data":[' + ','.join([json.dumps(entry)] + audit) + ']}').encode()
+
+
+class HttpClient:
+    def __init__(self, base_url, cookie, timeout):
+        self.base_url = base_url.rstrip('/')
+        self.cookie = cookie
+        self.timeout = timeout
+
+    def request(self, method, path, body=None):
+        req = urllib.request.Request(self.base_url + path, data=body, method=method)
+        if body is not None:
+            req.add_header('Content-Type', 'application/json')
+        if self.cookie:
+            req.add_header('Cookie', self.cookie)
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+                data = resp.read()
+                status = resp.status
+        except urllib.error.HTTPError as e:
+            data = e.read()
+            status = e.code
+        except (urllib.error.URLError, OSError) as e:
+            data = str(e).encode()
+            status = 0
+        return status, data, time.perf_counter() - start
+
+
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+        self.locked = 0
+        self.bytes = 0
+        self.count = 0
+
+    def record(self, kind, status, data, elapsed):
+        with self.lock:
+            self.count += 1
+            self.bytes += len(data)
+            self.latencies.setdefault(kind, []).append(elapsed * 1000)
+            if status == 0 or status >= 400:
+                key = f'{kind}:{status or "conn"}'
+                self.errors[key] = self.errors.get(key, 0) + 1
+                if _LOCKED_RE.search(data):
+                    self.locked += 1
+
+
+class SimulatedTab(threading.Thread):
+    def __init__(self, index, client, snapshot, stats, args, stop):
+        super().__init__(daemon=True, name=f'tab-{index}')
+        self.user = f'loadsim{index}@example.com'
+        self.client = client
+        self.snapshot = snapshot
+        self.stats = stats
+        self.stop = stop
+        self.rng = random.Random(args.seed + index)
+        self.poll = POLL_INTERVAL / args.time_scale
+        self.focus_rate = args.focus_per_min * args.time_scale / 60.0
+        self.edit_rate = args.edits_per_min * args.time_scale / 60.0
+        self.tables = list(EDIT_TABLES)
+        self.weights = [EDIT_TABLES[t] for t in self.tables]
+
+    def _call(self, kind, method, path, body=None):
+        status, data, elapsed = self.client.request(method, path, body)
+        self.stats.record(kind, status, data, elapsed)
+
+    def _next(self, rate):
+        return time.monotonic() + (self.rng.expovariate(rate) if rate > 0 else 1e12)
+
+    def run(self):
+        self._call('health', 'GET', '/api/v1/health')
+        self._call('load', 'GET', '/api/v1/backup')
+        now = time.monotonic()
+        next_poll = now + self.rng.uniform(0, self.poll)
+        next_focus = self._next(self.focus_rate)
+        next_edit = self._next(self.edit_rate)
+        while not self.stop.is_set():
+            wake = min(next_poll, next_focus, next_edit)
+            if self.stop.wait(max(0.0, wake - time.monotonic())):
+                break
+            now = time.monotonic()
+            if now >= next_poll:
+                self._call('poll', 'GET', '/api/v1/backup')
+                next_poll = now + self.poll
+            if now >= next_focus:
+                self._call('focus', 'GET', '/api/v1/backup')
+                next_focus = self._next(self.focus_rate)
+            if now >= next_edit:
+                table = self.rng.choices(self.tables, self.weights)[0]
+                body = self.snapshot.sync_body(table, self.user)
+                if body is not None:
+                    self._call('sync', 'PUT', f'/api/v1/sync/{table}', body)
+                    self._call('sync-audit', 'PUT', '/api/v1/sync/audit_log', self.snapshot.audit_body(self.user, table))
+                next_edit = self._next(self.edit_rate)
+
+
+def _server_lock_errors(client):
+    status, data, _ = client.request('GET', '/metrics')
+    if status != 200:
+        return None
+    return sum(float(v) for v in _DB_ERRORS_RE.findall(data.decode('utf-8', 'replace')))
+
+
+def run_stage(n, client, snapshot, args):
+    stats = Stats()
+    stop = threading.Event()
+    server_errors_before = _server_lock_errors(client)
+    tabs = [SimulatedTab(i, client, snapshot, stats, args, stop) for i in range(n)]
+    start = time.perf_counter()
+    for tab in tabs:
+        tab.start()
+        time.sleep(args.ramp_delay)
+    deadline = start + args.duration
+    while time.perf_counter() < deadline:
+        time.sleep(max(0.0, min(1.0, deadline - time.perf_counter())))
+        if time.monotonic() - snapshot.refreshed > args.snapshot_refresh:
+            try:
+                snapshot.refresh()
+            except Exception as e:
+                print(f'  snapshot refresh failed: {e}', file=sys.stderr)
+    stop.set()
+    for tab in tabs:
+        tab.join(timeout=args.timeout)
+    elapsed = time.perf_counter() - start
+    server_errors_after = _server_lock_errors(client)
+
+    all_latencies = [v for vals in stats.latencies.values() for v in vals]
+    result = {
+        'clients': n,
+        'requests': stats.count,
+        'throughput_rps': round(stats.count / elapsed, 2),
+        'mb_transferred': round(stats.bytes / 1048576, 2),
+        'p50_ms': round(_percentile(all_latencies, 50), 1),
+        'p99_ms': round(_percentile(all_latencies, 99), 1),
+        'max_ms': round(max(all_latencies), 1) if all_latencies else 0.0,
+        'errors': dict(stats.errors),
+        'lock_errors_client': stats.locked,
+        'lock_errors_server': (None if server_errors_before is None or server_errors_after is None
+                               else int(server_errors_after - server_errors_before)),
+        'by_kind': {
+            kind: {'count': len(v), 'p50_ms': round(_percentile(v, 50), 1),
+                   'p95_ms': round(_percentile(v, 95), 1), 'p99_ms': round(_percentile(v, 99), 1)}
+            for kind, v in sorted(stats.latencies.items())
+        },
+    }
+    return result
+
+
+def _print_stage(r):
+    lock_server = '-' if r['lock_errors_server'] is None else r['lock_errors_server']
+    errors = sum(r['errors'].values())
+    print(f'{r["clients"]:>7} {r["requests"]:>9} {r["throughput_rps"]:>9.1f} {r["p50_ms"]:>9.1f} '
+          f'{r["p99_ms"]:>9.1f} {r["max_ms"]:>9.1f} {errors:>7} {r["lock_errors_client"]:>6}/{lock_server:<6} '
+          f'{r["mb_transferred"]:>9.1f}')
+    for kind, k in r['by_kind'].items():
+        print(f'          {kind:<11} n={k["count"]:<7} p50 {k["p50_ms"]:8.1f}  p95 {k["p95_ms"]:8.1f}  p99 {k["p99_ms"]:8.1f} ms')
+
+
+def session_cookie(secret_key):
+    """Sign a session cookie the same way the app does so the auth gate lets us through."""
+    from flask import Flask
+    from flask.sessions import SecureCookieSessionInterface
+    app = Flask('loadsim')
+    app.secret_key = secret_key
+    serializer = SecureCookieSessionInterface().get_signing_serializer(app)
+    value = serializer.dumps({'user': {'email': 'loadsim@example.com', 'displayName': 'Load simulator'},
+                              '_permanent': True})
+    return f'{app.config["SESSION_COOKIE_NAME"]}={value}'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Simulate N concurrent OpenIPAM browser tabs')
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--clients', default='1,5,10,25', help='comma-separated client counts, one stage each')
+    parser.add_argument('--duration', type=float, default=60.0, help='seconds per stage')
+    parser.add_argument('--time-scale', type=float, default=1.0,
+                        help='compress browser timers (10 = poll every 3 s instead of 30 s)')
+    parser.add_argument('--edits-per-min', type=float, default=2.0, help='edits per tab per (scaled) minute')
+    parser.add_argument('--focus-per-min', type=float, default=1.0, help='focus events per tab per (scaled) minute')
+    parser.add_argument('--ramp-delay', type=float, default=0.05, help='seconds between starting tabs')
+    parser.add_argument('--snapshot-refresh', type=float, default=30.0)
+    parser.add_argument('--timeout', type=float, default=60.0)
+    parser.add_argument('--seed', type=int, default=1)
+    auth = parser.add_mutually_exclusive_group()
+    auth.add_argument('--cookie', help='raw Cookie header of a logged-in session')
+    auth.add_argument('--secret-key', help="server's FLASK_SECRET_KEY, used to mint a session cookie "
+                                           "(requires OPENIPAM_SESSION_BACKEND=cookie on the server)")
+    parser.add_argument('--json', help='write the per-stage report to this file')
+    args = parser.parse_args(argv)
+
+    cookie = args.cookie or (session_cookie(args.secret_key) if args.secret_key else None)
+    client = HttpClient(args.url, cookie, args.timeout)
+    status, _, _ = client.request('GET', '/api/v1/health')
+    if status != 200:
+        parser.error(f'{args.url} is not reachable (health returned {status})')
+    snapshot = Snapshot(client)
+    snapshot.refresh()
+
+    stages = [int(n) for n in args.clients.split(',') if n.strip()]
+    print(f'{"clients":>7} {"requests":>9} {"rps":>9} {"p50 ms":>9} {"p99 ms":>9} {"max ms":>9} '
+          f'{"errors":>7} {"locked c/s":>13} {"MB":>9}')
+    results = []
+    for n in stages:
+        result = run_stage(n, client, snapshot, args)
+        results.append(result)
+        _print_stage(result)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'url': args.url, 'time_scale': args.time_scale, 'duration': args.duration,
+                       'stages': results}, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,121 @@
+"""Cold-start profile of a backend worker.
+
+Each run starts a fresh interpreter with ``-X importtime``, imports the app
+module, calls create_app() and serves the first /api/v1/ready request through
+the test client, the way a new container or worker does. The first run
+against an empty database includes creating the schema; the following runs
+find the schema version in place and skip it. The report lists the phase
+timings and the slowest imports by cumulative time.
+
+    python -m benchmarks.startup --save benchmarks/startup-baseline.json
+    python -m benchmarks.startup --runs 5 --top 15
+"""
+import argparse
+import json
+import os
+import platform
+import re
+import subprocess
+import sys
+import tempfile
+from datetime import datetime
+from statistics import median
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in the child interpreter and prints its phase timings as JSON
+CHILD = '''
+import json, sys, time
+t0 = time.perf_counter()
+import app as module
+t1 = time.perf_counter()
+app = module.create_app()
+t2 = time.perf_counter()
+status = app.test_client().get('/api/v1/ready').status_code
+t3 = time.perf_counter()
+print(json.dumps({'import_ms': (t1 - t0) * 1000, 'create_app_ms': (t2 - t1) * 1000,
+                  'first_request_ms': (t3 - t2) * 1000, 'ready_status': status,
+                  'saml_loaded': 'onelogin' in sys.modules}))
+'''
+
+# import time: self [us] | cumulative | imported package
+IMPORTTIME_RE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)')
+
+
+def parse_importtime(stderr):
+    """{module: cumulative microseconds} for every import reported by -X importtime."""
+    modules = {}
+    for line in stderr.splitlines():
+        m = IMPORTTIME_RE.match(line)
+        if m:
+            modules[m.group(4)] = int(m.group(2))
+    return modules
+
+
+def run_once(db_path):
+    env = dict(os.environ, OPENIPAM_DB_PATH=db_path)
+    start = datetime.now()
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', CHILD], cwd=BACKEND_DIR, env=env,
+                          capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f'startup failed:\n{proc.stderr[-2000:]}')
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    result['process_ms'] = (datetime.now() - start).total_seconds() * 1000
+    result['imports'] = parse_importtime(proc.stderr)
+    return result
+
+
+def summarize(runs, top):
+    phases = ('import_ms', 'create_app_ms', 'first_request_ms', 'process_ms')
+    summary = {phase: round(median(r[phase] for r in runs), 1) for phase in phases}
+    imports = {}
+    for run in runs:
+        for module, us in run['imports'].items():
+            imports.setdefault(module, []).append(us)
+    slowest = sorted(((median(v) / 1000, k) for k, v in imports.items()), reverse=True)[:top]
+    summary['slowest_imports_ms'] = {module: round(ms, 1) for ms, module in slowest}
+    summary['saml_loaded'] = any(r['saml_loaded'] for r in runs)
+    summary['ready_status'] = runs[-1]['ready_status']
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Profile OpenIPAM worker start-up')
+    parser.add_argument('--runs', type=int, default=5, help='warm starts to take the median of')
+    parser.add_argument('--top', type=int, default=15, help='slowest imports to report')
+    parser.add_argument('--db', help='database to start against (default: a fresh temporary one)')
+    parser.add_argument('--save', help='write the report as JSON')
+    args = parser.parse_args(argv)
+
+    db_path = args.db or os.path.join(tempfile.mkdtemp(prefix='openipam-startup-'), 'openipam.db')
+    cold = run_once(db_path)
+    warm = [run_once(db_path) for _ in range(args.runs)]
+
+    report = {
+        'meta': {
+            'timestamp': datetime.utcnow().isoformat() + 'Z',
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'runs': args.runs,
+        },
+        'first_start': summarize([cold], args.top),
+        'warm_start': summarize(warm, args.top),
+    }
+
+    for label in ('first_start', 'warm_start'):
+        s = report[label]
+        print(f'{label:12s} import {s["import_ms"]:7.1f} ms  create_app {s["create_app_ms"]:6.1f} ms  '
+              f'first request {s["first_request_ms"]:6.1f} ms  process {s["process_ms"]:7.1f} ms')
+    print(f'\nSlowest imports (warm, cumulative ms; SAML loaded: {report["warm_start"]["saml_loaded"]}):')
+    for module, ms in report['warm_start']['slowest_imports_ms'].items():
+        print(f'  {ms:8.1f}  {module}')
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print(f'\nReport written to {args.save}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
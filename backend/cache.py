@@ -0,0 +1,149 @@
+"""Versioned read-through cache for GET responses.
+
+Views decorated with ``@cached('subnets', ...)`` name the tables they read. The
+first request runs the view and keeps the encoded body together with the
+versions those tables had (events.ChangeBus.versions); later requests with the
+same path, query string, company scope and response format are answered with a
+copy of the stored bytes for as long as none of the tables has been written.
+Every commit publishes its tables to the change bus, which bumps their
+versions, so the blueprints, table syncs, backup imports and snapshot restores
+all invalidate the cache without knowing about it. Versions are captured before
+the view runs: a write that lands while a response is being built leaves that
+entry stale rather than wrongly current.
+
+Bodies are held in an LRU bounded by their total size (VersionedCache, also
+used for saved filter results, see filters.py). Like the change bus the
+cache is per process: with several SQLite worker processes a worker only sees
+its own writes, so run threaded workers there (or disable the cache); on
+PostgreSQL, NOTIFY bumps the versions on every node.
+
+OPENIPAM_RESPONSE_CACHE_MB      memory for cached bodies per process (default 64; 0 disables)
+"""
+import functools
+import os
+import threading
+from collections import OrderedDict
+from flask import Response, current_app, request
+
+import events
+import formats
+import metrics
+import shards
+
+MAX_BYTES = int(float(os.environ.get('OPENIPAM_RESPONSE_CACHE_MB', 64)) * 1024 * 1024)
+ENABLED = MAX_BYTES > 0
+# A single body may use at most this share of the cache, so one huge list can't flush everything else
+MAX_ENTRY_SHARE = 0.25
+# Rough per-entry cost of the key, headers and bookkeeping on top of the body
+ENTRY_OVERHEAD = 512
+
+cache_lookups = metrics.Counter('openipam_response_cache_lookups_total', 'Cacheable GET requests by result',
+                                ('view', 'result'))
+cache_bytes = metrics.Gauge('openipam_cache_bytes', 'Bytes held by the versioned caches', ('cache',))
+# Every VersionedCache, for the statistics endpoint
+CACHES = []
+
+
+class VersionedCache:
+    """LRU of values tagged with the table versions they were built at, bounded by total size."""
+
+    def __init__(self, name, max_bytes):
+        self.name = name
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # key -> (versions, value, size)
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.evictions = 0
+        CACHES.append(self)
+
+    def get(self, key, versions):
+        """The value stored for ``key`` if it was built at ``versions``, else None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[0] != versions:
+                self.stale += 1
+                self._drop(key)
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, versions, value, size):
+        size += ENTRY_OVERHEAD
+        if size > self.max_bytes * MAX_ENTRY_SHARE:
+            return False
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (versions, value, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, old = self._entries.popitem(last=False)
+                self.bytes -= old[2]
+                self.evictions += 1
+            cache_bytes.set(self.bytes, (self.name,))
+        return True
+
+    def _drop(self, key):
+        self.bytes -= self._entries.pop(key)[2]
+        cache_bytes.set(self.bytes, (self.name,))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+            cache_bytes.set(0, (self.name,))
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses + self.stale
+            return {
+                'enabled': ENABLED,
+                'entries': len(self._entries),
+                'bytes': self.bytes,
+                'maxBytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'stale': self.stale,
+                'evictions': self.evictions,
+                'hitRatio': round(self.hits / lookups, 4) if lookups else None,
+            }
+
+
+store = VersionedCache('responses', MAX_BYTES)
+
+
+def _key():
+    return (request.path, request.query_string, shards.request_scope(), formats.msgpack_accepted())
+
+
+def cached(*tables):
+    """Serve a GET view from the cache while none of ``tables`` has been written."""
+    def decorator(view):
+        name = view.__name__
+
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return view(*args, **kwargs)
+            key = _key()
+            versions = events.bus.versions(tables)
+            entry = store.get(key, versions)
+            if entry is not None:
+                cache_lookups.inc((name, 'hit'))
+                status, headers, body = entry
+                return Response(body, status, headers)
+            cache_lookups.inc((name, 'miss'))
+            response = current_app.make_response(view(*args, **kwargs))
+            if response.status_code == 200 and not response.is_streamed:
+                body = response.get_data()
+                store.put(key, versions, (response.status_code, list(response.headers.items()), body), len(body))
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,130 @@
+"""In-process change bus feeding the /api/v1/events Server-Sent Events stream.
+
+Database connections publish the set of tables written by each commit (see
+database.Connection.commit). Publications are coalesced per table over a
+100 ms window into a single numbered event kept in a bounded history, which
+is what allows EventSource clients to resume with Last-Event-ID.
+
+Every publication also bumps a per-table version counter straight away, before
+the coalescing window; the response cache (cache.py) compares these counters to
+tell whether a table changed since a response was stored.
+
+The bus is per process: with several SQLite worker processes each one only sees
+its own commits, so run the stream on threaded workers or pin clients to a
+worker. The PostgreSQL engine instead relays commits through LISTEN/NOTIFY, so
+every node's bus sees every write.
+"""
+import json
+import os
+import threading
+import time
+from collections import deque
+from flask import has_request_context, request
+
+COALESCE_WINDOW = 0.1
+HISTORY_SIZE = 1024
+ORIGIN_HEADER = 'X-OpenIPAM-Client'
+# Bookkeeping tables, and tables written too often to be worth a reload in every open tab
+# (integrity.py, host_metrics.py):
+# their publications still bump the cache versions, but emit no change event
+QUIET_TABLES = set()
+
+
+class ChangeBus:
+    def __init__(self, window=COALESCE_WINDOW, history=HISTORY_SIZE):
+        self.window = window
+        # Distinguishes event ids issued by this process from those of a previous run
+        self.boot = f'{os.getpid():x}{int(time.time()):x}'
+        self._cond = threading.Condition()
+        self._pending = {}            # table -> set of origins
+        self._history = deque(maxlen=history)   # (seq, data)
+        self._seq = 0
+        self._flusher = None
+        self._versions = {}           # table -> number of publications
+
+    def touch(self, tables):
+        """Bump the version of each table without emitting an event."""
+        with self._cond:
+            for table in tables:
+                self._versions[table] = self._versions.get(table, 0) + 1
+
+    def versions(self, tables):
+        """Current versions of ``tables``, in order."""
+        return tuple(self._versions.get(table, 0) for table in tables)
+
+    def publish(self, tables, origin=None):
+        if not tables:
+            return
+        with self._cond:
+            self.touch(tables)
+            tables = [table for table in tables if table not in QUIET_TABLES]
+            if not tables:
+                return
+            for table in tables:
+                self._pending.setdefault(table, set()).add(origin or '')
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_loop, name='openipam-events', daemon=True)
+                self._flusher.start()
+            self._cond.notify_all()
+
+    def _flush_loop(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+            # Let further writes in this window join the same event
+            time.sleep(self.window)
+            with self._cond:
+                pending, self._pending = self._pending, {}
+                origins = set().union(*pending.values())
+                self._seq += 1
+                # 'anonymous' marks writes from callers that sent no client id
+                data = json.dumps({'tables': sorted(pending), 'origins': sorted(origins - {''}),
+                                   'anonymous': '' in origins})
+                self._history.append((self._seq, data))
+                self._cond.notify_all()
+
+    def event_id(self, seq):
+        return f'{self.boot}:{seq}'
+
+    def resume_point(self, last_event_id):
+        """Sequence number to resume after, or None when the client must do a full refresh."""
+        if not last_event_id:
+            return self._seq
+        boot, _, seq = last_event_id.partition(':')
+        if boot != self.boot or not seq.isdigit():
+            return None
+        seq = int(seq)
+        with self._cond:
+            oldest = self._history[0][0] if self._history else self._seq + 1
+            if seq > self._seq or seq < oldest - 1:
+                return None
+        return seq
+
+    def wait(self, after, timeout):
+        """Events with a sequence number above ``after``; empty list on timeout."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self._seq <= after:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return []
+                self._cond.wait(remaining)
+            return [(seq, data) for seq, data in self._history if seq > after]
+
+    @property
+    def last_seq(self):
+        return self._seq
+
+
+bus = ChangeBus()
+
+
+def current_origin():
+    """Client id sent by the browser tab making the current request, if any."""
+    return request.headers.get(ORIGIN_HEADER) if has_request_context() else None
+
+
+def publish(tables):
+    """Publish tables changed by a commit, tagged with the requesting client when known."""
+    bus.publish(tables, current_origin())
@@ -0,0 +1,327 @@
+"""Saved filter grammar, compiled to SQL and run on the server.
+
+A saved filter's ``filters`` is either the page state the browser saves
+(``{"search": "web", "state": "running", "company": "<id>"}``) or a typed filter:
+
+    {"match": "all",                                  # or "any"
+     "conditions": [
+         {"field": "state", "op": "eq", "value": "running"},
+         {"field": "ipAddress", "op": "in_cidr", "value": "10.20.0.0/16"},
+         {"field": "warrantyExpiry", "op": "between", "value": ["2026-01-01", "2026-06-30"]}]}
+
+Both compile to a WHERE clause over the table behind the filter's page (hosts,
+ipam -> ips, vlans). Field names come from the whitelist below and values are
+always bound as parameters. CIDR containment goes through the engine's
+address_in_network(): a range on the indexed ipInt column for IPv4 on SQLite,
+the GiST index on PostgreSQL.
+
+The ids matching a filter are memoized per filter version and sort order in a
+VersionedCache tagged with the versions of the tables the filter reads, so
+paging through a result only re-runs the query after one of them was written.
+"""
+import ipaddress
+from datetime import date, datetime, timedelta
+
+import cache
+import events
+import shards
+from database import get_db
+
+TEXT, ID, NUMBER, DATE, ADDRESS = 'text', 'id', 'number', 'date', 'address'
+
+OPERATORS = {
+    TEXT: {'eq', 'ne', 'in', 'contains', 'startswith', 'empty', 'notempty'},
+    ID: {'eq', 'ne', 'in', 'empty', 'notempty'},
+    NUMBER: {'eq', 'ne', 'lt', 'lte', 'gt', 'gte', 'between', 'in', 'empty', 'notempty'},
+    DATE: {'before', 'after', 'between', 'within_days', 'empty', 'notempty'},
+    ADDRESS: {'eq', 'in_cidr', 'not_in_cidr', 'empty', 'notempty'},
+}
+NEGATED = {'ne': 'eq', 'not_in_cidr': 'in_cidr'}
+COMPARISONS = {'lt': '<', 'lte': '<=', 'gt': '>', 'gte': '>='}
+MAX_IN_VALUES = 1000
+
+# table -> field -> (type, column); hosts.ipAddress matches hosts with any such IP
+FIELDS = {
+    'hosts': {
+        'vmName': (TEXT, 'vmName'), 'hostType': (TEXT, 'hostType'), 'state': (TEXT, 'state'),
+        'operatingSystem': (TEXT, 'operatingSystem'), 'node': (TEXT, 'node'),
+        'description': (TEXT, 'description'), 'serialNumber': (TEXT, 'serialNumber'),
+        'vendor': (TEXT, 'vendor'), 'model': (TEXT, 'model'), 'assetTag': (TEXT, 'assetTag'),
+        'lifecycleStatus': (TEXT, 'lifecycleStatus'), 'location': (TEXT, 'location'),
+        'id': (ID, 'id'), 'companyId': (ID, 'companyId'), 'locationId': (ID, 'locationId'),
+        'cpuCount': (NUMBER, 'cpuCount'), 'memoryTotalGB': (NUMBER, 'memoryTotalGB'),
+        'memoryUsedGB': (NUMBER, 'memoryUsedGB'), 'diskSizeGB': (NUMBER, 'diskSizeGB'),
+        'diskUsedGB': (NUMBER, 'diskUsedGB'), 'favorite': (NUMBER, 'favorite'),
+        'purchaseDate': (DATE, 'purchaseDate'), 'warrantyExpiry': (DATE, 'warrantyExpiry'),
+        'eolDate': (DATE, 'eolDate'), 'createdAt': (DATE, 'createdAt'), 'updatedAt': (DATE, 'updatedAt'),
+        'ipAddress': (ADDRESS, 'ipAddress'),
+    },
+    'ips': {
+        'ipAddress': (ADDRESS, 'ipAddress'), 'status': (TEXT, 'status'),
+        'reservationType': (TEXT, 'reservationType'), 'reservationDescription': (TEXT, 'reservationDescription'),
+        'dnsName': (TEXT, 'dnsName'), 'macAddress': (TEXT, 'macAddress'),
+        'id': (ID, 'id'), 'subnetId': (ID, 'subnetId'), 'hostId': (ID, 'hostId'),
+        'createdAt': (DATE, 'createdAt'), 'updatedAt': (DATE, 'updatedAt'),
+    },
+    'vlans': {
+        'name': (TEXT, 'name'), 'description': (TEXT, 'description'), 'type': (TEXT, 'type'),
+        'id': (ID, 'id'), 'companyId': (ID, 'companyId'), 'vlanId': (NUMBER, 'vlanId'),
+        'createdAt': (DATE, 'createdAt'), 'updatedAt': (DATE, 'updatedAt'),
+    },
+}
+# Columns searched by the ``search`` pseudo-field (the page search box)
+SEARCH_COLUMNS = {
+    'hosts': ('vmName', 'operatingSystem', 'description', 'serialNumber', 'node'),
+    'ips': ('ipAddress', 'dnsName', 'macAddress', 'reservationDescription'),
+    'vlans': ('name', 'description'),
+}
+PAGE_TABLES = {'hosts': 'hosts', 'ipam': 'ips', 'vlans': 'vlans'}
+# Page state saved by the browser (see modules/saved-filters.js) -> typed field
+PAGE_STATE = {
+    'hosts': {'state': 'state', 'company': 'companyId', 'type': 'hostType'},
+    'ipam': {'subnet': 'subnetId', 'status': 'status'},
+    'vlans': {'type': 'type', 'company': 'companyId'},
+}
+
+results_cache = cache.VersionedCache('saved_filter_results', cache.MAX_BYTES // 4)
+
+
+class FilterError(Exception):
+    pass
+
+
+def column_of(table, field):
+    """Whether ``field`` is a real column of ``table`` (hosts.ipAddress is matched through ips)."""
+    return field in FIELDS[table] and not (table == 'hosts' and field == 'ipAddress')
+
+
+def _like_escape(value):
+    return str(value).replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def _number(value):
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        raise FilterError(f'Expected a number, got {value!r}')
+    try:
+        return float(value) if isinstance(value, str) and not value.lstrip('-').isdigit() else int(value)
+    except ValueError:
+        raise FilterError(f'Expected a number, got {value!r}')
+
+
+def _date_bounds(value):
+    """(start, end) of a date or timestamp as comparable ISO strings; ``end`` is exclusive."""
+    if not isinstance(value, str):
+        raise FilterError(f'Expected an ISO date, got {value!r}')
+    try:
+        if len(value) == 10:
+            day = date.fromisoformat(value)
+            return day.isoformat(), (day + timedelta(days=1)).isoformat()
+        datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        raise FilterError(f'Expected an ISO date, got {value!r}')
+    return value, value
+
+
+def _network(value):
+    try:
+        return ipaddress.ip_network(str(value), strict=False)
+    except ValueError:
+        raise FilterError(f'Invalid network: {value!r}')
+
+
+def _scalar(value):
+    """A single string or number; lists and objects only go with in and between."""
+    if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+        raise FilterError(f'Expected a string or a number, got {value!r}')
+    return value
+
+
+def _pair(value):
+    if not isinstance(value, (list, tuple)) or len(value) != 2:
+        raise FilterError('between expects [from, to]')
+    return value
+
+
+def _values(value):
+    if not isinstance(value, (list, tuple)) or not value or len(value) > MAX_IN_VALUES:
+        raise FilterError(f'in expects a list of 1 to {MAX_IN_VALUES} values')
+    return [_scalar(v) for v in value]
+
+
+def _compare(db, alias, kind, column, op, value):
+    """SQL (and parameters) for one positive condition on ``alias.column``."""
+    col = f'{alias}.{column}'
+    if op == 'empty':
+        return (f"({col} IS NULL OR {col} = '')" if kind in (TEXT, ID, DATE, ADDRESS)
+                else f'{col} IS NULL'), []
+    if op == 'notempty':
+        return (f"({col} IS NOT NULL AND {col} <> '')" if kind in (TEXT, ID, DATE, ADDRESS)
+                else f'{col} IS NOT NULL'), []
+    if op == 'in':
+        values = _values(value)
+        if kind == NUMBER:
+            values = [_number(v) for v in values]
+        return f'{col} IN ({",".join("?" * len(values))})', [v if kind == NUMBER else str(v) for v in values]
+    if kind == TEXT:
+        if op == 'eq':
+            # LIKE without wildcards: case-insensitive equality, like the browser's filters
+            return f"{col} LIKE ? ESCAPE '\\'", [_like_escape(value)]
+        if op == 'contains':
+            return f"{col} LIKE ? ESCAPE '\\'", [f'%{_like_escape(value)}%']
+        return f"{col} LIKE ? ESCAPE '\\'", [f'{_like_escape(value)}%']
+    if kind == ID:
+        return f'{col} = ?', [str(value)]
+    if kind == NUMBER:
+        if op == 'between':
+            low, high = _pair(value)
+            return f'{col} BETWEEN ? AND ?', [_number(low), _number(high)]
+        return f'{col} {COMPARISONS.get(op, "=")} ?', [_number(value)]
+    if kind == DATE:
+        if op == 'before':
+            return f'{col} < ?', [_date_bounds(value)[0]]
+        if op == 'after':
+            return f'{col} >= ?', [_date_bounds(value)[1]]
+        if op == 'within_days':
+            days = _number(value)
+            today = datetime.utcnow().date()
+            low, high = sorted((today, today + timedelta(days=days)))
+            value = [low.isoformat(), high.isoformat()]
+        low, high = _pair(value)
+        return f'({col} >= ? AND {col} < ?)', [_date_bounds(low)[0], _date_bounds(high)[1]]
+    # ADDRESS
+    if op == 'eq':
+        return f'{col} = ?', [str(value)]
+    return db.address_in_network(alias, column, _network(value))
+
+
+def _condition(db, table, alias, condition):
+    """SQL, parameters and tables read for one typed condition."""
+    if not isinstance(condition, dict):
+        raise FilterError('Each condition must be an object')
+    field, op, value = condition.get('field'), condition.get('op', 'eq'), condition.get('value')
+    if field == 'search':
+        if value is not None:
+            _scalar(value)
+        columns = SEARCH_COLUMNS[table]
+        pattern = f'%{_like_escape(value or "")}%'
+        sql = ' OR '.join(f"{alias}.{c} LIKE ? ESCAPE '\\'" for c in columns)
+        return f'({sql})', [pattern] * len(columns), {table}
+    if field not in FIELDS[table]:
+        raise FilterError(f'Unknown field for {table}: {field}')
+    kind, column = FIELDS[table][field]
+    if op not in OPERATORS[kind]:
+        raise FilterError(f'Operator {op} does not apply to {field} ({kind})')
+    if value is None and op not in ('empty', 'notempty'):
+        raise FilterError(f'Missing value for {field}')
+    if op not in ('in', 'between', 'empty', 'notempty'):
+        _scalar(value)
+    positive = NEGATED.get(op, op)
+    tables = {table}
+    if table == 'hosts' and kind == ADDRESS:
+        # Hosts have no address column of their own: match through their IPs (indexed on hostId)
+        sql, parameters = _compare(db, 'fi', kind, column, positive, value)
+        sql = f'EXISTS (SELECT 1 FROM ips fi WHERE fi.hostId = {alias}.id AND {sql})'
+        tables.add('ips')
+    else:
+        sql, parameters = _compare(db, alias, kind, column, positive, value)
+    if positive != op:
+        # Unlike NOT, also true where the condition is NULL (e.g. ne on a row without a value)
+        sql = f'({sql}) IS NOT TRUE'
+    return sql, parameters, tables
+
+
+def conditions(page, spec):
+    """The typed conditions and match mode of a saved filter's ``filters`` value."""
+    if spec is None:
+        return [], 'all'
+    if not isinstance(spec, dict):
+        raise FilterError('filters must be an object')
+    if 'conditions' in spec:
+        if not isinstance(spec['conditions'], list):
+            raise FilterError('conditions must be a list')
+        match = spec.get('match', 'all')
+        if match not in ('all', 'any'):
+            raise FilterError('match must be "all" or "any"')
+        return spec['conditions'], match
+    # Page state saved by the browser
+    typed = [{'field': 'search', 'op': 'contains', 'value': spec['search']}] if spec.get('search') else []
+    for key, field in PAGE_STATE.get(page, {}).items():
+        if spec.get(key):
+            typed.append({'field': field, 'op': 'eq', 'value': spec[key]})
+    return typed, 'all'
+
+
+def compile_filter(db, page, spec, alias='t'):
+    """(table, WHERE clause, parameters, tables read) for a saved filter on ``page``."""
+    table = PAGE_TABLES.get(page)
+    if table is None:
+        raise FilterError(f'Saved filters for page {page!r} cannot run on the server')
+    typed, match = conditions(page, spec)
+    parts, parameters, tables = [], [], {table}
+    for condition in typed:
+        sql, params, read = _condition(db, table, alias, condition)
+        parts.append(sql)
+        parameters.extend(params)
+        tables |= read
+    where = (' OR ' if match == 'any' else ' AND ').join(f'({p})' for p in parts) if parts else '1 = 1'
+    return table, where, parameters, tables
+
+
+def _sort_key(kind):
+    def key(item):
+        value = item[2]
+        if value is None:
+            return (1, 0, '')
+        if kind == ADDRESS:
+            try:
+                addr = ipaddress.ip_address(value)
+                return (0, addr.version, int(addr))
+            except ValueError:
+                return (0, 9, str(value))
+        return (0, 0, value) if kind == NUMBER and isinstance(value, (int, float)) else (0, 1, str(value))
+    return key
+
+
+def matching_ids(saved, sort=None, descending=False):
+    """(table, [(company, id), ...]) of the rows a saved filter matches, in sort order.
+
+    Memoized until one of the tables the filter reads is written; the filter's
+    own version is part of the key, so editing it starts a new entry.
+    """
+    table, where, parameters, tables = compile_filter(get_db(), saved.get('page'), saved.get('filters'))
+    kind, column = ID, 'id'
+    if sort is not None:
+        kind, column = FIELDS[table].get(sort, (None, None))
+        if column is None or not column_of(table, sort):
+            raise FilterError(f'Unknown sort field for {table}: {sort}')
+    tables = tuple(sorted(tables))
+    key = (saved['id'], saved.get('version'), column, descending, shards.request_scope())
+    versions = events.bus.versions(tables)
+    if cache.ENABLED:
+        hit = results_cache.get(key, versions)
+        if hit is not None:
+            return table, hit
+    rows = []
+    for company, conn in shards.databases(table):
+        rows.extend((company, r[0], r[1]) for r in conn.execute(
+            f'SELECT t.id, t.{column} FROM {table} t WHERE {where}', parameters).fetchall())
+    rows.sort(key=_sort_key(kind), reverse=descending)
+    ids = [(company, id) for company, id, _ in rows]
+    if cache.ENABLED:
+        results_cache.put(key, versions, ids, sum(len(id) + 64 for _, id in ids))
+    return table, ids
+
+
+def fetch(table, ids):
+    """Full rows for a page of (company, id) pairs, in the same order."""
+    by_company = {}
+    for company, id in ids:
+        by_company.setdefault(company, []).append(id)
+    connections = dict(shards.databases(table))
+    rows = {}
+    for company, chunk in by_company.items():
+        conn = connections.get(company) or shards.shard_db(company)
+        for row in conn.execute(f'SELECT * FROM {table} WHERE id IN ({",".join("?" * len(chunk))})',
+                                chunk).fetchall():
+            rows[(company, row['id'])] = dict(row)
+    return [rows[key] for key in ids if key in rows]
@@ -0,0 +1,98 @@
+"""Compact representations for large row lists.
+
+``?format=columnar`` on the list and backup endpoints returns each table as
+``{"columns": [...], "rows": [[...], ...]}`` instead of an array of objects: key
+names are sent once per table rather than once per row, and rows go from the
+cursor's tuples straight to the encoder without a dict per row. JSON columns
+(e.g. maintenance_windows.hostIds) are left as the strings stored in the
+database.
+
+The same endpoints, and the bodies of backup imports and table syncs, also
+speak MessagePack when the optional ``msgpack`` package is installed: a client
+sending ``Accept: application/msgpack`` gets a binary response that is
+streamed out in chunks instead of being encoded in one piece, and a body sent
+with ``Content-Type: application/msgpack`` is decoded in C. Without the
+package everything stays JSON.
+"""
+from flask import Response, jsonify, request
+
+try:
+    import msgpack
+except ImportError:  # optional dependency, see requirements.txt
+    msgpack = None
+
+COLUMNAR = 'columnar'
+MSGPACK = 'application/msgpack'
+# Rows packed per yielded chunk when streaming long arrays
+STREAM_ROWS = 2000
+
+
+def columnar_requested():
+    return request.args.get('format') == COLUMNAR
+
+
+def columnar(connections, table, where='', parameters=()):
+    """Rows of ``table`` from every connection as one ``{columns, rows}`` block."""
+    connections = list(connections)
+    # An explicit column list keeps the order identical across shards
+    columns = connections[0].columns(table)
+    sql = f'SELECT {", ".join(columns)} FROM {table}{where}'
+    rows = []
+    for db in connections:
+        rows.extend(db.fetch_tuples(sql, parameters))
+    return {'columns': columns, 'rows': rows}
+
+
+def expand(block):
+    """Row objects from a ``{columns, rows}`` block, the inverse of columnar(); ValueError if malformed."""
+    columns, rows = block.get('columns'), block.get('rows')
+    if not isinstance(columns, list) or not isinstance(rows, list):
+        raise ValueError('a columnar table needs "columns" and "rows" arrays')
+    if any(not isinstance(row, list) or len(row) != len(columns) for row in rows):
+        raise ValueError('every columnar row must have one value per column')
+    return [dict(zip(columns, row)) for row in rows]
+
+
+def msgpack_accepted():
+    """Whether the client prefers MessagePack over JSON (and we can produce it)."""
+    if msgpack is None:
+        return False
+    accept = request.accept_mimetypes
+    # Only on explicit request: a bare */* (browsers, curl) keeps getting JSON
+    return MSGPACK in accept.values() and accept[MSGPACK] >= accept['application/json']
+
+
+def _stream(obj, packer):
+    if isinstance(obj, dict):
+        yield packer.pack_map_header(len(obj))
+        for key, value in obj.items():
+            yield packer.pack(key)
+            yield from _stream(value, packer)
+    elif isinstance(obj, (list, tuple)) and len(obj) > STREAM_ROWS:
+        yield packer.pack_array_header(len(obj))
+        for i in range(0, len(obj), STREAM_ROWS):
+            yield b''.join(map(packer.pack, obj[i:i + STREAM_ROWS]))
+    else:
+        yield packer.pack(obj)
+
+
+def respond(obj):
+    """JSON response, or a streamed MessagePack one when the client asked for it."""
+    if msgpack_accepted():
+        response = Response(_stream(obj, msgpack.Packer(default=str)), mimetype=MSGPACK)
+    else:
+        response = jsonify(obj)
+    response.vary.add('Accept')
+    return response
+
+
+def request_data():
+    """The request body decoded from MessagePack or JSON; None if it is neither."""
+    if request.mimetype == MSGPACK:
+        if msgpack is None:
+            return None
+        try:
+            return msgpack.unpackb(request.get_data(), raw=False, strict_map_key=False)
+        except (ValueError, msgpack.UnpackException):
+            return None
+    return request.get_json(silent=True)
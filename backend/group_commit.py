@@ -0,0 +1,232 @@
+"""Group commit: one writer connection per SQLite file, shared by all request threads.
+
+Request connections buffer their INSERT/UPDATE/DELETE statements; ``commit()``
+hands the buffered unit to the file's coordinator thread and blocks until it is
+durable. The coordinator takes every unit queued within a short window (or up to
+a maximum batch; a lone unit is flushed at once) and applies them in a single write transaction, each inside
+its own SAVEPOINT so a failing request only rolls back its own statements. One
+lock acquisition and one WAL fsync are then shared by the whole batch instead
+of paid per request, and requests queue in memory instead of spinning on
+``database is locked``.
+
+Reads keep using the request's own connection and do not see that request's
+buffered writes until it commits.
+
+OPENIPAM_GROUP_COMMIT        '0' disables the coordinator (default enabled)
+OPENIPAM_GROUP_COMMIT_MS     how long a batch stays open for more units when others are
+                             already queued (default 2)
+OPENIPAM_GROUP_COMMIT_MAX    maximum units per transaction (default 64)
+"""
+import os
+import queue
+import sqlite3
+import threading
+from time import monotonic, perf_counter
+
+import events
+import metrics
+
+ENABLED = os.environ.get('OPENIPAM_GROUP_COMMIT', '1') != '0'
+WINDOW = float(os.environ.get('OPENIPAM_GROUP_COMMIT_MS', 2)) / 1000.0
+MAX_BATCH = int(os.environ.get('OPENIPAM_GROUP_COMMIT_MAX', 64))
+BUSY_TIMEOUT_MS = 30000
+
+batch_units = metrics.Histogram('openipam_group_commit_batch_units', 'Requests committed per write transaction',
+                                (1, 2, 4, 8, 16, 32, 64, 128))
+commit_wait = metrics.Histogram('openipam_group_commit_wait_seconds',
+                                'Time a request waits for its writes to become durable', metrics.LATENCY_BUCKETS)
+
+
+class PendingCursor:
+    """Result of a buffered write.
+
+    ``rowcount`` is known once ``commit()`` has applied the unit. Reading it
+    before raises instead of returning a misleading -1.
+    """
+
+    lastrowid = None
+
+    def __init__(self):
+        self._rowcount = None
+
+    @property
+    def rowcount(self):
+        if self._rowcount is None:
+            raise RuntimeError('rowcount of a buffered write is only known after commit()')
+        return self._rowcount
+
+    def fetchone(self):
+        return None
+
+    def fetchall(self):
+        return []
+
+
+class _Unit:
+    __slots__ = ('ops', 'done', 'error')
+
+    def __init__(self, ops):
+        self.ops = ops            # [(sql, parameters, many, PendingCursor)]
+        self.done = threading.Event()
+        self.error = None
+
+
+class WriteCoordinator:
+    """Owns the single writer connection of one database file."""
+
+    def __init__(self, opener, window=WINDOW, max_batch=MAX_BATCH):
+        self.opener = opener
+        self.window = window
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, ops):
+        """Apply a unit of writes in the next batch and wait until it is committed."""
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='openipam-writer', daemon=True)
+                    self._thread.start()
+        unit = _Unit(ops)
+        self._queue.put(unit)
+        unit.done.wait()
+        if unit.error is not None:
+            raise unit.error
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        if self._queue.empty():
+            # Nobody else is waiting: holding the batch open would only add latency
+            return batch
+        deadline = monotonic() + self.window
+        while len(batch) < self.max_batch:
+            try:
+                remaining = deadline - monotonic()
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        db = None
+        while True:
+            batch = self._collect()
+            try:
+                if db is None:
+                    db = self.opener()
+                    db.isolation_level = None
+                    db.execute(f'PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}')
+                self._flush(db, batch)
+            except sqlite3.Error as e:
+                # The transaction as a whole failed (lock timeout, disk error): fail every unit
+                for unit in batch:
+                    unit.error = unit.error or e
+                if db is not None:
+                    if db.in_transaction:
+                        db.execute('ROLLBACK')
+                    db.dirty = set()
+            finally:
+                for unit in batch:
+                    unit.done.set()
+
+    def _flush(self, db, batch):
+        start = perf_counter()
+        db.execute('BEGIN IMMEDIATE')
+        metrics.lock_wait.observe(perf_counter() - start, ('acquire',))
+        for unit in batch:
+            db.execute('SAVEPOINT request')
+            try:
+                for sql, parameters, many, cursor in unit.ops:
+                    cur = db.executemany(sql, parameters) if many else db.execute(sql, parameters)
+                    cursor._rowcount, cursor.lastrowid = cur.rowcount, cur.lastrowid
+                db.execute('RELEASE request')
+            except sqlite3.Error as e:
+                db.execute('ROLLBACK TO request')
+                db.execute('RELEASE request')
+                unit.error = e
+        start = perf_counter()
+        db.execute('COMMIT')
+        metrics.observe_commit(perf_counter() - start)
+        # Change events are published by each request once its commit returns
+        db.dirty = set()
+        batch_units.observe(len(batch))
+
+
+_coordinators = {}
+_registry_lock = threading.Lock()
+
+
+def coordinator(key, opener):
+    """The coordinator for a database file, created on first use."""
+    found = _coordinators.get(key)
+    if found is None:
+        with _registry_lock:
+            found = _coordinators.setdefault(key, WriteCoordinator(opener))
+    return found
+
+
+class BufferedConnection:
+    """Request connection that reads directly and commits writes through a coordinator."""
+
+    def __init__(self, db, coordinator):
+        self._db = db
+        self._coordinator = coordinator
+        self._ops = []
+        self.dirty = set()
+
+    def __getattr__(self, name):
+        return getattr(self._db, name)
+
+    @property
+    def in_transaction(self):
+        return bool(self._ops) or self._db.in_transaction
+
+    def _buffer(self, sql, parameters, many):
+        cursor = PendingCursor()
+        self._ops.append((sql, parameters, many, cursor))
+        table = metrics.written_table(sql)
+        if table:
+            self.dirty.add(table)
+        return cursor
+
+    def execute(self, sql, parameters=()):
+        if metrics.classify(sql)[0] in metrics.WRITE_VERBS:
+            return self._buffer(sql, parameters, False)
+        return self._db.execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        if metrics.classify(sql)[0] in metrics.WRITE_VERBS:
+            # Materialized here: generators may depend on request state
+            return self._buffer(sql, list(seq_of_parameters), True)
+        return self._db.executemany(sql, seq_of_parameters)
+
+    def bulk_insert(self, table, columns, rows):
+        placeholders = ','.join(['?'] * len(columns))
+        return self.executemany(f'INSERT INTO {table} ({",".join(columns)}) VALUES ({placeholders})', rows)
+
+    def commit(self):
+        """Apply the buffered writes; their cursors report ``rowcount`` from here on."""
+        ops, self._ops = self._ops, []
+        if ops:
+            start = perf_counter()
+            try:
+                self._coordinator.submit(ops)
+            except sqlite3.Error:
+                self.dirty = set()
+                raise
+            finally:
+                elapsed = perf_counter() - start
+                self._db.db_time += elapsed
+                commit_wait.observe(elapsed)
+        if self._db.in_transaction:
+            self._db.commit()
+        if self.dirty:
+            changed, self.dirty = self.dirty, set()
+            events.publish(changed)
+
+    def rollback(self):
+        self._ops = []
+        self.dirty = set()
+        self._db.rollback()
@@ -0,0 +1,343 @@
+"""Host resource time series: raw samples, rollups and retention.
+
+Hypervisor stats are pushed in batches to POST /api/v1/hosts/metrics and
+appended to host_samples with integer timestamps (Unix seconds). The table is
+keyed by (ts, hostId), so each batch lands at the end of the index. The hosts
+row only takes the newest values of a batch when they differ from the stored
+ones (routes/hosts.py).
+
+A background downsampler, started by the first batch a worker process
+accepts, rolls the samples up into 1-minute, 1-hour and 1-day
+buckets (host_metrics_1m, _1h and _1d). Each bucket keeps the sample count and
+the average and peak of every metric. Each level is rolled up from the one
+below it, and only for the buckets completed since its watermark. Samples that
+arrive for a bucket already rolled up move the watermark back, so the bucket
+is computed again. Rows past their level's retention are then deleted once
+the next level has them. Trend queries read the coarsest table that still
+gives enough points for their span.
+
+    python host_metrics.py rollup        # one pass, e.g. from cron
+    python host_metrics.py schedule      # a pass every OPENIPAM_METRICS_ROLLUP_SEC (foreground)
+
+Environment:
+    OPENIPAM_METRICS_ROLLUP_SEC   seconds between rollups in the app once samples arrive (default 60, 0 disables)
+    OPENIPAM_METRICS_RETENTION    per level, e.g. "raw=1h,1m=6h,1h=30d,1d=3650d" (the defaults)
+"""
+import argparse
+import math
+import os
+import sys
+import threading
+import time
+
+import events
+
+# Sampled columns of the hosts table, with their SQL type
+METRICS = {'memoryUsedGB': 'REAL', 'diskUsedGB': 'REAL', 'cpuCount': 'INTEGER'}
+# Only updates the hosts row
+STATUS_FIELDS = ('state',)
+
+# (level, table, bucket seconds); each level is rolled up from the one before it
+LEVELS = (
+    ('raw', 'host_samples', 1),
+    ('1m', 'host_metrics_1m', 60),
+    ('1h', 'host_metrics_1h', 3600),
+    ('1d', 'host_metrics_1d', 86400),
+)
+TABLES = {level: table for level, table, _ in LEVELS}
+DEFAULT_RETENTION = 'raw=1h,1m=6h,1h=30d,1d=3650d'
+ROLLUP_INTERVAL = int(os.environ.get('OPENIPAM_METRICS_ROLLUP_SEC', 60))
+# A bucket is rolled up this long after it ends, for samples still in flight
+GRACE_SECONDS = 30
+# How far ahead of the server clock a sample's ts may be
+MAX_SKEW_SECONDS = 300
+# Most samples accepted per request and points returned per query
+MAX_SAMPLES = 50000
+MAX_POINTS = 2000
+
+_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def _schema_sql():
+    raw = ''.join(f'\n        {name} {kind},' for name, kind in METRICS.items())
+    rolled = ''.join(f'\n        {name} REAL,\n        {name}Max {kind},' for name, kind in METRICS.items())
+    statements = [
+        f"""CREATE TABLE IF NOT EXISTS host_samples (
+        ts INTEGER NOT NULL,
+        hostId TEXT NOT NULL,{raw}
+        PRIMARY KEY (ts, hostId)
+    ) WITHOUT ROWID""",
+        """CREATE TABLE IF NOT EXISTS host_metrics_state (
+        key TEXT PRIMARY KEY,
+        value INTEGER
+    )""",
+    ]
+    for _, table, _ in LEVELS[1:]:
+        statements.append(f"""CREATE TABLE IF NOT EXISTS {table} (
+        hostId TEXT NOT NULL,
+        ts INTEGER NOT NULL,
+        samples INTEGER,{rolled}
+        PRIMARY KEY (hostId, ts)
+    ) WITHOUT ROWID""")
+        # Rollups of the next level and retention work by time across all hosts
+        statements.append(f'CREATE INDEX IF NOT EXISTS idx_{table}_ts ON {table} (ts)')
+    return statements
+
+
+# Part of database.CREATE_TABLES_SQL: the tables live in the main database only
+SCHEMA_SQL = _schema_sql()
+
+# Ingest writes every minute: bump the cache versions, but don't make every open tab reload
+events.QUIET_TABLES.update(('host_samples', 'host_metrics_state'))
+
+
+def _duration(text):
+    text = text.strip()
+    if text[-1:] in _UNITS:
+        return int(float(text[:-1]) * _UNITS[text[-1]])
+    return int(text)
+
+
+def retention(spec=None):
+    """Seconds kept per level, from OPENIPAM_METRICS_RETENTION on top of the defaults."""
+    kept = {}
+    for part in f'{DEFAULT_RETENTION},{spec or os.environ.get("OPENIPAM_METRICS_RETENTION", "")}'.split(','):
+        level, _, value = part.partition('=')
+        if level.strip() in TABLES and value.strip():
+            kept[level.strip()] = _duration(value)
+    return kept
+
+
+# --- Ingest ---
+
+def _number(value):
+    """True for a finite int or float that fits a SQLite column."""
+    return (isinstance(value, (int, float)) and not isinstance(value, bool)
+            and math.isfinite(value) and -2 ** 63 <= value < 2 ** 63)
+
+
+def parse(samples, now=None):
+    """Validate a batch of sample objects.
+
+    Returns (rows, errors): rows are dicts with hostId, an integer ts (the
+    server time when absent) and the metric and status fields that were sent;
+    errors are ``{index, error}`` for the samples left out. Samples older than
+    the raw retention are refused, as their minute may no longer be complete,
+    and so are samples from the future, which would stay the newest for good.
+    """
+    now = int(time.time() if now is None else now)
+    oldest, newest = now - retention()['raw'], now + MAX_SKEW_SECONDS
+    rows, errors = [], []
+    for index, sample in enumerate(samples):
+        if not isinstance(sample, dict) or not isinstance(sample.get('hostId'), str) or not sample['hostId']:
+            errors.append({'index': index, 'error': 'hostId is required'})
+            continue
+        ts = sample.get('ts', now)
+        if not _number(ts) or ts < 0:
+            errors.append({'index': index, 'error': 'ts must be Unix seconds'})
+            continue
+        if ts < oldest:
+            errors.append({'index': index, 'error': 'ts is older than the raw sample retention'})
+            continue
+        if ts > newest:
+            errors.append({'index': index, 'error': 'ts is ahead of the server clock'})
+            continue
+        row = {'hostId': sample['hostId'], 'ts': int(ts)}
+        for name in METRICS:
+            value = sample.get(name)
+            if value is not None and not _number(value):
+                errors.append({'index': index, 'error': f'{name} must be a finite number'})
+                break
+            row[name] = value
+        else:
+            for name in STATUS_FIELDS:
+                if name in sample:
+                    row[name] = sample[name]
+            rows.append(row)
+    return rows, errors
+
+
+def superseded(db, latest):
+    """Ids of ``latest`` ({hostId: newest row of a batch}) with a stored sample at least as new.
+
+    A stored sample with the same ts wins (see append()), so it stays the one in the hosts row.
+    """
+    oldest = min(row['ts'] for row in latest.values())
+    # A range at the end of the (ts, hostId) key: empty unless samples arrive out of order
+    newer = db.execute('SELECT hostId, MAX(ts) FROM host_samples WHERE ts >= ? GROUP BY hostId', (oldest,)).fetchall()
+    return {host_id for host_id, ts in newer if host_id in latest and ts >= latest[host_id]['ts']}
+
+
+def append(db, rows):
+    """Append samples; a repeated (ts, hostId) keeps the first one, so retried pushes are harmless."""
+    columns = ['ts', 'hostId', *METRICS]
+    db.executemany(f'INSERT INTO host_samples ({", ".join(columns)}) VALUES ({", ".join("?" * len(columns))}) '
+                   'ON CONFLICT (ts, hostId) DO NOTHING', [tuple(row[c] for c in columns) for row in rows])
+    # Samples for a minute already rolled up: roll it up again on the next pass
+    oldest = min(row['ts'] for row in rows) // 60 * 60
+    db.execute("UPDATE host_metrics_state SET value = ? WHERE key = 'rolled:1m' AND value > ?", (oldest, oldest))
+
+
+# --- Rollups ---
+
+def _rollup_sql(source, table, size):
+    """Upsert of ``table``'s buckets between two timestamps from the ``source`` level."""
+    bucket = f'ts / {size} * {size}'
+    if source == 'host_samples':
+        selects = ['COUNT(*)'] + [f'AVG({m}), MAX({m})' for m in METRICS]
+    else:
+        # Averages weighted by the samples behind them, skipping buckets without the metric
+        selects = ['SUM(samples)'] + [f'SUM({m} * samples) / SUM(CASE WHEN {m} IS NOT NULL THEN samples END), '
+                                      f'MAX({m}Max)' for m in METRICS]
+    columns = ['samples'] + [c for m in METRICS for c in (m, f'{m}Max')]
+    updates = ', '.join(f'{c} = excluded.{c}' for c in columns)
+    return (f'INSERT INTO {table} (hostId, ts, {", ".join(columns)}) '
+            f'SELECT hostId, {bucket}, {", ".join(selects)} FROM {source} '
+            f'WHERE ts >= ? AND ts < ? GROUP BY hostId, {bucket} '
+            f'ON CONFLICT (hostId, ts) DO UPDATE SET {updates}')
+
+
+def _state(db):
+    return {key: value for key, value in db.execute('SELECT key, value FROM host_metrics_state').fetchall()}
+
+
+def _set_state(db, key, value):
+    db.execute('INSERT INTO host_metrics_state (key, value) VALUES (?, ?) '
+               'ON CONFLICT (key) DO UPDATE SET value = excluded.value', (key, value))
+
+
+def rollup(db, now=None, kept=None):
+    """Roll the completed buckets of every level up and apply retention.
+
+    ``db`` is an autocommit connection (engine.standalone()). Returns
+    ({level: buckets written}, {level: rows deleted}).
+    """
+    now = int(time.time() if now is None else now)
+    kept = kept or retention()
+    state = _state(db)
+    written, deleted = {}, {}
+    for i in range(1, len(LEVELS)):
+        source = LEVELS[i - 1][1]
+        level, table, size = LEVELS[i]
+        start = state.get(f'rolled:{level}')
+        if start is None:
+            first = db.execute(f'SELECT MIN(ts) FROM {source}').fetchone()[0]
+            start = first // size * size if first is not None else None
+        end = (now - GRACE_SECONDS) // size * size
+        if start is None or start >= end:
+            continue
+        written[level] = db.execute(_rollup_sql(source, table, size), (start, end)).rowcount
+        _set_state(db, f'rolled:{level}', end)
+        state[f'rolled:{level}'] = end
+        if i + 1 < len(LEVELS):
+            # The next level's buckets from ``start`` on are out of date now
+            next_level, _, next_size = LEVELS[i + 1]
+            stale = start // next_size * next_size
+            if state.get(f'rolled:{next_level}') is not None and state[f'rolled:{next_level}'] > stale:
+                _set_state(db, f'rolled:{next_level}', stale)
+                state[f'rolled:{next_level}'] = stale
+
+    for i, (level, table, _) in enumerate(LEVELS):
+        cutoff = now - kept[level]
+        if i + 1 < len(LEVELS):
+            # Whole buckets of the next level only, and only those it has taken in
+            next_level, _, next_size = LEVELS[i + 1]
+            cutoff = min(cutoff // next_size * next_size, state.get(f'rolled:{next_level}') or 0)
+        deleted[level] = db.execute(f'DELETE FROM {table} WHERE ts < ?', (cutoff,)).rowcount
+    return written, deleted
+
+
+def claim(db, interval):
+    """Take the rollup turn for ``interval`` seconds; False while another process has it."""
+    now = int(time.time())
+    db.execute("INSERT INTO host_metrics_state (key, value) VALUES ('lease', 0) ON CONFLICT (key) DO NOTHING")
+    cur = db.execute("UPDATE host_metrics_state SET value = ? WHERE key = 'lease' AND value <= ?",
+                     (now + max(1, interval - 1), now))
+    return cur.rowcount == 1
+
+
+# --- Queries ---
+
+def resolution(start, end):
+    """Coarsest level with at least MAX_POINTS / 10 buckets between ``start`` and ``end``."""
+    for level, _, size in reversed(LEVELS[1:]):
+        if (end - start) / size >= MAX_POINTS / 10:
+            return level
+    return LEVELS[1][0]
+
+
+def series(db, level, start, end, host_id=None):
+    """{columns, rows} of one host's buckets, or of all hosts added up per bucket."""
+    names = list(METRICS) if level == 'raw' else ['samples'] + [c for m in METRICS for c in (m, f'{m}Max')]
+    if host_id is not None:
+        columns = ['ts'] + names
+        select, where, group, parameters = ', '.join(columns), 'hostId = ? AND ', '', (host_id, start, end)
+    else:
+        columns = ['ts', 'hosts'] + names
+        select = 'ts, COUNT(*), ' + ', '.join(f'SUM({c})' for c in names)
+        where, group, parameters = '', ' GROUP BY ts', (start, end)
+    sql = (f'SELECT {select} FROM {TABLES[level]} WHERE {where}ts >= ? AND ts < ?{group} '
+           f'ORDER BY ts LIMIT {MAX_POINTS}')
+    return {'columns': columns, 'rows': [list(row) for row in db.fetch_tuples(sql, parameters)]}
+
+
+# --- Scheduled mode ---
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def start_scheduler(interval=ROLLUP_INTERVAL, logger=None):
+    """Start a daemon thread rolling up every ``interval`` seconds, once per process.
+
+    Called on each ingest: every worker process taking samples runs one; the
+    lease in host_metrics_state lets only one of them do each pass.
+    """
+    global _scheduler
+    if _scheduler is not None or interval <= 0:
+        return None
+
+    def _loop():
+        import database
+        db = None
+        while True:
+            time.sleep(interval)
+            try:
+                db = db or database.engine.standalone()
+                if claim(db, interval):
+                    rollup(db)
+            except Exception as e:
+                db = None
+                if logger:
+                    logger.error(f'Host metrics rollup failed: {e}')
+
+    with _scheduler_lock:
+        if _scheduler is not None:
+            return None
+        _scheduler = threading.Thread(target=_loop, name='openipam-host-metrics', daemon=True)
+        _scheduler.start()
+    return _scheduler
+
+
+def main(argv=None):
+    import database
+    parser = argparse.ArgumentParser(description='OpenIPAM host metrics rollups')
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('rollup', help='roll up completed buckets and apply retention once')
+    schedule = sub.add_parser('schedule', help='roll up periodically (foreground)')
+    schedule.add_argument('--interval', type=int, default=ROLLUP_INTERVAL or 60, help='seconds between passes')
+    args = parser.parse_args(argv)
+
+    database.init_db()
+    db = database.engine.standalone()
+    while True:
+        started = time.perf_counter()
+        written, deleted = rollup(db)
+        print(f'rolled up {written or "nothing"}, deleted {deleted} '
+              f'in {time.perf_counter() - started:.2f}s', flush=True)
+        if args.command == 'rollup':
+            return 0
+        time.sleep(args.interval)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
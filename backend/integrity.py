@@ -0,0 +1,320 @@
+"""Referential integrity checks between the entity tables.
+
+The tables declare no foreign keys: table syncs and backup imports replace a
+whole table (DELETE, then INSERT), which would fire every ON DELETE action on
+each upload. The relationships are listed in RELATIONS instead. The API delete
+handlers apply their ON DELETE behaviour themselves, and this module finds the
+references that point nowhere: an anti-join per relation, i.e. a NOT EXISTS
+probe on the parent's primary key for each child row.
+
+Scans are incremental and only visit the child rows added or changed since the
+last scan, plus the children of parent rows deleted since:
+
+- New child rows are the rowids above the checkpoint stored per table. SQLite
+  hands out rowids in ascending order; if the row at the checkpoint is gone
+  (its rowid may be reused), that table is checked in full.
+- Triggers log to integrity_journal the ids of child rows whose reference
+  column changed and of deleted parent rows. On PostgreSQL, which has no
+  rowids, statement-level triggers also log inserted rows.
+- Stored findings are re-checked on every scan: that clears the ones whose
+  child row was deleted or whose parent came back.
+
+Row triggers on INSERT would slow down every table sync, hence the rowids.
+Syncs and imports pause the journal while they rewrite a table (replacing())
+and the next scan checks that table's relations in full. So do the first scan
+of a database, any ``full`` one and a scan facing more than FULL_SCAN_ENTRIES
+journal entries. Relations are checked within one database: in a company
+shard (shards.py) the references to shared tables such as companies are
+skipped.
+"""
+import json
+from contextlib import contextmanager
+from datetime import datetime
+
+import events
+
+# name -> (child table, reference column, parent table, repair)
+# repair is the SET clause that unlinks a dangling child row, or None to delete it
+RELATIONS = {
+    'ips.hostId': ('ips', 'hostId', 'hosts', "hostId = NULL, status = 'available'"),
+    'ips.subnetId': ('ips', 'subnetId', 'subnets', 'subnetId = NULL'),
+    'ip_ranges.subnetId': ('ip_ranges', 'subnetId', 'subnets', 'subnetId = NULL'),
+    'dhcp_scopes.subnetId': ('dhcp_scopes', 'subnetId', 'subnets', 'subnetId = NULL'),
+    'dhcp_options.scopeId': ('dhcp_options', 'scopeId', 'dhcp_scopes', None),
+    'dhcp_leases.scopeId': ('dhcp_leases', 'scopeId', 'dhcp_scopes', None),
+    'dhcp_reservations.scopeId': ('dhcp_reservations', 'scopeId', 'dhcp_scopes', None),
+    'subnets.companyId': ('subnets', 'companyId', 'companies', 'companyId = NULL'),
+    'hosts.companyId': ('hosts', 'companyId', 'companies', 'companyId = NULL'),
+    'vlans.companyId': ('vlans', 'companyId', 'companies', 'companyId = NULL'),
+    'hosts.locationId': ('hosts', 'locationId', 'locations', 'locationId = NULL'),
+}
+
+# An incremental scan looks up at most this many logged keys per statement
+BATCH_KEYS = 500
+# Beyond this many journal entries one pass over the tables is cheaper than a lookup per entry
+FULL_SCAN_ENTRIES = 50000
+
+# table -> its reference columns
+CHILD_COLUMNS = {child: [column for c, column, _, _ in RELATIONS.values() if c == child]
+                 for child, _, _, _ in RELATIONS.values()}
+PARENT_TABLES = sorted({parent for _, _, parent, _ in RELATIONS.values()})
+TABLES = sorted(set(CHILD_COLUMNS) | set(PARENT_TABLES))
+
+# Bookkeeping of the scans, not data the browser holds: no reload in open tabs
+events.QUIET_TABLES.update(('integrity_findings', 'integrity_state', 'integrity_journal'))
+
+_STATE_SQL = [
+    """CREATE TABLE IF NOT EXISTS integrity_findings (
+        relation TEXT,
+        childId TEXT,
+        value TEXT,
+        foundAt TEXT,
+        PRIMARY KEY (relation, childId)
+    )""",
+    """CREATE TABLE IF NOT EXISTS integrity_state (
+        key TEXT PRIMARY KEY,
+        value TEXT
+    )""",
+]
+
+
+def _sqlite_sql():
+    statements = _STATE_SQL + [
+        """CREATE TABLE IF NOT EXISTS integrity_journal (
+            seq INTEGER PRIMARY KEY,
+            tableName TEXT,
+            rowKey TEXT
+        )""",
+    ]
+    for table in TABLES:
+        triggers = []
+        if table in CHILD_COLUMNS:
+            columns = CHILD_COLUMNS[table]
+            changed = ' OR '.join(f'NEW.{c} IS NOT OLD.{c}' for c in columns)
+            triggers.append((f'integrity_{table}_update',
+                             f'AFTER UPDATE OF {", ".join(columns)} ON {table} WHEN {changed}', 'NEW'))
+        if table in PARENT_TABLES:
+            triggers.append((f'integrity_{table}_delete', f'AFTER DELETE ON {table} WHEN NOT EXISTS '
+                             "(SELECT 1 FROM integrity_state WHERE key = 'paused')", 'OLD'))
+        for name, event, row in triggers:
+            # Dropped first so a changed definition replaces the old trigger
+            statements.append(f'DROP TRIGGER IF EXISTS {name}')
+            statements.append(f'CREATE TRIGGER {name} {event} BEGIN INSERT INTO integrity_journal '
+                              f"(tableName, rowKey) VALUES ('{table}', {row}.id); END")
+    return statements
+
+
+def _postgres_sql():
+    statements = _STATE_SQL + [
+        """CREATE TABLE IF NOT EXISTS integrity_journal (
+            seq BIGSERIAL PRIMARY KEY,
+            tableName TEXT,
+            rowKey TEXT
+        )""",
+        """CREATE OR REPLACE FUNCTION openipam_integrity_log() RETURNS trigger
+           LANGUAGE plpgsql AS $$
+           BEGIN
+               IF EXISTS (SELECT 1 FROM integrity_state WHERE key = 'paused') THEN
+                   RETURN NULL;
+               ELSIF TG_OP = 'DELETE' THEN
+                   INSERT INTO integrity_journal (tableName, rowKey) SELECT TG_TABLE_NAME, id FROM old_rows;
+               ELSE
+                   INSERT INTO integrity_journal (tableName, rowKey) SELECT TG_TABLE_NAME, id FROM new_rows;
+               END IF;
+               RETURN NULL;
+           END $$""",
+    ]
+    for table in TABLES:
+        triggers = []
+        if table in CHILD_COLUMNS:
+            triggers.append((f'integrity_{table}_insert', f'AFTER INSERT ON {table} REFERENCING NEW TABLE AS new_rows'))
+            triggers.append((f'integrity_{table}_update', f'AFTER UPDATE ON {table} REFERENCING NEW TABLE AS new_rows'))
+        if table in PARENT_TABLES:
+            triggers.append((f'integrity_{table}_delete', f'AFTER DELETE ON {table} REFERENCING OLD TABLE AS old_rows'))
+        for name, event in triggers:
+            statements.append(f'DROP TRIGGER IF EXISTS {name} ON {table}')
+            statements.append(f'CREATE TRIGGER {name} {event} FOR EACH STATEMENT '
+                              'EXECUTE FUNCTION openipam_integrity_log()')
+    return statements
+
+
+# Appended to database.SQLITE_EXTRA_SQL and postgres.PG_EXTRA_SQL
+SQLITE_SQL = _sqlite_sql()
+POSTGRES_SQL = _postgres_sql()
+
+
+def _dangling(child, column, parent):
+    """SQL condition for a child row whose reference names no parent row."""
+    return (f"{child}.{column} IS NOT NULL AND {child}.{column} <> '' "
+            f'AND NOT EXISTS (SELECT 1 FROM {parent} p WHERE p.id = {child}.{column})')
+
+
+def _relations(db):
+    """The relations whose child and parent tables both live in this database."""
+    present = {table for table in TABLES if db.columns(table)}
+    return [(name, relation) for name, relation in RELATIONS.items()
+            if relation[0] in present and relation[2] in present]
+
+
+def _now():
+    return datetime.utcnow().isoformat() + 'Z'
+
+
+def _state(db):
+    return dict(db.fetch_tuples('SELECT key, value FROM integrity_state'))
+
+
+def _set_state(db, values):
+    db.executemany('INSERT INTO integrity_state (key, value) VALUES (?, ?) '
+                   'ON CONFLICT (key) DO UPDATE SET value = excluded.value', list(values.items()))
+
+
+def _batches(keys):
+    keys = sorted(keys)
+    for start in range(0, len(keys), BATCH_KEYS):
+        batch = keys[start:start + BATCH_KEYS]
+        yield batch, ','.join('?' * len(batch))
+
+
+def _uses_rowids():
+    import database     # here, since database imports this module for SQLITE_SQL
+    return database.engine.name == 'sqlite'
+
+
+def _new_rows(db, table, checkpoint):
+    """(first rowid to visit or None for a full check, last rowid, its id) of a SQLite table."""
+    last = db.fetch_tuples(f'SELECT rowid, id FROM {table} ORDER BY rowid DESC LIMIT 1')
+    end, key = last[0] if last else (0, None)
+    if checkpoint:
+        start, start_key = json.loads(checkpoint)
+        if not start or db.fetch_tuples(f'SELECT 1 FROM {table} WHERE rowid = ? AND id = ?', (start, start_key)):
+            return start, end, key
+    return None, end, key
+
+
+def scan(db, full=False):
+    """Bring the findings of one database up to date and commit them; returns 'full' or 'incremental'."""
+    state = _state(db)
+    stale = {key: value for key, value in state.items() if key.startswith('stale:')}
+    first, checkpoint = db.fetch_tuples('SELECT MIN(seq), MAX(seq) FROM integrity_journal')[0]
+    checkpoint = checkpoint or 0
+    full = full or 'fullScanAt' not in state or checkpoint - (first or 0) >= FULL_SCAN_ENTRIES
+    logged = {}     # table -> keys logged since the last scan
+    if not full:
+        for table, key in db.fetch_tuples('SELECT tableName, rowKey FROM integrity_journal WHERE seq <= ?',
+                                          (checkpoint,)):
+            logged.setdefault(table, set()).add(key)
+    relations = _relations(db)
+    rowids = {}
+    if _uses_rowids():
+        rowids = {child: _new_rows(db, child, state.get(f'rowid:{child}')) for _, (child, _, _, _) in relations}
+    now = _now()
+    # Reads first, writes after: buffered connections (group_commit.py) apply writes at commit
+    results = []
+    for name, (child, column, parent, _) in relations:
+        dangling = _dangling('c', column, parent)
+        if (full or f'stale:{child}' in stale or f'stale:{parent}' in stale
+                or (child in rowids and rowids[child][0] is None)):
+            rows = db.fetch_tuples(f'SELECT c.id, c.{column} FROM {child} c WHERE {dangling}')
+            results.append((name, child, column, parent, None, dict(rows)))
+            continue
+        changed, parents, found = logged.get(child, set()), logged.get(parent, set()), {}
+        if child in rowids:
+            start, end, _ = rowids[child]
+            found.update(db.fetch_tuples(f'SELECT c.id, c.{column} FROM {child} c WHERE c.rowid > ? '
+                                         f'AND c.rowid <= ? AND {dangling}', (start, end)))
+        for keys, marks in _batches(changed):
+            found.update(db.fetch_tuples(f'SELECT c.id, c.{column} FROM {child} c WHERE c.id IN ({marks}) '
+                                         f'AND {dangling}', keys))
+        for keys, marks in _batches(parents):
+            found.update(db.fetch_tuples(f'SELECT c.id, c.{column} FROM {child} c WHERE c.{column} IN ({marks}) '
+                                         f'AND {dangling}', keys))
+        results.append((name, child, column, parent, changed, found))
+
+    for name, child, column, parent, changed, found in results:
+        if changed is None:
+            db.execute('DELETE FROM integrity_findings WHERE relation = ?', (name,))
+        else:
+            for keys, marks in _batches(changed):
+                db.execute(f'DELETE FROM integrity_findings WHERE relation = ? AND childId IN ({marks})',
+                           [name, *keys])
+            db.execute(f'DELETE FROM integrity_findings WHERE relation = ? AND NOT EXISTS '
+                       f'(SELECT 1 FROM {child} WHERE {child}.id = integrity_findings.childId '
+                       f'AND {child}.{column} = integrity_findings.value AND {_dangling(child, column, parent)})',
+                       (name,))
+        if found:
+            db.executemany('INSERT INTO integrity_findings (relation, childId, value, foundAt) VALUES (?, ?, ?, ?) '
+                           'ON CONFLICT (relation, childId) DO UPDATE SET value = excluded.value',
+                           [(name, id, value, now) for id, value in found.items()])
+    db.execute('DELETE FROM integrity_journal WHERE seq <= ?', (checkpoint,))
+    # Only the marks read above: a table replaced meanwhile stays stale for the next scan
+    db.executemany('DELETE FROM integrity_state WHERE key = ? AND value = ?', list(stale.items()))
+    values = {f'rowid:{child}': json.dumps([end, key]) for child, (_, end, key) in rowids.items()}
+    values['scannedAt'] = now
+    if full:
+        values['fullScanAt'] = now
+    _set_state(db, values)
+    db.commit()
+    return 'full' if full else 'incremental'
+
+
+@contextmanager
+def replacing(db, table):
+    """Pause the journal while ``table`` is rewritten in the open transaction.
+
+    For table syncs and imports, which rewrite every row anyway: instead of a
+    journal entry per deleted row, the table is marked stale and its relations
+    are checked in full by the next scan. The pause ends before the transaction
+    commits, so other connections never see it.
+    """
+    if table not in TABLES:
+        yield
+        return
+    _set_state(db, {'paused': '1', f'stale:{table}': _now()})
+    try:
+        yield
+    finally:
+        db.execute("DELETE FROM integrity_state WHERE key = 'paused'")
+
+
+def scanned_at(db):
+    """When the findings of a database were last brought up to date, or None."""
+    rows = db.fetch_tuples("SELECT value FROM integrity_state WHERE key = 'scannedAt'")
+    return rows[0][0] if rows else None
+
+
+def findings(db, limit):
+    """(counts per relation, up to ``limit`` findings) stored for one database."""
+    counts = dict(db.fetch_tuples('SELECT relation, COUNT(*) FROM integrity_findings GROUP BY relation'))
+    items = []
+    for name, id, value, found_at in db.fetch_tuples(
+            'SELECT relation, childId, value, foundAt FROM integrity_findings ORDER BY relation, childId LIMIT ?',
+            (limit,)):
+        child, column, parent, repair = RELATIONS.get(name, (None, None, None, None))
+        items.append({'relation': name, 'table': child, 'id': id, 'column': column, 'value': value,
+                      'parent': parent, 'repair': 'delete' if repair is None else 'unlink', 'foundAt': found_at})
+    return counts, items
+
+
+def repair(db, names=None):
+    """Unlink or delete the child rows of the stored findings; returns {relation: rows changed}.
+
+    Each statement re-checks the reference, so rows fixed since the last scan
+    are left alone. Run scan() first to act on current findings.
+    """
+    now = _now()
+    cursors = {}
+    for name, (child, column, parent, action) in _relations(db):
+        if names is not None and name not in names:
+            continue
+        target = (f'{child}.id IN (SELECT childId FROM integrity_findings WHERE relation = ?) '
+                  f'AND {_dangling(child, column, parent)}')
+        if action is None:
+            cursors[name] = db.execute(f'DELETE FROM {child} WHERE {target}', (name,))
+        else:
+            cursors[name] = db.execute(f'UPDATE {child} SET {action}, version = version + 1, updatedAt = ? '
+                                       f'WHERE {target}', (now, name))
+        db.execute('DELETE FROM integrity_findings WHERE relation = ?', (name,))
+    _set_state(db, {'repairedAt': now})
+    db.commit()
+    return {name: cur.rowcount for name, cur in cursors.items() if cur.rowcount}
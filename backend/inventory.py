@@ -0,0 +1,482 @@
+"""Hypervisor inventory import: Proxmox and vSphere exports reconciled into hosts.
+
+Reads three kinds of export file:
+
+    proxmox   JSON from ``pvesh get /cluster/resources --type vm --output-format json``
+              (or /nodes/<node>/qemu); guest agent addresses are taken from an
+              ``interfaces`` / ``ipAddresses`` key on each VM when the dump has one
+    rvtools   RVTools vInfo tab saved as CSV (vSphere)
+    openipam  the sample_inventory.csv layout read by CSVManager.import()
+
+Files are parsed in a process pool when there are several of them (spawned,
+not forked: the server's threads, locks and connections must not be copied
+into the workers). The VMs are
+then matched to the company's hosts by serial number, or else by VM name, and
+only the differences are written: new hosts, changed hosts (version bumped),
+a ``locations`` row per hypervisor node and the VMs' addresses registered as
+assigned IPs in their subnets, like IPManager.register(). Fields an export
+does not carry keep their stored value, and hosts missing from the export are
+only counted, never deleted.
+
+    python inventory.py cluster.json rvtools_vInfo.csv --company acme --dry-run
+
+The same runs through POST /api/v1/hosts/import (routes/hosts.py).
+
+Environment:
+    OPENIPAM_IMPORT_WORKERS   parser processes (default: one per CPU)
+"""
+import argparse
+import csv
+import io
+import json
+import multiprocessing
+import os
+import re
+import sys
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import ipmath
+
+# Columns of hosts an import writes; None in a parsed VM means "not in this export"
+HOST_FIELDS = ('vmName', 'serialNumber', 'hostType', 'operatingSystem', 'memoryUsedGB', 'memoryAvailableGB',
+               'memoryTotalGB', 'node', 'diskSizeGB', 'diskUsedGB', 'state', 'cpuCount', 'favorite', 'locationId')
+FORMATS = ('proxmox', 'rvtools', 'openipam')
+# Hypervisor nodes are filed as locations of this type (see LocationManager)
+NODE_LOCATION_TYPE = 'rack'
+WORKERS = int(os.environ.get('OPENIPAM_IMPORT_WORKERS', 0)) or os.cpu_count() or 1
+# Below this much input, starting the pool costs more than the parsing
+POOL_MIN_BYTES = 1 << 20
+# Addresses looked up per statement, and errors / changes listed in a report
+LOOKUP_BATCH = 500
+MAX_REPORTED = 1000
+
+GB = 1024 ** 3
+_SPLIT_RE = re.compile(r'[\s,;]+')
+# Link-local and loopback addresses reported by guest agents are not inventory
+_SKIPPED_PREFIXES = ('127.', '169.254.')
+
+_PROXMOX_OS = {'l24': 'Linux 2.4', 'l26': 'Linux', 'win7': 'Windows 7', 'win8': 'Windows 8',
+               'win10': 'Windows 10/2016/2019', 'win11': 'Windows 11/2022', 'w2k8': 'Windows Server 2008',
+               'wxp': 'Windows XP', 'solaris': 'Solaris', 'other': 'Other'}
+_VSPHERE_STATES = {'poweredon': 'running', 'poweredoff': 'stopped', 'suspended': 'suspended'}
+
+# RVTools column names differ between versions (MB / MiB) and export options
+_RVTOOLS_COLUMNS = {
+    'vmName': ('VM',),
+    'state': ('Powerstate',),
+    'template': ('Template',),
+    'cpuCount': ('CPUs',),
+    'memory': ('Memory', 'Memory MB', 'Memory MiB'),
+    'provisioned': ('Provisioned MiB', 'Provisioned MB'),
+    'inUse': ('In Use MiB', 'In Use MB'),
+    'address': ('Primary IP Address', 'IP Address', 'IPv4 Address'),
+    'node': ('Host',),
+    'datacenter': ('Datacenter',),
+    'operatingSystem': ('OS according to the VMware Tools', 'OS according to the configuration file', 'OS'),
+    'serialNumber': ('SMBIOS UUID', 'BIOS UUID', 'VM UUID', 'Serial Number'),
+}
+_OPENIPAM_COLUMNS = {
+    'vmName': 'VM Name', 'hostType': 'Host Type', 'operatingSystem': 'Operating System',
+    'memoryUsedGB': 'Memory Used (GB)', 'memoryAvailableGB': 'Memory Available (GB)',
+    'memoryTotalGB': 'Memory Total (GB)', 'node': 'Node', 'diskSizeGB': 'Disk Size (GB)',
+    'diskUsedGB': 'Disk Used (GB)', 'state': 'State', 'cpuCount': 'CPU Count',
+}
+
+
+class InventoryError(ValueError):
+    """An export file that cannot be read at all."""
+
+
+# --- Parsing (runs in the worker processes) ---
+
+def _text(value):
+    value = str(value).strip() if value is not None else ''
+    return value or None
+
+
+def _number(value, scale=1, integer=False):
+    try:
+        number = float(str(value).replace(',', '')) / scale
+    except (TypeError, ValueError):
+        return None
+    return int(number) if integer else round(number, 2)
+
+
+def _addresses(values):
+    """Address strings from a comma/space separated string or a list, without loopback and link-local."""
+    if isinstance(values, str):
+        values = _SPLIT_RE.split(values)
+    found = []
+    for value in values or ():
+        value = _text(value)
+        if value and not value.startswith(_SKIPPED_PREFIXES) and value not in found:
+            found.append(value)
+    return found
+
+
+def _agent_addresses(interfaces):
+    """IPv4 addresses from QEMU guest agent network-get-interfaces output."""
+    if isinstance(interfaces, dict):
+        interfaces = interfaces.get('result') or []
+    return _addresses([entry.get('ip-address') for iface in interfaces if isinstance(iface, dict)
+                       for entry in iface.get('ip-addresses') or [] if isinstance(entry, dict)
+                       and entry.get('ip-address-type', 'ipv4') == 'ipv4'])
+
+
+def _vm(**fields):
+    vm = dict.fromkeys(HOST_FIELDS)
+    vm.update(fields)
+    vm.setdefault('ips', [])
+    return vm
+
+
+def parse_proxmox(content):
+    """VMs and containers of a pvesh JSON dump: (vms, errors)."""
+    try:
+        data = json.loads(content)
+    except ValueError as e:
+        raise InventoryError(f'Invalid JSON: {e}')
+    if isinstance(data, dict):
+        data = data.get('data')
+    if not isinstance(data, list):
+        raise InventoryError('Expected a JSON list of VMs')
+    vms, errors = [], []
+    for index, item in enumerate(data):
+        if not isinstance(item, dict) or item.get('type', 'qemu') not in ('qemu', 'lxc') or item.get('template'):
+            continue
+        name = _text(item.get('name'))
+        if name is None:
+            errors.append({'row': index, 'error': 'VM without a name'})
+            continue
+        total = _number(item.get('maxmem'), GB)
+        used = _number(item.get('mem'), GB)
+        smbios = dict(part.split('=', 1) for part in str(item.get('smbios1') or '').split(',') if '=' in part)
+        ips = _addresses(item.get('ipAddresses') or item.get('ip'))
+        if item.get('interfaces'):
+            ips += [ip for ip in _agent_addresses(item['interfaces']) if ip not in ips]
+        vms.append(_vm(
+            vmName=name,
+            serialNumber=_text(item.get('serial') or smbios.get('uuid')),
+            operatingSystem=_PROXMOX_OS.get(item.get('ostype'), _text(item.get('ostype'))),
+            memoryTotalGB=total,
+            memoryUsedGB=used,
+            memoryAvailableGB=round(total - used, 2) if total is not None and used is not None else None,
+            diskSizeGB=_number(item.get('maxdisk'), GB),
+            # QEMU guests report 0 here unless the guest agent fills it in
+            diskUsedGB=_number(item.get('disk'), GB) if item.get('disk') else None,
+            cpuCount=_number(item.get('maxcpu', item.get('cpus')), integer=True),
+            state=_text(item.get('status')),
+            node=_text(item.get('node')),
+            ips=ips,
+        ))
+    return vms, errors
+
+
+def _csv_rows(content):
+    if content[:1] == '\ufeff':
+        content = content[1:]
+    header = content.split('\n', 1)[0]
+    return csv.DictReader(io.StringIO(content), delimiter=';' if header.count(';') > header.count(',') else ',')
+
+
+def _column(fieldnames, candidates):
+    return next((name for name in candidates if name in fieldnames), None)
+
+
+def parse_rvtools(content):
+    """VMs of an RVTools vInfo CSV export: (vms, errors)."""
+    rows = _csv_rows(content)
+    columns = {field: _column(rows.fieldnames or (), names) for field, names in _RVTOOLS_COLUMNS.items()}
+    if columns['vmName'] is None:
+        raise InventoryError('Not an RVTools vInfo export: no "VM" column')
+    vms, errors = [], []
+    for index, row in enumerate(rows, start=2):
+        get = lambda field: row.get(columns[field]) if columns[field] else None
+        name = _text(get('vmName'))
+        if name is None:
+            errors.append({'row': index, 'error': 'VM without a name'})
+            continue
+        if str(get('template') or '').lower() == 'true':
+            continue
+        size, used = _number(get('provisioned'), 1024), _number(get('inUse'), 1024)
+        state = _text(get('state'))
+        vms.append(_vm(
+            vmName=name,
+            serialNumber=_text(get('serialNumber')),
+            operatingSystem=_text(get('operatingSystem')),
+            memoryTotalGB=_number(get('memory'), 1024),
+            diskSizeGB=size,
+            diskUsedGB=used,
+            cpuCount=_number(get('cpuCount'), integer=True),
+            state=_VSPHERE_STATES.get(state.lower(), state) if state else None,
+            node=_text(get('node')),
+            datacenter=_text(get('datacenter')),
+            ips=_addresses(get('address')),
+        ))
+    return vms, errors
+
+
+def parse_openipam(content):
+    """VMs of the sample_inventory.csv layout: (vms, errors)."""
+    rows = _csv_rows(content)
+    if 'VM Name' not in (rows.fieldnames or ()):
+        raise InventoryError('Not an OpenIPAM inventory CSV: no "VM Name" column')
+    vms, errors = [], []
+    for index, row in enumerate(rows, start=2):
+        vm = _vm(**{field: _text(row.get(column)) for field, column in _OPENIPAM_COLUMNS.items()})
+        if vm['vmName'] is None:
+            errors.append({'row': index, 'error': 'VM without a name'})
+            continue
+        for field in ('memoryUsedGB', 'memoryAvailableGB', 'memoryTotalGB', 'diskSizeGB', 'diskUsedGB'):
+            vm[field] = _number(vm[field])
+        vm['cpuCount'] = _number(vm['cpuCount'], integer=True)
+        fav = _text(row.get('Fav'))
+        vm['favorite'] = None if fav is None else int(fav == '1' or fav.lower() == 'true')
+        vm['ips'] = _addresses(row.get('IP Addresses'))
+        vms.append(vm)
+    return vms, errors
+
+
+PARSERS = {'proxmox': parse_proxmox, 'rvtools': parse_rvtools, 'openipam': parse_openipam}
+
+
+def detect(name, content):
+    """Format of an export file, from its extension or first line."""
+    if (name or '').lower().endswith('.json') or content.lstrip()[:1] in ('[', '{'):
+        return 'proxmox'
+    header = content.lstrip('\ufeff').split('\n', 1)[0]
+    if '"VM Name"' in header or header.startswith('VM Name') or ',VM Name,' in header:
+        return 'openipam'
+    return 'rvtools'
+
+
+def parse_file(item):
+    """Parse one (name, bytes or text, format or None) file: a summary dict with its vms and errors."""
+    name, content, fmt = item
+    if isinstance(content, bytes):
+        content = content.decode('utf-8-sig', errors='replace')
+    fmt = fmt or detect(name, content)
+    try:
+        vms, errors = PARSERS[fmt](content)
+    except InventoryError as e:
+        return {'name': name, 'format': fmt, 'vms': [], 'errors': [{'error': str(e)}], 'unreadable': True}
+    return {'name': name, 'format': fmt, 'vms': vms, 'errors': errors, 'unreadable': False}
+
+
+def parse_files(files, workers=None):
+    """Parse (name, content, format) files, several at a time in worker processes."""
+    files = list(files)
+    workers = min(workers or WORKERS, len(files))
+    if workers > 1 and sum(len(content) for _, content, _ in files) >= POOL_MIN_BYTES:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+            return list(pool.map(parse_file, files))
+    return [parse_file(item) for item in files]
+
+
+# --- Reconciling against the database ---
+
+def _locate_subnets(db, addresses):
+    """Subnet id of each address (narrowest containing subnet), None where there is none."""
+    if not addresses:
+        return []
+    subnets = db.fetch_tuples('SELECT id, network, cidr FROM subnets')
+    if not subnets:
+        return [None] * len(addresses)
+    starts, ends, _, valid = ipmath.networks([f'{network}/{cidr}' for _, network, cidr in subnets])
+    ids = [row[0] for row, ok in zip(subnets, valid) if ok]
+    starts = [s for s, ok in zip(starts, valid) if ok]
+    ends = [e for e, ok in zip(ends, valid) if ok]
+    values, _ = ipmath.parse(addresses)
+    owners = ipmath.locate(values, starts, ends)
+    return [ids[int(owner)] if owner >= 0 else None for owner in owners]
+
+
+def _existing_ips(db, addresses):
+    found = {}
+    for i in range(0, len(addresses), LOOKUP_BATCH):
+        chunk = addresses[i:i + LOOKUP_BATCH]
+        for row in db.fetch_tuples('SELECT ipAddress, id, hostId, status, subnetId FROM ips '
+                                   f'WHERE ipAddress IN ({",".join("?" * len(chunk))})', chunk):
+            found.setdefault(row[0], row[1:])
+    return found
+
+
+def reconcile(db, vms, company=None, locations_db=None, update_existing=True, dry_run=False):
+    """Bring the hosts of ``company`` in ``db`` in line with the parsed VMs; returns a report.
+
+    ``locations_db`` holds the shared locations table (``db`` when not sharded).
+    Reads everything first and writes at the end in batches, and leaves the
+    commit to the caller. With ``dry_run`` nothing is written.
+    """
+    locations_db = locations_db or db
+    now = datetime.utcnow().isoformat() + 'Z'
+    counts = {'added': 0, 'updated': 0, 'unchanged': 0, 'skipped': 0, 'missing': 0,
+              'ipsAdded': 0, 'ipsUpdated': 0, 'locationsAdded': 0}
+    errors, changes = [], []
+
+    fields = ', '.join(HOST_FIELDS)
+    sql = f'SELECT id, {fields} FROM hosts' + (' WHERE companyId = ?' if company else '')
+    hosts = db.fetch_tuples(sql, (company,) if company else ())
+    by_serial, by_name = {}, {}
+    for row in hosts:
+        if row[2]:
+            by_serial.setdefault(row[2], row)
+        by_name.setdefault(row[1], row)
+    locations = {name: id for id, name in locations_db.fetch_tuples('SELECT id, name FROM locations')}
+
+    new_locations = []
+    for vm in vms:
+        node = vm.get('node')
+        if node and node not in locations:
+            locations[node] = uuid.uuid4().hex[:12]
+            new_locations.append((locations[node], NODE_LOCATION_TYPE, node, vm.get('datacenter'), now, now))
+        if node:
+            vm['locationId'] = locations[node]
+
+    inserts, updates, assigned, seen = [], [], [], {}
+    for vm in vms:
+        row = by_serial.get(vm['serialNumber']) if vm['serialNumber'] else None
+        row = row or by_name.get(vm['vmName'])
+        key = row[0] if row else vm['vmName']
+        if key in seen:
+            errors.append({'vmName': vm['vmName'], 'error': f'Same host as {seen[key]} earlier in the import'})
+            continue
+        seen[key] = vm['vmName']
+        if row is None:
+            host_id = uuid.uuid4().hex[:12]
+            values = [vm[f] for f in HOST_FIELDS]
+            values[HOST_FIELDS.index('hostType')] = vm['hostType'] or 'vm'
+            values[HOST_FIELDS.index('favorite')] = vm['favorite'] or 0
+            inserts.append((host_id, company, *values, now, now))
+            counts['added'] += 1
+            if len(changes) < MAX_REPORTED:
+                changes.append({'op': 'add', 'id': host_id, 'vmName': vm['vmName']})
+        elif not update_existing:
+            counts['skipped'] += 1
+            continue
+        else:
+            host_id, current = row[0], row[1:]
+            # Fields this export does not carry keep their stored value
+            values = [current[i] if vm[f] is None else vm[f] for i, f in enumerate(HOST_FIELDS)]
+            if values != list(current):
+                updates.append((*values, now, host_id))
+                counts['updated'] += 1
+                if len(changes) < MAX_REPORTED:
+                    changes.append({'op': 'update', 'id': host_id, 'vmName': vm['vmName'],
+                                    'fields': {f: [old, new] for f, old, new in zip(HOST_FIELDS, current, values)
+                                               if old != new}})
+            else:
+                counts['unchanged'] += 1
+        assigned.extend((address, host_id) for address in vm['ips'])
+    counts['missing'] = len({row[0] for row in hosts} - set(seen))
+
+    # IPManager.register(): assign the address to its host, in its subnet, adding the row if needed
+    owners, addresses = {}, []
+    for address, host_id in assigned:
+        if address in owners:
+            if owners[address] != host_id:
+                errors.append({'ipAddress': address, 'error': 'Address listed for more than one VM'})
+            continue
+        owners[address] = host_id
+        addresses.append(address)
+    _, valid = ipmath.parse(addresses)
+    errors.extend({'ipAddress': a, 'error': 'Invalid IPv4 address'} for a, ok in zip(addresses, valid) if not ok)
+    addresses = [a for a, ok in zip(addresses, valid) if ok]
+    subnets = _locate_subnets(db, addresses)
+    existing = _existing_ips(db, addresses)
+    ip_inserts, ip_updates = [], []
+    for address, subnet_id in zip(addresses, subnets):
+        host_id = owners[address]
+        if address not in existing:
+            ip_inserts.append((uuid.uuid4().hex[:12], address, subnet_id, host_id, 'assigned', now, now))
+            continue
+        ip_id, old_host, status, old_subnet = existing[address]
+        subnet_id = subnet_id or old_subnet
+        if (old_host, status, old_subnet) != (host_id, 'assigned', subnet_id):
+            ip_updates.append((host_id, subnet_id, now, ip_id))
+    counts['ipsAdded'], counts['ipsUpdated'] = len(ip_inserts), len(ip_updates)
+    counts['locationsAdded'] = len(new_locations)
+
+    if not dry_run:
+        if new_locations:
+            locations_db.bulk_insert('locations', ('id', 'type', 'name', 'datacenter', 'createdAt', 'updatedAt'),
+                                     new_locations)
+        if inserts:
+            db.bulk_insert('hosts', ('id', 'companyId', *HOST_FIELDS, 'createdAt', 'updatedAt'), inserts)
+        if updates:
+            assignments = ''.join(f'{f} = ?, ' for f in HOST_FIELDS)
+            db.executemany(f'UPDATE hosts SET {assignments}updatedAt = ?, version = version + 1 WHERE id = ?',
+                           updates)
+        if ip_inserts:
+            db.bulk_insert('ips', ('id', 'ipAddress', 'subnetId', 'hostId', 'status', 'createdAt', 'updatedAt'),
+                           ip_inserts)
+        if ip_updates:
+            db.executemany("UPDATE ips SET hostId = ?, status = 'assigned', subnetId = ?, updatedAt = ?, "
+                           'version = version + 1 WHERE id = ?', ip_updates)
+    return {'counts': counts, 'errors': errors[:MAX_REPORTED], 'changes': changes}
+
+
+def run(files, db, company=None, locations_db=None, update_existing=True, dry_run=False, workers=None):
+    """Parse the files and reconcile their VMs; the report lists each file with its format and VM count.
+
+    Raises InventoryError when not one of the files could be read.
+    """
+    parsed = parse_files(files, workers)
+    if parsed and all(result['unreadable'] for result in parsed):
+        raise InventoryError('No export file could be read: ' +
+                             '; '.join(f'{r["name"]}: {r["errors"][0]["error"]}' for r in parsed))
+    vms = [vm for result in parsed for vm in result['vms']]
+    report = reconcile(db, vms, company, locations_db, update_existing, dry_run)
+    report['errors'] = [{'file': result['name'], **error} for result in parsed
+                        for error in result['errors']][:MAX_REPORTED] + report['errors']
+    report['files'] = [{'name': r['name'], 'format': r['format'], 'vms': len(r['vms'])} for r in parsed]
+    report['dryRun'] = dry_run
+    return report
+
+
+def main(argv=None):
+    import database
+    import shards
+    parser = argparse.ArgumentParser(description='Import Proxmox / vSphere VM inventory into OpenIPAM hosts')
+    parser.add_argument('files', nargs='+', help='pvesh JSON, RVTools vInfo CSV or OpenIPAM inventory CSV')
+    parser.add_argument('--company', help='company id the VMs belong to')
+    parser.add_argument('--format', choices=FORMATS, help='format of every file (default: detected)')
+    parser.add_argument('--dry-run', action='store_true', help='report the changes without writing them')
+    parser.add_argument('--no-update', action='store_true', help='only add new hosts')
+    parser.add_argument('--workers', type=int, help=f'parser processes (default {WORKERS})')
+    args = parser.parse_args(argv)
+
+    files = []
+    for path in args.files:
+        with open(path, 'rb') as f:
+            files.append((os.path.basename(path), f.read(), args.format))
+    database.init_db()
+    main_db = database.engine.connect()
+    db = main_db
+    try:
+        if args.company and not main_db.execute('SELECT 1 FROM companies WHERE id = ?', (args.company,)).fetchone():
+            print(f'Unknown company: {args.company}', file=sys.stderr)
+            return 2
+        if shards.ENABLED and args.company:
+            database.engine.ensure_shard(args.company, registered=True)
+            db = database.engine.open_shard(args.company)
+        try:
+            report = run(files, db, args.company, main_db, not args.no_update, args.dry_run, args.workers)
+        except InventoryError as e:
+            print(e, file=sys.stderr)
+            return 2
+        db.commit()
+        main_db.commit()
+    finally:
+        if db is not main_db:
+            db.close()
+        database.engine.release(main_db)
+    report['changes'] = report['changes'][:20]
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
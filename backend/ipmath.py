@@ -0,0 +1,293 @@
+"""Batch IP address and CIDR arithmetic.
+
+IPUtils (modules/utils.js) works on one dotted-quad string at a time. This
+module does the same jobs for whole columns at once, for validation, imports
+and conflict checks on the server:
+
+    values, valid = ipmath.parse(addresses)                 # text -> integers
+    starts, ends, prefixlens, valid = ipmath.networks(['10.0.0.0/8', ...])
+    owner = ipmath.locate(values, starts, ends)             # narrowest range per address, -1 for none
+    other = ipmath.overlaps(starts, ends)                   # a range each one collides with, -1 for none
+    starts, prefixlens = ipmath.summarize(starts, ends)     # fewest CIDR blocks covering the ranges
+    texts = ipmath.to_text(starts)
+
+With NumPy, IPv4 addresses are uint32 (uint64 for range arithmetic), parsing is
+a few vectorized passes over the characters, and containment is one sorted
+searchsorted, so a million addresses take a fraction of a second (see
+benchmarks/addresses.py). NumPy has no 128-bit integers, so IPv6 (version=6)
+values are Python ints in object arrays: correct, but at Python speed.
+
+NumPy is optional (see requirements.txt). Without it the same functions return
+lists and run on bisect and the ipaddress module: fine for thousands of
+addresses, but tens of seconds for a million. Rows
+that fail to parse come back with ``valid`` False and a value of 0; leave them
+out before calling locate(), overlaps() or summarize().
+"""
+import bisect
+import ipaddress
+
+try:
+    import numpy as np
+except ImportError:  # optional dependency, see requirements.txt
+    np = None
+
+BITS = {4: 32, 6: 128}
+# Longest dotted quad, 255.255.255.255
+V4_WIDTH = 15
+
+_ZERO, _DOT, _NUL = ord('0'), ord('.'), 0
+
+
+def available():
+    """Whether the vectorized (NumPy) implementation is in use."""
+    return np is not None
+
+
+def _check_version(version):
+    if version not in BITS:
+        raise ValueError(f'Unknown IP version: {version}')
+
+
+# --- Parsing ---
+
+def parse(addresses, version=4):
+    """Integer values of address strings: (values, valid)."""
+    _check_version(version)
+    if np is not None and version == 4:
+        return _parse4(np.asarray(addresses, dtype=str).reshape(-1))
+    values, valid = [], []
+    for text in addresses:
+        try:
+            addr = ipaddress.ip_address(text)
+        except (TypeError, ValueError):
+            addr = None
+        ok = addr is not None and addr.version == version
+        values.append(int(addr) if ok else 0)
+        valid.append(ok)
+    if np is not None:
+        return np.array(values, dtype=object), np.array(valid, dtype=bool)
+    return values, valid
+
+
+def _parse4(text):
+    """Dotted quads to uint32, one vectorized pass per character column."""
+    n = len(text)
+    if n == 0:
+        return np.zeros(0, np.uint32), np.zeros(0, bool)
+    width = text.dtype.itemsize // 4
+    chars = np.ascontiguousarray(text).view(np.uint32).reshape(n, width)
+    valid = np.ones(n, bool)
+    if width > V4_WIDTH:
+        valid &= chars[:, V4_WIDTH] == _NUL
+    # One contiguous row per character position; anything outside Latin-1 becomes 255, which is invalid anyway
+    columns = np.minimum(chars[:, :V4_WIDTH], 255).astype(np.uint8).T.copy()
+    value = np.zeros(n, np.uint32)
+    octet = np.zeros(n, np.uint16)
+    digits = np.zeros(n, np.uint8)
+    leading_zero = np.zeros(n, bool)
+    dots = np.zeros(n, np.uint8)
+    ended = np.zeros(n, bool)
+
+    def close(sep):
+        # An octet needs 1-3 digits, no leading zero and a value below 256
+        ok = (digits - np.uint8(1) < 3) & (octet < 256) & ~(leading_zero & (digits > 1))
+        valid[sep & ~ok] = False
+        np.copyto(value, (value << np.uint32(8)) | octet, where=sep)
+
+    for column in columns:
+        digit = column - np.uint8(_ZERO)
+        is_digit = digit < 10
+        is_dot = column == _DOT
+        is_nul = column == _NUL
+        valid &= is_digit | is_dot | is_nul
+        close(is_dot | (is_nul & ~ended))
+        np.copyto(leading_zero, digit == 0, where=digits == 0)
+        leading_zero &= is_digit
+        # In place: octet = octet * 10 + digit on digits, 0 otherwise
+        octet *= np.uint16(10)
+        octet += digit
+        octet *= is_digit
+        digits += np.uint8(1)
+        digits *= is_digit
+        dots += is_dot
+        ended |= is_nul
+    # Quads filling every column have no terminating NUL
+    close(~ended)
+    valid &= dots == 3
+    return np.where(valid, value, 0).astype(np.uint32), valid
+
+
+def networks(prefixes, version=4):
+    """Bounds of CIDR strings ("10.0.0.0/8"; a bare address is a host route): (starts, ends, prefixlens, valid).
+
+    Host bits are ignored, like ipaddress.ip_network(strict=False).
+    """
+    _check_version(version)
+    if np is not None and version == 4:
+        text = np.asarray(prefixes, dtype=str).reshape(-1)
+        if len(text) == 0:
+            return np.zeros(0, np.uint64), np.zeros(0, np.uint64), np.zeros(0, np.int64), np.zeros(0, bool)
+        parts = np.char.partition(text, '/')
+        values, valid = _parse4(parts[:, 0])
+        lengths = parts[:, 2]
+        bare = parts[:, 1] == ''
+        numeric = np.char.isdigit(lengths) & (np.char.str_len(lengths) <= 2)
+        prefixlens = np.where(bare, 32, np.where(numeric, lengths, '0').astype(np.int64))
+        valid &= (bare | numeric) & (prefixlens <= 32)
+        prefixlens = np.where(valid, prefixlens, 32)
+        size = np.left_shift(np.uint64(1), (32 - prefixlens).astype(np.uint64))
+        starts = np.where(valid, values.astype(np.uint64) & ~(size - np.uint64(1)), np.uint64(0))
+        return starts, starts + size - np.uint64(1), prefixlens, valid
+    starts, ends, prefixlens, valid = [], [], [], []
+    for text in prefixes:
+        try:
+            net = ipaddress.ip_network(text, strict=False)
+        except (TypeError, ValueError):
+            net = None
+        ok = net is not None and net.version == version
+        starts.append(int(net.network_address) if ok else 0)
+        ends.append(int(net.broadcast_address) if ok else 0)
+        prefixlens.append(net.prefixlen if ok else BITS[version])
+        valid.append(ok)
+    if np is not None:
+        return (np.array(starts, dtype=object), np.array(ends, dtype=object),
+                np.array(prefixlens, dtype=np.int64), np.array(valid, dtype=bool))
+    return starts, ends, prefixlens, valid
+
+
+def to_text(values, version=4):
+    """Address strings for integer values."""
+    _check_version(version)
+    if np is not None and version == 4:
+        values = np.asarray(values, dtype=np.uint64)
+        # Octets through a 256-entry table: much faster than formatting each integer
+        octets = np.array([str(i) for i in range(256)])
+        text = octets[(values >> np.uint64(24)).astype(np.intp) & 255]
+        for shift in (16, 8, 0):
+            text = np.char.add(np.char.add(text, '.'), octets[(values >> np.uint64(shift)).astype(np.intp) & 255])
+        return text
+    texts = [str(ipaddress.ip_address(int(v))) if version == 4 else str(ipaddress.IPv6Address(int(v)))
+             for v in values]
+    return np.array(texts, dtype=str) if np is not None else texts
+
+
+# --- Containment and overlap ---
+
+def locate(values, starts, ends):
+    """Index of the narrowest range [start, end] containing each value, -1 where none does.
+
+    The range boundaries cut the address space into segments, each owned by
+    the narrowest range covering it; every value then costs one binary search.
+    """
+    if np is not None:
+        values = np.asarray(values)
+        starts, ends = np.asarray(starts), np.asarray(ends)
+        if len(starts) == 0:
+            return np.full(len(values), -1, np.int64)
+        bounds = np.unique(np.concatenate([starts, ends + 1]))
+        owner = np.full(len(bounds), -1, np.int64)
+        first, stop = np.searchsorted(bounds, starts), np.searchsorted(bounds, ends + 1)
+        # Widest first, so nested ranges overwrite their parents
+        for i in np.argsort(ends - starts, kind='stable')[::-1]:
+            owner[first[i]:stop[i]] = i
+        segment = np.searchsorted(bounds, values, side='right') - 1
+        return np.where(segment >= 0, owner[np.maximum(segment, 0)], -1)
+    if not starts:
+        return [-1] * len(values)
+    bounds = sorted(set(starts) | {end + 1 for end in ends})
+    owner = [-1] * len(bounds)
+    for i in sorted(range(len(starts)), key=lambda i: ends[i] - starts[i], reverse=True):
+        first, stop = bisect.bisect_left(bounds, starts[i]), bisect.bisect_left(bounds, ends[i] + 1)
+        owner[first:stop] = [i] * (stop - first)
+    result = []
+    for value in values:
+        segment = bisect.bisect_right(bounds, value) - 1
+        result.append(owner[segment] if segment >= 0 else -1)
+    return result
+
+
+def overlaps(starts, ends):
+    """For each range, the index of a range sharing addresses with it, -1 for none.
+
+    Ranges are swept in start order against the furthest end seen so far, so
+    every range that overlaps any other gets a partner.
+    """
+    n = len(starts)
+    if np is not None:
+        starts, ends = np.asarray(starts), np.asarray(ends)
+        other = np.full(n, -1, np.int64)
+        if n < 2:
+            return other
+        order = np.lexsort((ends, starts))
+        s, e = starts[order], ends[order]
+        reach = np.maximum.accumulate(e)
+        holder = np.maximum.accumulate(np.where(e == reach, np.arange(n), 0))
+        hit = np.flatnonzero(s[1:] <= reach[:-1]) + 1
+        other[order[hit]] = order[holder[hit - 1]]
+        # The earlier range of each pair points back at a later one
+        first = order[holder[hit - 1]]
+        free = other[first] == -1
+        other[first[free]] = order[hit[free]]
+        return other
+    other = [-1] * n
+    reach = holder = None
+    for i in sorted(range(n), key=lambda i: (starts[i], ends[i])):
+        if holder is not None and starts[i] <= reach:
+            other[i] = holder
+            if other[holder] == -1:
+                other[holder] = i
+        if reach is None or ends[i] > reach:
+            reach, holder = ends[i], i
+    return other
+
+
+# --- Summarization ---
+
+def summarize(starts, ends, version=4):
+    """Fewest CIDR blocks covering the union of the ranges: (starts, prefixlens) in address order.
+
+    Overlapping and adjacent ranges are merged first; pass the same values as
+    starts and ends to summarize single addresses.
+    """
+    _check_version(version)
+    if np is not None and version == 4:
+        starts = np.asarray(starts, dtype=np.uint64)
+        ends = np.asarray(ends, dtype=np.uint64)
+        if len(starts) == 0:
+            return np.zeros(0, np.uint64), np.zeros(0, np.int64)
+        order = np.lexsort((ends, starts))
+        s, e = starts[order], ends[order]
+        reach = np.maximum.accumulate(e)
+        new = np.ones(len(s), bool)
+        new[1:] = s[1:] > reach[:-1] + np.uint64(1)
+        merged_starts, merged_ends = s[new], reach[np.r_[np.flatnonzero(new)[1:] - 1, len(s) - 1]]
+        out_starts, out_lengths = [], []
+        while len(merged_starts):
+            # Largest block that is aligned on the start and fits in what's left of the range
+            aligned = merged_starts & (~merged_starts + np.uint64(1))
+            aligned = np.where(aligned == 0, np.uint64(1) << np.uint64(32), aligned)
+            fits = np.frexp((merged_ends - merged_starts + np.uint64(1)).astype(np.float64))[1] - 1
+            size = np.minimum(aligned, np.uint64(1) << fits.astype(np.uint64))
+            out_starts.append(merged_starts)
+            out_lengths.append(32 - (np.frexp(size.astype(np.float64))[1] - 1))
+            merged_starts = merged_starts + size
+            left = merged_starts <= merged_ends
+            merged_starts, merged_ends = merged_starts[left], merged_ends[left]
+        starts, prefixlens = np.concatenate(out_starts), np.concatenate(out_lengths).astype(np.int64)
+        order = np.argsort(starts, kind='stable')
+        return starts[order], prefixlens[order]
+    address = ipaddress.IPv4Address if version == 4 else ipaddress.IPv6Address
+    blocks, reach = [], None
+    for start, end in sorted(zip((int(s) for s in starts), (int(e) for e in ends))):
+        if reach is not None and start <= reach[1] + 1:
+            reach[1] = max(reach[1], end)
+            continue
+        if reach is not None:
+            blocks.extend(ipaddress.summarize_address_range(address(reach[0]), address(reach[1])))
+        reach = [start, end]
+    if reach is not None:
+        blocks.extend(ipaddress.summarize_address_range(address(reach[0]), address(reach[1])))
+    starts, prefixlens = [int(b.network_address) for b in blocks], [b.prefixlen for b in blocks]
+    if np is not None:
+        return np.array(starts, dtype=object), np.array(prefixlens, dtype=np.int64)
+    return starts, prefixlens
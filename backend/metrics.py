@@ -0,0 +1,227 @@
+"""Prometheus-style request and SQL metrics for the OpenIPAM backend.
+
+Series are created the first time a label set is seen and reused afterwards,
+so observing a value on the hot path is a bisect plus two increments.
+"""
+import re
+import threading
+from bisect import bisect_left
+from time import perf_counter
+from flask import request, g
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216, 67108864)
+
+_lock = threading.Lock()
+REGISTRY = []
+
+
+def _format_labels(names, values, extra=''):
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.label_names = labels
+        self._series = {}
+        REGISTRY.append(self)
+
+    def inc(self, labels=(), amount=1):
+        with _lock:
+            self._series[labels] = self._series.get(labels, 0) + amount
+
+    def collect(self):
+        with _lock:
+            items = list(self._series.items())
+        for labels, value in items:
+            yield f'{self.name}{_format_labels(self.label_names, labels)} {_format_value(value)}'
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def dec(self, labels=(), amount=1):
+        self.inc(labels, -amount)
+
+    def set(self, value, labels=()):
+        with _lock:
+            self._series[labels] = value
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, buckets, labels=()):
+        self.name = name
+        self.help = help_text
+        self.buckets = buckets
+        self.label_names = labels
+        self._series = {}
+        REGISTRY.append(self)
+
+    def observe(self, value, labels=()):
+        series = self._series.get(labels)
+        if series is None:
+            with _lock:
+                # [per-bucket counts (+Inf last), sum]
+                series = self._series.setdefault(labels, [[0] * (len(self.buckets) + 1), 0.0])
+        i = bisect_left(self.buckets, value)
+        with _lock:
+            series[0][i] += 1
+            series[1] += value
+
+    def collect(self):
+        with _lock:
+            items = [(labels, list(s[0]), s[1]) for labels, s in self._series.items()]
+        for labels, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                le = _format_labels(self.label_names, labels, f'le="{_format_value(float(bound))}"')
+                yield f'{self.name}_bucket{le} {cumulative}'
+            cumulative += counts[-1]
+            inf = _format_labels(self.label_names, labels, 'le="+Inf"')
+            plain = _format_labels(self.label_names, labels)
+            yield f'{self.name}_bucket{inf} {cumulative}'
+            yield f'{self.name}_sum{plain} {_format_value(total)}'
+            yield f'{self.name}_count{plain} {cumulative}'
+
+
+# --- HTTP metrics ---
+http_requests = Counter('openipam_http_requests_total', 'HTTP requests handled',
+                        ('blueprint', 'endpoint', 'method', 'status'))
+http_latency = Histogram('openipam_http_request_duration_seconds', 'HTTP request latency',
+                         LATENCY_BUCKETS, ('blueprint', 'endpoint', 'method'))
+http_response_size = Histogram('openipam_http_response_size_bytes', 'HTTP response body size',
+                               SIZE_BUCKETS, ('blueprint', 'endpoint'))
+http_in_flight = Gauge('openipam_http_requests_in_flight', 'Requests currently being processed')
+
+# --- SQL metrics ---
+sql_latency = Histogram('openipam_db_statement_duration_seconds', 'SQL statement execution time',
+                        LATENCY_BUCKETS, ('verb', 'table'))
+sql_rows_read = Counter('openipam_db_rows_read_total', 'Rows fetched from SQL result sets',
+                        ('verb', 'table'))
+sql_errors = Counter('openipam_db_errors_total', 'SQL statements that raised', ('verb', 'table', 'error'))
+lock_wait = Histogram('openipam_db_lock_wait_seconds',
+                      'Time spent acquiring the write lock (first write of a transaction) and committing',
+                      LATENCY_BUCKETS, ('phase',))
+db_connections = Gauge('openipam_db_connections_open', 'Open request-scoped database connections')
+
+
+# --- Statement classification ---
+_STATEMENT_RE = re.compile(
+    r'^\s*(?:(SELECT|PRAGMA|BEGIN|COMMIT|ROLLBACK|SAVEPOINT|RELEASE)\b(?:.*?\bFROM\s+(\w+))?'
+    r'|(INSERT)\s+(?:OR\s+\w+\s+)?INTO\s+(\w+)'
+    r'|(UPDATE)\s+(?:OR\s+\w+\s+)?(\w+)'
+    r'|(DELETE)\s+FROM\s+(\w+)'
+    r'|(\w+))',
+    re.IGNORECASE | re.DOTALL)
+_statement_cache = {}
+_STATEMENT_CACHE_MAX = 2048
+WRITE_VERBS = frozenset(('INSERT', 'UPDATE', 'DELETE'))
+
+
+def written_table(sql):
+    """Table modified by a write statement, or None for reads and unparsed statements."""
+    verb, table = classify(sql)
+    return table if verb in WRITE_VERBS and table else None
+
+
+def classify(sql):
+    """Return (verb, table) for a SQL string; results are memoized per statement text."""
+    info = _statement_cache.get(sql)
+    if info is None:
+        m = _STATEMENT_RE.match(sql)
+        verb, table = 'OTHER', ''
+        if m:
+            groups = m.groups()
+            for i in range(0, 8, 2):
+                if groups[i]:
+                    verb, table = groups[i].upper(), (groups[i + 1] or '')
+                    break
+            else:
+                verb = (groups[8] or 'OTHER').upper()
+        info = (verb, table)
+        if len(_statement_cache) < _STATEMENT_CACHE_MAX:
+            _statement_cache[sql] = info
+    return info
+
+
+def observe_statement(sql, elapsed, opened_transaction=False):
+    verb, table = classify(sql)
+    sql_latency.observe(elapsed, (verb, table))
+    if opened_transaction and verb in WRITE_VERBS:
+        lock_wait.observe(elapsed, ('acquire',))
+
+
+def observe_error(sql, exc):
+    verb, table = classify(sql)
+    sql_errors.inc((verb, table, type(exc).__name__))
+
+
+def observe_rows(sql, count):
+    if count:
+        sql_rows_read.inc(classify(sql), count)
+
+
+def observe_commit(elapsed):
+    lock_wait.observe(elapsed, ('commit',))
+
+
+# --- Flask integration ---
+def _start_timer():
+    g._metrics_start = perf_counter()
+    http_in_flight.inc()
+
+
+def _record_response(response):
+    start = g.get('_metrics_start')
+    if start is None:
+        return response
+    elapsed = perf_counter() - start
+    endpoint = request.endpoint or 'unmatched'
+    blueprint = request.blueprint or ''
+    http_latency.observe(elapsed, (blueprint, endpoint, request.method))
+    http_requests.inc((blueprint, endpoint, request.method, str(response.status_code)))
+    if not response.is_streamed:
+        http_response_size.observe(response.content_length or 0, (blueprint, endpoint))
+    return response
+
+
+def _finish_request(exc=None):
+    if g.pop('_metrics_start', None) is not None:
+        http_in_flight.dec()
+
+
+def render():
+    """Render every registered metric in the Prometheus text exposition format."""
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f'# HELP {metric.name} {metric.help}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        lines.extend(metric.collect())
+    return '\n'.join(lines) + '\n'
+
+
+def init_app(app):
+    """Register the request timing hooks. Call before any other before_request handler."""
+    app.before_request(_start_timer)
+    app.after_request(_record_response)
+    app.teardown_request(_finish_request)
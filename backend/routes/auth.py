@@ -1,12 +1,23 @@
 import os
 import json
+import threading
+import time
 from flask import Blueprint, request, session, redirect, jsonify, make_response, g
-from onelogin.saml2.auth import OneLogin_Saml2_Auth
-from onelogin.saml2.utils import OneLogin_Saml2_Utils
+
+# python3-saml (and the lxml/xmlsec stack under it) is imported on the first SAML
+# request rather than here, so workers that never serve /auth/saml start faster
 
 bp = Blueprint('auth', __name__)
 
 SAML_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'saml')
+SETTINGS_FILE = os.path.join(SAML_PATH, 'settings.json')
+ADVANCED_FILE = os.path.join(SAML_PATH, 'advanced_settings.json')
+
+ENV_OVERRIDES = ('SAML_SP_ENTITY_ID', 'SAML_SP_ACS_URL', 'SAML_SP_SLO_URL', 'SAML_IDP_ENTITY_ID',
+                 'SAML_IDP_SSO_URL', 'SAML_IDP_SLO_URL', 'SAML_IDP_CERT')
+
+# How often (seconds) the config files are stat()ed for changes
+RELOAD_CHECK_INTERVAL = 2.0
 
 
 def _prepare_flask_request():
@@ -25,12 +36,9 @@ def _prepare_flask_request():
 
 def _load_saml_settings():
     """Load SAML settings from JSON files with env var overrides."""
-    settings_file = os.path.join(SAML_PATH, 'settings.json')
-    advanced_file = os.path.join(SAML_PATH, 'advanced_settings.json')
-
-    with open(settings_file, 'r') as f:
+    with open(SETTINGS_FILE, 'r') as f:
         settings = json.load(f)
-    with open(advanced_file, 'r') as f:
+    with open(ADVANCED_FILE, 'r') as f:
         advanced = json.load(f)
 
     # Apply environment variable overrides
@@ -54,11 +62,53 @@ def _load_saml_settings():
     return settings
 
 
+class _SamlConfigCache:
+    """Parsed OneLogin settings, SP metadata and IdP certs, rebuilt only when inputs change.
+
+    The cache key is the mtime of both JSON files plus the SAML_* env overrides.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._key = None
+        self._checked_at = 0.0
+        self.settings = None
+        self.metadata = None
+        self.metadata_errors = None
+
+    @staticmethod
+    def _current_key():
+        return (os.stat(SETTINGS_FILE).st_mtime_ns, os.stat(ADVANCED_FILE).st_mtime_ns,
+                tuple(os.environ.get(k) for k in ENV_OVERRIDES))
+
+    def get(self):
+        now = time.monotonic()
+        if self.settings is not None and now - self._checked_at < RELOAD_CHECK_INTERVAL:
+            return self
+        key = self._current_key()
+        if key != self._key:
+            with self._lock:
+                if key != self._key:
+                    from onelogin.saml2.settings import OneLogin_Saml2_Settings
+                    settings = OneLogin_Saml2_Settings(_load_saml_settings())
+                    metadata = settings.get_sp_metadata()
+                    errors = list(settings.validate_metadata(metadata))
+                    # Format and cache the IdP signing certificates up front
+                    settings.get_idp_cert()
+                    self.settings, self.metadata, self.metadata_errors = settings, metadata, errors
+                    self._key = key
+        self._checked_at = now
+        return self
+
+
+_saml_config = _SamlConfigCache()
+
+
 def _init_saml_auth():
-    """Initialize a OneLogin SAML auth object."""
+    """Initialize a OneLogin SAML auth object from the cached settings."""
+    from onelogin.saml2.auth import OneLogin_Saml2_Auth
     req = _prepare_flask_request()
-    settings = _load_saml_settings()
-    return OneLogin_Saml2_Auth(req, settings)
+    return OneLogin_Saml2_Auth(req, _saml_config.get().settings)
 
 
 @bp.route('/saml/login')
@@ -153,15 +203,11 @@ def saml_sls():
 @bp.route('/saml/metadata')
 def saml_metadata():
     """Serve SP metadata XML for Azure app registration."""
-    auth = _init_saml_auth()
-    settings = auth.get_settings()
-    metadata = settings.get_sp_metadata()
-    errors = settings.validate_metadata(metadata)
-
-    if errors:
-        return jsonify({'error': 'Metadata validation failed', 'details': list(errors)}), 500
+    config = _saml_config.get()
+    if config.metadata_errors:
+        return jsonify({'error': 'Metadata validation failed', 'details': config.metadata_errors}), 500
 
-    resp = make_response(metadata, 200)
+    resp = make_response(config.metadata, 200)
     resp.headers['Content-Type'] = 'text/xml'
     return resp
 
@@ -1,7 +1,16 @@
 import json
+from contextlib import ExitStack, closing
 from datetime import datetime
-from flask import Blueprint, request, jsonify
-from database import get_db
+from itertools import groupby
+from flask import Blueprint, Response, request, jsonify, stream_with_context
+import database
+from database import VERSIONED_TABLES, get_db, close_db
+import backup_diff
+import formats
+import integrity
+import snapshots
+import events
+import shards
 
 bp = Blueprint('backup', __name__)
 
@@ -36,6 +45,52 @@ JSON_FIELDS = {
 }
 
 
+def _column_value(item, col, json_cols):
+    val = item[col]
+    if col in json_cols and val is not None and not isinstance(val, str):
+        val = json.dumps(val)
+    return val
+
+
+def _stamp_versions(table, items):
+    """Carry row versions across a full-table sync, bumping rows whose content changed.
+
+    The browser's local copy has no version column; without this every sync would
+    reset versions to 1 and a stale If-Match would match again.
+    """
+    if table not in VERSIONED_TABLES or not items:
+        return items
+    json_cols = JSON_FIELDS.get(table, [])
+    stored = {r['id']: dict(r) for r in shards.query(table, f'SELECT * FROM {table}')}
+    stamped = []
+    for item in items:
+        row = stored.get(item.get('id'))
+        if row is None:
+            version = item.get('version') or 1
+        else:
+            changed = any(_column_value(item, col, json_cols) != row[col]
+                          for col in item if col in row and col != 'version')
+            version = (row['version'] or 1) + changed
+        stamped.append({**item, 'version': version})
+    return stamped
+
+
+def _insert_items(db, table, items):
+    """Bulk-insert backup items, batching consecutive items that carry the same columns."""
+    if table == 'reservations':
+        db.bulk_insert('reservations', ('id', 'json'),
+                       ((item.get('id', ''), json.dumps(item)) for item in items))
+        return
+
+    json_cols = JSON_FIELDS.get(table, [])
+    valid_cols = db.columns(table)
+
+    # Missing keys are left out rather than sent as NULL so column defaults still apply
+    for cols, group in groupby(items, key=lambda item: tuple(c for c in valid_cols if c in item)):
+        if cols:
+            db.bulk_insert(table, cols, (tuple(_column_value(item, c, json_cols) for c in cols) for item in group))
+
+
 @bp.route('/backup', methods=['GET'])
 def export_backup():
     db = get_db()
@@ -43,9 +98,26 @@ def export_backup():
         'version': 5,
         'timestamp': datetime.utcnow().isoformat() + 'Z',
     }
+    scope = shards.request_scope()
+    if scope:
+        # Per-shard export: the company's own rows and its companies entry
+        backup['company'] = scope
+
+    columnar = formats.columnar_requested()
+    if columnar:
+        # Each table as {columns, rows}; reservations stay objects as they are opaque JSON documents
+        backup['format'] = formats.COLUMNAR
 
     for key, table in TABLES.items():
-        rows = db.execute(f'SELECT * FROM {table}').fetchall()
+        if scope and table not in shards.TENANT_TABLES and table != 'companies':
+            continue
+        if columnar and table != 'reservations':
+            where, parameters = (' WHERE id = ?', (scope,)) if scope and table == 'companies' else ('', ())
+            backup[key] = formats.columnar(shards.connections(table), table, where, parameters)
+            continue
+        rows = shards.query(table, f'SELECT * FROM {table}')
+        if scope and table == 'companies':
+            rows = [r for r in rows if r['id'] == scope]
         json_cols = JSON_FIELDS.get(table, [])
         items = []
         for r in rows:
@@ -65,6 +137,9 @@ def export_backup():
             items.append(d)
         backup[key] = items
 
+    if scope:
+        return formats.respond(backup)
+
     # Settings
     settings_rows = db.execute('SELECT key, value FROM settings').fetchall()
     settings = {}
@@ -75,57 +150,67 @@ def export_backup():
             settings[r['key']] = r['value']
     backup['settings'] = settings
 
-    return jsonify(backup)
+    return formats.respond(backup)
+
+
+def _backup_items(data):
+    """Every table of a backup document as a list of row objects, columnar tables expanded.
+
+    Checked before anything is replaced; ValueError names the first malformed table.
+    """
+    columnar = data.get('format') == formats.COLUMNAR
+    tables = {}
+    for key, table in TABLES.items():
+        items = data.get(key)
+        if items is None:
+            items = []
+        elif columnar and isinstance(items, dict):
+            try:
+                items = formats.expand(items)
+            except ValueError as e:
+                raise ValueError(f'{key}: {e}') from None
+        if not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
+            raise ValueError(f'{key}: expected an array of objects')
+        tables[key] = items
+    return tables
 
 
 @bp.route('/backup', methods=['POST'])
 def import_backup():
-    data = request.get_json()
-    if not data or 'subnets' not in data or 'hosts' not in data:
+    data = formats.request_data()
+    if not isinstance(data, dict) or 'subnets' not in data or 'hosts' not in data:
         return jsonify({'error': 'Invalid backup file'}), 400
+    try:
+        data = {**data, **_backup_items(data)}
+    except ValueError as e:
+        return jsonify({'error': f'Invalid backup file: {e}'}), 400
 
     db = get_db()
+    scoped = shards.request_scope() is not None
+    # Unscoped imports in sharded mode send each tenant row to its company's shard
+    partitioner = shards.Partitioner.for_import(data, TABLES) if shards.ENABLED and not scoped else None
 
     for key, table in TABLES.items():
         items = data.get(key, [])
-        db.execute(f'DELETE FROM {table}')
-
-        if not items:
+        if table in shards.TENANT_TABLES and partitioner:
+            shards.replace_table(table, items, _insert_items, partitioner)
             continue
-
-        if table == 'reservations':
-            for item in items:
-                item_id = item.get('id', '')
-                db.execute('INSERT INTO reservations (id, json) VALUES (?, ?)',
-                           (item_id, json.dumps(item)))
-        else:
-            json_cols = JSON_FIELDS.get(table, [])
-            # Get column names
-            info = db.execute(f'PRAGMA table_info({table})').fetchall()
-            valid_cols = [r['name'] for r in info]
-
-            for item in items:
-                cols = []
-                vals = []
-                for col in valid_cols:
-                    if col in item:
-                        val = item[col]
-                        if col in json_cols and val is not None and not isinstance(val, str):
-                            val = json.dumps(val)
-                        cols.append(col)
-                        vals.append(val)
-                if cols:
-                    placeholders = ','.join(['?'] * len(cols))
-                    db.execute(f'INSERT INTO {table} ({",".join(cols)}) VALUES ({placeholders})', vals)
+        if scoped and table not in shards.TENANT_TABLES:
+            # A company-scoped import only restores that company's shard
+            continue
+        with integrity.replacing(db, table):
+            db.execute(f'DELETE FROM {table}')
+            if items:
+                _insert_items(db, table, items)
 
     # Settings
-    if 'settings' in data and isinstance(data['settings'], dict):
+    if 'settings' in data and isinstance(data['settings'], dict) and not scoped:
         db.execute('DELETE FROM settings')
-        for k, v in data['settings'].items():
-            db.execute('INSERT INTO settings (key, value) VALUES (?, ?)',
-                       (k, json.dumps(v)))
+        db.bulk_insert('settings', ('key', 'value'),
+                       ((k, json.dumps(v)) for k, v in data['settings'].items()))
 
     db.commit()
+    shards.commit()
     return jsonify({'success': True, 'message': 'Backup imported successfully'})
 
 
@@ -139,9 +224,9 @@ def sync_table(table_name):
     if table_name not in ALLOWED_SYNC_TABLES:
         return jsonify({'error': f'Unknown table: {table_name}'}), 400
 
-    body = request.get_json()
+    body = formats.request_data()
     if body is None:
-        return jsonify({'error': 'Missing JSON body'}), 400
+        return jsonify({'error': 'Missing JSON or MessagePack body'}), 400
 
     db = get_db()
 
@@ -151,42 +236,133 @@ def sync_table(table_name):
         if not isinstance(data, dict):
             return jsonify({'error': 'Settings data must be an object'}), 400
         db.execute('DELETE FROM settings')
-        for k, v in data.items():
-            db.execute('INSERT INTO settings (key, value) VALUES (?, ?)',
-                       (k, json.dumps(v)))
+        db.bulk_insert('settings', ('key', 'value'), ((k, json.dumps(v)) for k, v in data.items()))
         db.commit()
         return jsonify({'success': True})
 
     items = body.get('data', [])
     if not isinstance(items, list):
         return jsonify({'error': 'data must be an array'}), 400
+    items = _stamp_versions(table_name, items)
 
-    db.execute(f'DELETE FROM {table_name}')
-
-    if items:
-        if table_name == 'reservations':
-            for item in items:
-                item_id = item.get('id', '')
-                db.execute('INSERT INTO reservations (id, json) VALUES (?, ?)',
-                           (item_id, json.dumps(item)))
-        else:
-            json_cols = JSON_FIELDS.get(table_name, [])
-            info = db.execute(f'PRAGMA table_info({table_name})').fetchall()
-            valid_cols = [r['name'] for r in info]
-
-            for item in items:
-                cols = []
-                vals = []
-                for col in valid_cols:
-                    if col in item:
-                        val = item[col]
-                        if col in json_cols and val is not None and not isinstance(val, str):
-                            val = json.dumps(val)
-                        cols.append(col)
-                        vals.append(val)
-                if cols:
-                    placeholders = ','.join(['?'] * len(cols))
-                    db.execute(f'INSERT INTO {table_name} ({",".join(cols)}) VALUES ({placeholders})', vals)
+    if table_name in shards.TENANT_TABLES and shards.ENABLED and shards.request_scope() is None:
+        shards.replace_table(table_name, items, _insert_items, shards.Partitioner.from_databases())
+    else:
+        with integrity.replacing(db, table_name):
+            db.execute(f'DELETE FROM {table_name}')
+            if items:
+                _insert_items(db, table_name, items)
 
     db.commit()
+    shards.commit()
     return jsonify({'success': True})
+
+
+# --- Online SQLite snapshots ---
+
+@bp.route('/backup/snapshots', methods=['GET'])
+def list_snapshots():
+    return jsonify(snapshots.list_snapshots())
+
+
+@bp.route('/backup/snapshots', methods=['POST'])
+def create_snapshot():
+    try:
+        manifest = snapshots.create_snapshot()
+    except snapshots.SnapshotError as e:
+        return jsonify({'error': str(e)}), 500
+    return jsonify({'success': True, 'snapshot': manifest}), 201
+
+
+@bp.route('/backup/snapshots/<name>/verify', methods=['POST'])
+def verify_snapshot(name):
+    try:
+        result = snapshots.verify_snapshot(name)
+    except snapshots.SnapshotError as e:
+        return jsonify({'error': str(e)}), 404
+    return jsonify(result), (200 if result['ok'] else 409)
+
+
+@bp.route('/backup/snapshots/<name>/restore', methods=['POST'])
+def restore_snapshot(name):
+    # Release this request's connection so the restore isn't blocked by our own read lock
+    close_db()
+    try:
+        result = snapshots.restore_snapshot(name)
+    except snapshots.SnapshotError as e:
+        return jsonify({'error': str(e)}), 400
+    events.publish(ALLOWED_SYNC_TABLES)
+    return jsonify({'success': True, **result})
+
+
+# --- Row-level diff between backups, snapshots and the live database ---
+
+def _diff_source(spec, stack):
+    """One side of a diff: "current", {"snapshot": name} or {"backup": {...}}."""
+    if spec in (None, 'current'):
+        return backup_diff.DatabaseSource(shards.connections, database.engine.byte_collation)
+    if isinstance(spec, dict) and 'snapshot' in spec:
+        path = stack.enter_context(snapshots.extracted(spec['snapshot']))
+        db = stack.enter_context(closing(backup_diff.open_database(path)))
+        return backup_diff.DatabaseSource(lambda table: [db])
+    if isinstance(spec, dict) and 'backup' in spec:
+        return backup_diff.BackupSource(spec['backup'], TABLE_NAME_TO_KEY)
+    raise backup_diff.DiffError('Each side must be "current", {"snapshot": name} or {"backup": {...}}')
+
+
+@bp.route('/backup/diff', methods=['POST'])
+def diff_backup():
+    """What replacing one state with another would change, row by row.
+
+    The body names the two sides, ``from`` (default: the live database) and
+    ``to``; a bare backup document is compared against the live database, i.e.
+    a preview of POSTing it to /backup. The response streams one JSON line per
+    added, removed or changed row and ends with a summary line; ``?summary=1``
+    returns just the summary.
+    """
+    data = formats.request_data()
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Missing JSON or MessagePack body'}), 400
+    if 'to' not in data and 'subnets' in data and 'hosts' in data:
+        data = {'to': {'backup': data}}
+    if 'to' not in data:
+        return jsonify({'error': 'Nothing to compare: give "to" (and optionally "from")'}), 400
+
+    tables = list(TABLES.values()) + ['settings']
+    if shards.request_scope() is not None:
+        # Like a scoped import, only the company's shard is compared
+        tables = [t for t in tables if t in shards.TENANT_TABLES]
+    if data.get('tables'):
+        wanted = [TABLES.get(t, t) for t in data['tables']]
+        unknown = [t for t in wanted if t not in tables]
+        if unknown:
+            return jsonify({'error': f'Unknown tables: {", ".join(map(str, unknown))}'}), 400
+        tables = wanted
+
+    stack = ExitStack()
+    try:
+        old = _diff_source(data.get('from'), stack)
+        new = _diff_source(data['to'], stack)
+    except (backup_diff.DiffError, snapshots.SnapshotError) as e:
+        stack.close()
+        return jsonify({'error': str(e)}), 400
+    records = backup_diff.diff(old, new, tables, JSON_FIELDS, data.get('ignore') or ())
+
+    if request.args.get('summary') in ('1', 'true'):
+        with stack:
+            for record in records:
+                pass
+        return jsonify(record)
+
+    def _lines():
+        with stack:
+            batch = []
+            for record in records:
+                batch.append(json.dumps(record, default=str))
+                if len(batch) >= backup_diff.BATCH_ROWS:
+                    yield '\n'.join(batch) + '\n'
+                    batch = []
+            yield '\n'.join(batch) + '\n'
+
+    return Response(stream_with_context(_lines()), mimetype='application/x-ndjson',
+                    headers={'X-Accel-Buffering': 'no'})
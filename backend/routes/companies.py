@@ -2,10 +2,14 @@ import uuid
 from datetime import datetime
 from flask import Blueprint, request, jsonify
 from database import get_db
+import versioning
+import cache
+import shards
 
 bp = Blueprint('companies', __name__)
 
 @bp.route('/companies', methods=['GET'])
+@cache.cached('companies')
 def list_companies():
     db = get_db()
     rows = db.execute('SELECT * FROM companies').fetchall()
@@ -17,7 +21,7 @@ def get_company(id):
     row = db.execute('SELECT * FROM companies WHERE id = ?', (id,)).fetchone()
     if not row:
         return jsonify({'error': 'Company not found'}), 404
-    return jsonify(dict(row))
+    return versioning.tagged(dict(row))
 
 @bp.route('/companies', methods=['POST'])
 def create_company():
@@ -37,18 +41,28 @@ def create_company():
 def update_company(id):
     data = request.get_json()
     db = get_db()
-    now = datetime.utcnow().isoformat() + 'Z'
-    db.execute(
-        'UPDATE companies SET name=?, code=?, contact=?, email=?, color=?, notes=?, updatedAt=? WHERE id=?',
-        (data.get('name'), data.get('code'), data.get('contact'), data.get('email'),
-         data.get('color'), data.get('notes'), now, id)
-    )
-    db.commit()
-    return jsonify({'success': True, 'message': 'Company updated'})
+    fields = ['name', 'code', 'contact', 'email', 'color', 'notes']
+    values = versioning.changes(data, fields)
+    values['updatedAt'] = datetime.utcnow().isoformat() + 'Z'
+    return versioning.update(db, 'companies', id, values, 'Company not found',
+                             {'success': True, 'message': 'Company updated'})
 
 @bp.route('/companies/<id>', methods=['DELETE'])
 def delete_company(id):
     db = get_db()
-    db.execute('DELETE FROM companies WHERE id = ?', (id,))
-    db.commit()
-    return jsonify({'success': True, 'message': 'Company deleted'})
+    mismatch = versioning.precondition(db, 'companies', id, 'Company not found')
+    if mismatch:
+        return mismatch
+    # ON DELETE of the companyId references (integrity.py): restricted while subnets or hosts
+    # use the company, like CompanyManager.delete(); VLANs are unlinked
+    in_use = [table for table in ('subnets', 'hosts')
+              if shards.query(table, f'SELECT 1 FROM {table} WHERE companyId = ? LIMIT 1', (id,))]
+    if in_use:
+        return jsonify({'error': f'Company still has {" and ".join(in_use)}', 'tables': in_use}), 409
+
+    def unlink(guard, parameters):
+        db.execute('UPDATE vlans SET companyId = NULL, version = version + 1, updatedAt = ? '
+                   f'WHERE companyId = ? AND {guard}', [datetime.utcnow().isoformat() + 'Z', id, *parameters])
+
+    return versioning.delete(db, 'companies', id, 'Company not found',
+                             {'success': True, 'message': 'Company deleted'}, then=unlink)
@@ -2,14 +2,15 @@ import uuid
 from datetime import datetime
 from flask import Blueprint, request, jsonify
 from database import get_db
+import versioning
+import shards
 
 bp = Blueprint('dhcp', __name__)
 
 # --- Scopes ---
 @bp.route('/dhcp/scopes', methods=['GET'])
 def list_scopes():
-    db = get_db()
-    rows = db.execute('SELECT * FROM dhcp_scopes').fetchall()
+    rows = shards.query('dhcp_scopes', 'SELECT * FROM dhcp_scopes')
     return jsonify([dict(r) for r in rows])
 
 @bp.route('/dhcp/scopes/<id>', methods=['GET'])
@@ -18,7 +19,7 @@ def get_scope(id):
     row = db.execute('SELECT * FROM dhcp_scopes WHERE id = ?', (id,)).fetchone()
     if not row:
         return jsonify({'error': 'Scope not found'}), 404
-    return jsonify(dict(row))
+    return versioning.tagged(dict(row))
 
 @bp.route('/dhcp/scopes', methods=['POST'])
 def create_scope():
@@ -40,38 +41,34 @@ def create_scope():
 def update_scope(id):
     data = request.get_json()
     db = get_db()
-    now = datetime.utcnow().isoformat() + 'Z'
-    enabled = data.get('enabled')
-    if enabled is not None:
-        enabled = 1 if enabled else 0
-    db.execute(
-        '''UPDATE dhcp_scopes SET name=?, subnetId=?, startIP=?, endIP=?, leaseTime=?, dns=?, gateway=?, domain=?, enabled=?, notes=?, updatedAt=? WHERE id=?''',
-        (data.get('name'), data.get('subnetId'), data.get('startIP'), data.get('endIP'),
-         data.get('leaseTime'), data.get('dns'), data.get('gateway'), data.get('domain'),
-         enabled, data.get('notes'), now, id)
-    )
-    db.commit()
-    return jsonify({'success': True, 'message': 'DHCP scope updated'})
+    fields = ['name', 'subnetId', 'startIP', 'endIP', 'leaseTime', 'dns', 'gateway', 'domain', 'enabled', 'notes']
+    values = versioning.changes(data, fields)
+    if values.get('enabled') is not None:
+        values['enabled'] = 1 if values['enabled'] else 0
+    values['updatedAt'] = datetime.utcnow().isoformat() + 'Z'
+    return versioning.update(db, 'dhcp_scopes', id, values, 'Scope not found',
+                             {'success': True, 'message': 'DHCP scope updated'})
 
 @bp.route('/dhcp/scopes/<id>', methods=['DELETE'])
 def delete_scope(id):
     db = get_db()
-    db.execute('DELETE FROM dhcp_leases WHERE scopeId = ?', (id,))
-    db.execute('DELETE FROM dhcp_reservations WHERE scopeId = ?', (id,))
-    db.execute('DELETE FROM dhcp_options WHERE scopeId = ?', (id,))
-    db.execute('DELETE FROM dhcp_scopes WHERE id = ?', (id,))
-    db.commit()
-    return jsonify({'success': True, 'message': 'DHCP scope and related data deleted'})
+
+    def delete_related(guard, parameters):
+        for table in ('dhcp_leases', 'dhcp_reservations', 'dhcp_options'):
+            db.execute(f'DELETE FROM {table} WHERE scopeId = ? AND {guard}', [id, *parameters])
+
+    return versioning.delete(db, 'dhcp_scopes', id, 'Scope not found',
+                             {'success': True, 'message': 'DHCP scope and related data deleted'},
+                             then=delete_related)
 
 # --- Leases ---
 @bp.route('/dhcp/leases', methods=['GET'])
 def list_leases():
-    db = get_db()
     scope_id = request.args.get('scopeId')
     if scope_id:
-        rows = db.execute('SELECT * FROM dhcp_leases WHERE scopeId = ?', (scope_id,)).fetchall()
+        rows = shards.query('dhcp_leases', 'SELECT * FROM dhcp_leases WHERE scopeId = ?', (scope_id,))
     else:
-        rows = db.execute('SELECT * FROM dhcp_leases').fetchall()
+        rows = shards.query('dhcp_leases', 'SELECT * FROM dhcp_leases')
     return jsonify([dict(r) for r in rows])
 
 @bp.route('/dhcp/leases/<id>', methods=['GET'])
@@ -80,7 +77,7 @@ def get_lease(id):
     row = db.execute('SELECT * FROM dhcp_leases WHERE id = ?', (id,)).fetchone()
     if not row:
         return jsonify({'error': 'Lease not found'}), 404
-    return jsonify(dict(row))
+    return versioning.tagged(dict(row))
 
 @bp.route('/dhcp/leases', methods=['POST'])
 def create_lease():
@@ -102,32 +99,26 @@ def create_lease():
 def update_lease(id):
     data = request.get_json()
     db = get_db()
-    now = datetime.utcnow().isoformat() + 'Z'
-    db.execute(
-        '''UPDATE dhcp_leases SET scopeId=?, ipAddress=?, macAddress=?, hostname=?, status=?, startTime=?, endTime=?, notes=?, updatedAt=? WHERE id=?''',
-        (data.get('scopeId'), data.get('ipAddress'), data.get('macAddress'),
-         data.get('hostname'), data.get('status'), data.get('startTime'),
-         data.get('endTime'), data.get('notes'), now, id)
-    )
-    db.commit()
-    return jsonify({'success': True, 'message': 'DHCP lease updated'})
+    fields = ['scopeId', 'ipAddress', 'macAddress', 'hostname', 'status', 'startTime', 'endTime', 'notes']
+    values = versioning.changes(data, fields)
+    values['updatedAt'] = datetime.utcnow().isoformat() + 'Z'
+    return versioning.update(db, 'dhcp_leases', id, values, 'Lease not found',
+                             {'success': True, 'message': 'DHCP lease updated'})
 
 @bp.route('/dhcp/leases/<id>', methods=['DELETE'])
 def delete_lease(id):
     db = get_db()
-    db.execute('DELETE FROM dhcp_leases WHERE id = ?', (id,))
-    db.commit()
-    return jsonify({'success': True, 'message': 'DHCP lease deleted'})
+    return versioning.delete(db, 'dhcp_leases', id, 'Lease not found',
+                             {'success': True, 'message': 'DHCP lease deleted'})
 
 # --- Reservations ---
 @bp.route('/dhcp/reservations', methods=['GET'])
 def list_reservations():
-    db = get_db()
     scope_id = request.args.get('scopeId')
     if scope_id:
-        rows = db.execute('SELECT * FROM dhcp_reservations WHERE scopeId = ?', (scope_id,)).fetchall()
+        rows = shards.query('dhcp_reservations', 'SELECT * FROM dhcp_reservations WHERE scopeId = ?', (scope_id,))
     else:
-        rows = db.execute('SELECT * FROM dhcp_reservations').fetchall()
+        rows = shards.query('dhcp_reservations', 'SELECT * FROM dhcp_reservations')
     return jsonify([dict(r) for r in rows])
 
 @bp.route('/dhcp/reservations/<id>', methods=['GET'])
@@ -136,7 +127,7 @@ def get_reservation(id):
     row = db.execute('SELECT * FROM dhcp_reservations WHERE id = ?', (id,)).fetchone()
     if not row:
         return jsonify({'error': 'Reservation not found'}), 404
-    return jsonify(dict(row))
+    return versioning.tagged(dict(row))
 
 @bp.route('/dhcp/reservations', methods=['POST'])
 def create_reservation():
@@ -157,31 +148,26 @@ def create_reservation():
 def update_reservation(id):
     data = request.get_json()
     db = get_db()
-    now = datetime.utcnow().isoformat() + 'Z'
-    db.execute(
-        '''UPDATE dhcp_reservations SET scopeId=?, ipAddress=?, macAddress=?, hostname=?, description=?, updatedAt=? WHERE id=?''',
-        (data.get('scopeId'), data.get('ipAddress'), data.get('macAddress'),
-         data.get('hostname'), data.get('description'), now, id)
-    )
-    db.commit()
-    return jsonify({'success': True, 'message': 'DHCP reservation updated'})
+    fields = ['scopeId', 'ipAddress', 'macAddress', 'hostname', 'description']
+    values = versioning.changes(data, fields)
+    values['updatedAt'] = datetime.utcnow().isoformat() + 'Z'
+    return versioning.update(db, 'dhcp_reservations', id, values, 'Reservation not found',
+                             {'success': True, 'message': 'DHCP reservation updated'})
 
 @bp.route('/dhcp/reservations/<id>', methods=['DELETE'])
 def delete_reservation(id):
     db = get_db()
-    db.execute('DELETE FROM dhcp_reservations WHERE id = ?', (id,))
-    db.commit()
-    return jsonify({'success': True, 'message': 'DHCP reservation deleted'})
+    return versioning.delete(db, 'dhcp_reservations', id, 'Reservation not found',
+                             {'success': True, 'message': 'DHCP reservation deleted'})
 
 # --- Options ---
 @bp.route('/dhcp/options', methods=['GET'])
 def list_options():
-    db = get_db()
     scope_id = request.args.get('scopeId')
     if scope_id:
-        rows = db.execute('SELECT * FROM dhcp_options WHERE scopeId = ?', (scope_id,)).fetchall()
+        rows = shards.query('dhcp_options', 'SELECT * FROM dhcp_options WHERE scopeId = ?', (scope_id,))
     else:
-        rows = db.execute('SELECT * FROM dhcp_options').fetchall()
+        rows = shards.query('dhcp_options', 'SELECT * FROM dhcp_options')
     return jsonify([dict(r) for r in rows])
 
 @bp.route('/dhcp/options', methods=['POST'])
@@ -203,17 +189,14 @@ def create_option():
 def update_option(id):
     data = request.get_json()
     db = get_db()
-    now = datetime.utcnow().isoformat() + 'Z'
-    db.execute(
-        '''UPDATE dhcp_options SET optionCode=?, optionName=?, optionValue=?, updatedAt=? WHERE id=?''',
-        (data.get('optionCode'), data.get('optionName'), data.get('optionValue'), now, id)
-    )
-    db.commit()
-    return jsonify({'success': True, 'message': 'DHCP option updated'})
+    fields = ['optionCode', 'optionName', 'optionValue']
+    values = versioning.changes(data, fields)
+    values['updatedAt'] = datetime.utcnow().isoformat() + 'Z'
+    return versioning.update(db, 'dhcp_options', id, values, 'Option not found',
+                             {'success': True, 'message': 'DHCP option updated'})
 
 @bp.route('/dhcp/options/<id>', methods=['DELETE'])
 def delete_option(id):
     db = get_db()
-    db.execute('DELETE FROM dhcp_options WHERE id = ?', (id,))
-    db.commit()
-    return jsonify({'success': True, 'message': 'DHCP option deleted'})
+    return versioning.delete(db, 'dhcp_options', id, 'Option not found',
+                             {'success': True, 'message': 'DHCP option deleted'})
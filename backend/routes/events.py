@@ -0,0 +1,35 @@
+from flask import Blueprint, request, Response
+import events
+
+bp = Blueprint('events', __name__)
+
+HEARTBEAT_SECONDS = 20
+RETRY_MS = 3000
+
+
+@bp.route('/events', methods=['GET'])
+def event_stream():
+    """Server-Sent Events: one 'change' event per coalesced batch of committed tables."""
+    bus = events.bus
+    last_id = request.headers.get('Last-Event-ID') or request.args.get('lastEventId')
+    after = bus.resume_point(last_id)
+
+    def stream(after):
+        yield f'retry: {RETRY_MS}\n\n'
+        if after is None:
+            # Unknown or too old to replay: tell the client to reload everything
+            after = bus.last_seq
+            yield f'id: {bus.event_id(after)}\nevent: reset\ndata: {{}}\n\n'
+        while True:
+            batch = bus.wait(after, HEARTBEAT_SECONDS)
+            if not batch:
+                yield ': keepalive\n\n'
+                continue
+            for seq, data in batch:
+                yield f'id: {bus.event_id(seq)}\nevent: change\ndata: {data}\n\n'
+                after = seq
+
+    return Response(stream(after), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
@@ -0,0 +1,160 @@
+import csv
+import io
+from datetime import datetime
+from flask import Blueprint, request, jsonify, Response, stream_with_context
+from database import get_db
+import shards
+import xlsx
+
+bp = Blueprint('export', __name__)
+
+# Rows fetched from the cursor and written out per chunk
+BATCH_ROWS = 1000
+
+# key -> (header, SQL over hosts h / ips i, lookup table resolving ids to names)
+HOST_COLUMNS = {
+    'operatingSystem': ('Operating System', 'h.operatingSystem', None),
+    'memoryUsedGB': ('Memory Used (GB)', 'h.memoryUsedGB', None),
+    'memoryAvailableGB': ('Memory Available (GB)', 'h.memoryAvailableGB', None),
+    'vmName': ('VM Name', 'h.vmName', None),
+    'hostType': ('Host Type', "COALESCE(h.hostType, 'vm')", None),
+    'node': ('Node', 'h.node', None),
+    'diskSizeGB': ('Disk Size (GB)', 'h.diskSizeGB', None),
+    'state': ('State', 'h.state', None),
+    'cpuCount': ('CPU Count', 'h.cpuCount', None),
+    'diskUsedGB': ('Disk Used (GB)', 'h.diskUsedGB', None),
+    'memoryTotalGB': ('Memory Total (GB)', 'h.memoryTotalGB', None),
+    'ipAddresses': ('IP Addresses', "group_concat(i.ipAddress, ', ')", None),
+    'favorite': ('Fav', "CASE WHEN h.favorite = 1 THEN '1' ELSE '0' END", None),
+    'id': ('ID', 'h.id', None),
+    'company': ('Company', 'h.companyId', 'companies'),
+    'location': ('Location', 'COALESCE(h.locationId, h.location)', 'locations'),
+    'description': ('Description', 'h.description', None),
+    'serialNumber': ('Serial Number', 'h.serialNumber', None),
+    'vendor': ('Vendor', 'h.vendor', None),
+    'model': ('Model', 'h.model', None),
+    'assetTag': ('Asset Tag', 'h.assetTag', None),
+    'lifecycleStatus': ('Lifecycle Status', 'h.lifecycleStatus', None),
+    'purchaseDate': ('Purchase Date', 'h.purchaseDate', None),
+    'warrantyExpiry': ('Warranty Expiry', 'h.warrantyExpiry', None),
+    'eolDate': ('EOL Date', 'h.eolDate', None),
+    'uPosition': ('U Position', 'h.uPosition', None),
+    'createdAt': ('Created At', 'h.createdAt', None),
+    'updatedAt': ('Updated At', 'h.updatedAt', None),
+}
+# Same columns and headers as CSVManager.export(), so the file imports back unchanged
+DEFAULT_COLUMNS = list(HOST_COLUMNS)[:13]
+
+# query arg -> condition on hosts h
+HOST_FILTERS = {
+    'companyId': 'h.companyId = ?',
+    'locationId': 'h.locationId = ?',
+    'hostType': "COALESCE(h.hostType, 'vm') = ?",
+    'state': 'LOWER(h.state) = LOWER(?)',
+    'favorite': 'h.favorite = ?',
+}
+SEARCH_FILTER = '(h.vmName LIKE ? OR h.operatingSystem LIKE ? OR h.description LIKE ? OR h.serialNumber LIKE ?)'
+
+LOOKUPS = {
+    'companies': 'SELECT id, name FROM companies',
+    'locations': 'SELECT id, name FROM locations',
+}
+
+
+def _selected_columns():
+    """Requested column keys, or (None, error response) for unknown ones."""
+    requested = request.args.get('columns')
+    if not requested:
+        return DEFAULT_COLUMNS, None
+    columns = [c.strip() for c in requested.split(',') if c.strip()]
+    unknown = [c for c in columns if c not in HOST_COLUMNS]
+    if unknown or not columns:
+        return None, (jsonify({'error': f'Unknown columns: {", ".join(unknown) or "(none)"}',
+                               'columns': list(HOST_COLUMNS)}), 400)
+    return columns, None
+
+
+def _where():
+    conditions, parameters = [], []
+    for arg, condition in HOST_FILTERS.items():
+        value = request.args.get(arg)
+        if value not in (None, ''):
+            conditions.append(condition)
+            parameters.append(int(value in ('1', 'true')) if arg == 'favorite' else value)
+    q = request.args.get('q', '').strip()
+    if q:
+        conditions.append(SEARCH_FILTER)
+        parameters.extend([f'%{q}%'] * 4)
+    return (' WHERE ' + ' AND '.join(conditions) if conditions else ''), parameters
+
+
+def _lookup(table):
+    """id -> name for a small shared table (scoped shard connections see it through global_db)."""
+    return {row[0]: row[1] for row in get_db().execute(LOOKUPS[table]).fetchall()}
+
+
+def _text(value):
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def _host_batches(columns):
+    """Yield lists of export rows, one cursor batch at a time."""
+    select = ', '.join(HOST_COLUMNS[c][1] for c in columns)
+    where, parameters = _where()
+    if 'ipAddresses' in columns:
+        sql = f'SELECT {select} FROM hosts h LEFT JOIN ips i ON i.hostId = h.id{where} GROUP BY h.id'
+    else:
+        sql = f'SELECT {select} FROM hosts h{where}'
+    resolvers = [(n, _lookup(HOST_COLUMNS[c][2])) for n, c in enumerate(columns) if HOST_COLUMNS[c][2]]
+    for db in shards.connections('hosts'):
+        cur = db.execute(sql, parameters)
+        while True:
+            rows = cur.fetchmany(BATCH_ROWS)
+            if not rows:
+                break
+            batch = [[_text(v) for v in row] for row in rows]
+            for n, names in resolvers:
+                for values in batch:
+                    values[n] = names.get(values[n], values[n])
+            yield batch
+
+
+def _csv_stream(header, batches):
+    buffer = io.StringIO()
+    # Quoted like CSVManager.export() so CSVManager.parseCSV() reads it back
+    writer = csv.writer(buffer, quoting=csv.QUOTE_ALL, lineterminator='\n')
+    writer.writerow(header)
+    yield buffer.getvalue()
+    for batch in batches:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(('' if v is None else v for v in row) for row in batch)
+        yield buffer.getvalue()
+
+
+def _download(body, mimetype, extension):
+    filename = f'hosts_{datetime.utcnow().strftime("%Y%m%d")}.{extension}'
+    return Response(stream_with_context(body), mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename="{filename}"',
+        'X-Accel-Buffering': 'no',
+    })
+
+
+@bp.route('/export/hosts.csv', methods=['GET'])
+def export_hosts_csv():
+    columns, error = _selected_columns()
+    if error:
+        return error
+    header = [HOST_COLUMNS[c][0] for c in columns]
+    return _download(_csv_stream(header, _host_batches(columns)), 'text/csv', 'csv')
+
+
+@bp.route('/export/hosts.xlsx', methods=['GET'])
+def export_hosts_xlsx():
+    columns, error = _selected_columns()
+    if error:
+        return error
+    header = [HOST_COLUMNS[c][0] for c in columns]
+    return _download(xlsx.stream(header, _host_batches(columns), sheet='Hosts'), xlsx.MIMETYPE, 'xlsx')
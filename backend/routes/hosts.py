@@ -1,15 +1,25 @@
+import time
 import uuid
 from datetime import datetime
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app
 from database import get_db
+import formats
+import host_metrics
+import inventory
+import shards
+import versioning
 
 bp = Blueprint('hosts', __name__)
 
+# Host ids looked up per statement when ingesting metrics
+LOOKUP_BATCH = 500
+
 @bp.route('/hosts', methods=['GET'])
 def list_hosts():
-    db = get_db()
-    rows = db.execute('SELECT * FROM hosts').fetchall()
-    return jsonify([dict(r) for r in rows])
+    if formats.columnar_requested():
+        return formats.respond(formats.columnar(shards.connections('hosts'), 'hosts'))
+    rows = shards.query('hosts', 'SELECT * FROM hosts')
+    return formats.respond([dict(r) for r in rows])
 
 @bp.route('/hosts/<id>', methods=['GET'])
 def get_host(id):
@@ -17,7 +27,7 @@ def get_host(id):
     row = db.execute('SELECT * FROM hosts WHERE id = ?', (id,)).fetchone()
     if not row:
         return jsonify({'error': 'Host not found'}), 404
-    return jsonify(dict(row))
+    return versioning.tagged(dict(row))
 
 @bp.route('/hosts', methods=['POST'])
 def create_host():
@@ -53,19 +63,149 @@ def update_host(id):
               'state', 'cpuCount', 'favorite', 'purchaseDate', 'warrantyExpiry', 'eolDate',
               'lifecycleStatus', 'vendor', 'model', 'assetTag', 'location', 'locationId',
               'uPosition', 'uHeight']
-    set_clauses = ', '.join(f'{f}=?' for f in fields if f in data)
-    values = [data[f] for f in fields if f in data]
-    if not set_clauses:
+    values = versioning.changes(data, fields)
+    if not values:
         return jsonify({'success': True, 'message': 'Nothing to update'})
-    set_clauses += ', updatedAt=?'
-    values.extend([now, id])
-    db.execute(f'UPDATE hosts SET {set_clauses} WHERE id=?', values)
-    db.commit()
-    return jsonify({'success': True, 'message': 'Host updated'})
+    values['updatedAt'] = now
+    return versioning.update(db, 'hosts', id, values, 'Host not found',
+                             {'success': True, 'message': 'Host updated'})
 
 @bp.route('/hosts/<id>', methods=['DELETE'])
 def delete_host(id):
     db = get_db()
-    db.execute('DELETE FROM hosts WHERE id = ?', (id,))
+
+    def release(guard, parameters):
+        # ON DELETE of ips.hostId (integrity.py): release the host's IPs like HostManager.delete()
+        db.execute("UPDATE ips SET hostId = NULL, status = 'available', version = version + 1, updatedAt = ? "
+                   f'WHERE hostId = ? AND {guard}', [datetime.utcnow().isoformat() + 'Z', id, *parameters])
+
+    return versioning.delete(db, 'hosts', id, 'Host not found', {'success': True, 'message': 'Host deleted'},
+                             then=release)
+
+# --- Resource metrics (host_metrics.py) ---
+
+def _refresh_hosts(latest, stale):
+    """Write each host's newest sampled values into its row where they differ.
+
+    Hosts in ``stale`` already hold newer values and are only looked up.
+    Returns the ids found and the number of rows updated.
+    """
+    fields = [*host_metrics.METRICS, *host_metrics.STATUS_FIELDS]
+    assignments = ''.join(f'{f} = ?, ' for f in fields)
+    now = datetime.utcnow().isoformat() + 'Z'
+    ids, found, updated = list(latest), set(), 0
+    for db in shards.connections('hosts'):
+        changed = []
+        for i in range(0, len(ids), LOOKUP_BATCH):
+            chunk = ids[i:i + LOOKUP_BATCH]
+            rows = db.execute(f'SELECT id, {", ".join(fields)} FROM hosts WHERE id IN ({",".join("?" * len(chunk))})',
+                              chunk).fetchall()
+            for row in rows:
+                found.add(row['id'])
+                if row['id'] in stale:
+                    continue
+                sample = latest[row['id']]
+                current = [row[f] for f in fields]
+                # Fields a sample leaves out keep their stored value
+                values = [value if sample.get(f) is None else sample[f] for f, value in zip(fields, current)]
+                if values != current:
+                    changed.append((*values, now, row['id']))
+        if changed:
+            db.executemany(f'UPDATE hosts SET {assignments}updatedAt = ?, version = version + 1 WHERE id = ?', changed)
+            updated += len(changed)
+    return found, updated
+
+
+@bp.route('/hosts/metrics', methods=['POST'])
+def ingest_host_metrics():
+    """Append a batch of resource samples; hosts rows are only written when a value changed."""
+    data = formats.request_data()
+    samples = data.get('samples') if isinstance(data, dict) else data
+    if not isinstance(samples, list) or not samples:
+        return jsonify({'error': 'Expected {"samples": [{"hostId", "ts", ...}, ...]}'}), 400
+    if len(samples) > host_metrics.MAX_SAMPLES:
+        return jsonify({'error': f'At most {host_metrics.MAX_SAMPLES} samples per request'}), 413
+
+    rows, errors = host_metrics.parse(samples)
+    latest = {}
+    for row in rows:
+        if row['hostId'] not in latest or row['ts'] >= latest[row['hostId']]['ts']:
+            latest[row['hostId']] = row
+    db = get_db()
+    found, updated = _refresh_hosts(latest, host_metrics.superseded(db, latest) if latest else set())
+    errors.extend({'hostId': host_id, 'error': 'Host not found'} for host_id in latest if host_id not in found)
+    accepted = [row for row in rows if row['hostId'] in found]
+    if accepted:
+        host_metrics.append(db, accepted)
+    db.commit()
+    shards.commit()
+    if accepted:
+        # Rollups start with the first samples this process takes (off with OPENIPAM_METRICS_ROLLUP_SEC=0)
+        host_metrics.start_scheduler(logger=current_app.logger)
+    return jsonify({'success': True, 'accepted': len(accepted), 'hostsUpdated': updated,
+                    'rejected': len(samples) - len(accepted), 'errors': errors[:100]})
+
+
+def _series(host_id):
+    now = int(time.time())
+    end = request.args.get('to', now, type=int)
+    start = request.args.get('from', end - 86400, type=int)
+    level = request.args.get('resolution') or host_metrics.resolution(start, end)
+    if level not in host_metrics.TABLES or (host_id is None and level == 'raw'):
+        levels = [name for name in host_metrics.TABLES if host_id is not None or name != 'raw']
+        return jsonify({'error': f'resolution must be one of {", ".join(levels)}'}), 400
+    result = host_metrics.series(get_db(), level, start, end, host_id)
+    return formats.respond({'hostId': host_id, 'resolution': level, 'from': start, 'to': end, **result})
+
+
+@bp.route('/hosts/metrics', methods=['GET'])
+def fleet_metrics():
+    """All hosts' rollups added up per bucket, for capacity trends."""
+    return _series(None)
+
+
+@bp.route('/hosts/<id>/metrics', methods=['GET'])
+def get_host_metrics(id):
+    return _series(id)
+
+
+# --- Hypervisor inventory import (inventory.py) ---
+
+@bp.route('/hosts/import', methods=['POST'])
+def import_inventory():
+    """Reconcile hosts with Proxmox / RVTools / inventory CSV exports.
+
+    Takes the export files as multipart uploads, or one file as the raw body.
+    companyId, format, dryRun and updateExisting come from the query string or
+    form fields.
+    """
+    options = request.values
+    fmt = options.get('format') or None
+    if fmt is not None and fmt not in inventory.FORMATS:
+        return jsonify({'error': f'format must be one of {", ".join(inventory.FORMATS)}'}), 400
+    if request.files:
+        files = [(f.filename, f.read(), fmt) for _, f in request.files.items(multi=True)]
+    else:
+        body = request.get_data()
+        files = [('body.json' if request.is_json else 'body.csv', body, fmt)] if body else []
+    if not files:
+        return jsonify({'error': 'Upload one or more export files'}), 400
+
+    company = options.get('companyId') or shards.request_scope()
+    scope = shards.request_scope()
+    if scope is not None and company != scope:
+        return jsonify({'error': 'companyId does not match the company scope'}), 400
+    db = get_db()
+    if company and not db.execute('SELECT 1 FROM companies WHERE id = ?', (company,)).fetchone():
+        return jsonify({'error': f'Unknown company: {company}'}), 400
+    # Unscoped requests write the hosts into the company's shard; locations stay in the main database
+    hosts_db = db if scope is not None or not shards.ENABLED else shards.shard_db(company)
+    try:
+        report = inventory.run(files, hosts_db, company, db,
+                               update_existing=options.get('updateExisting', 'true') in ('1', 'true'),
+                               dry_run=options.get('dryRun') in ('1', 'true'))
+    except inventory.InventoryError as e:
+        return jsonify({'error': str(e)}), 400
     db.commit()
-    return jsonify({'success': True, 'message': 'Host deleted'})
+    shards.commit()
+    return jsonify({'success': True, **report})
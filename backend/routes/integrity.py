@@ -0,0 +1,72 @@
+from flask import Blueprint, request, jsonify
+import integrity
+import shards
+
+bp = Blueprint('integrity', __name__)
+
+MAX_FINDINGS = 1000
+
+
+def _databases():
+    """(company, connection) for each database file the request covers.
+
+    Scoped requests check their shard on its own: references to the shared
+    tables of the attached main database are not journaled there.
+    """
+    company = shards.request_scope()
+    if company is not None:
+        return [(company, shards.shard_db(company))]
+    return shards.databases()
+
+
+def _report(limit, mode=None):
+    counts, items, scanned = {}, [], []
+    for company, db in _databases():
+        db_counts, db_items = integrity.findings(db, limit - len(items))
+        for name, count in db_counts.items():
+            counts[name] = counts.get(name, 0) + count
+        if shards.ENABLED:
+            for item in db_items:
+                item['company'] = company
+        items.extend(db_items)
+        scanned.append(integrity.scanned_at(db))
+    # The oldest scan across the databases, or None while one was never scanned
+    report = {'scannedAt': None if None in scanned else min(scanned, default=None),
+              'total': sum(counts.values()), 'counts': counts, 'findings': items}
+    if mode:
+        report['mode'] = mode
+    return report
+
+
+def _limit():
+    return max(0, min(request.args.get('limit', MAX_FINDINGS, type=int), MAX_FINDINGS))
+
+
+@bp.route('/integrity', methods=['GET'])
+def get_integrity():
+    """Findings stored by the last scan; reading them writes nothing."""
+    return jsonify(_report(_limit()))
+
+
+@bp.route('/integrity/scan', methods=['POST'])
+def scan_integrity():
+    data = request.get_json(silent=True) or {}
+    full = request.args.get('full') in ('1', 'true') or data.get('full') is True
+    modes = {integrity.scan(db, full) for _, db in _databases()}
+    return jsonify(_report(_limit(), 'full' if 'full' in modes else 'incremental'))
+
+
+@bp.route('/integrity/repair', methods=['POST'])
+def repair_integrity():
+    data = request.get_json(silent=True) or {}
+    names = data.get('relations')
+    unknown = [name for name in names or [] if name not in integrity.RELATIONS]
+    if unknown:
+        return jsonify({'error': f'Unknown relations: {", ".join(unknown)}',
+                        'relations': list(integrity.RELATIONS)}), 400
+    repaired = {}
+    for _, db in _databases():
+        integrity.scan(db)
+        for name, count in integrity.repair(db, names).items():
+            repaired[name] = repaired.get(name, 0) + count
+    return jsonify({'success': True, 'repaired': repaired, 'total': sum(repaired.values())})
@@ -2,15 +2,17 @@ import uuid
 from datetime import datetime
 from flask import Blueprint, request, jsonify
 from database import get_db
+import shards
 
 bp = Blueprint('ip_history', __name__)
 
 @bp.route('/ip_history', methods=['GET'])
 def list_ip_history():
-    db = get_db()
     limit = request.args.get('limit', 500, type=int)
-    rows = db.execute('SELECT * FROM ip_history ORDER BY timestamp DESC LIMIT ?', (limit,)).fetchall()
-    return jsonify([dict(r) for r in rows])
+    rows = shards.query('ip_history', 'SELECT * FROM ip_history ORDER BY timestamp DESC LIMIT ?', (limit,))
+    # Each shard returns its newest entries; keep the newest overall
+    rows.sort(key=lambda r: r['timestamp'] or '', reverse=True)
+    return jsonify([dict(r) for r in rows[:limit]])
 
 @bp.route('/ip_history/<id>', methods=['GET'])
 def get_ip_history_entry(id):
@@ -45,7 +47,7 @@ def delete_ip_history_entry(id):
 
 @bp.route('/ip_history', methods=['DELETE'])
 def clear_ip_history():
-    db = get_db()
-    db.execute('DELETE FROM ip_history')
-    db.commit()
+    for db in shards.connections('ip_history'):
+        db.execute('DELETE FROM ip_history')
+        db.commit()
     return jsonify({'success': True, 'message': 'IP history cleared'})
@@ -2,13 +2,16 @@ import uuid
 from datetime import datetime
 from flask import Blueprint, request, jsonify
 from database import get_db
+import versioning
+import cache
+import shards
 
 bp = Blueprint('ip_ranges', __name__)
 
 @bp.route('/ip_ranges', methods=['GET'])
+@cache.cached('ip_ranges')
 def list_ip_ranges():
-    db = get_db()
-    rows = db.execute('SELECT * FROM ip_ranges').fetchall()
+    rows = shards.query('ip_ranges', 'SELECT * FROM ip_ranges')
     return jsonify([dict(r) for r in rows])
 
 @bp.route('/ip_ranges/<id>', methods=['GET'])
@@ -17,7 +20,7 @@ def get_ip_range(id):
     row = db.execute('SELECT * FROM ip_ranges WHERE id = ?', (id,)).fetchone()
     if not row:
         return jsonify({'error': 'IP range not found'}), 404
-    return jsonify(dict(row))
+    return versioning.tagged(dict(row))
 
 @bp.route('/ip_ranges', methods=['POST'])
 def create_ip_range():
@@ -37,18 +40,14 @@ def create_ip_range():
 def update_ip_range(id):
     data = request.get_json()
     db = get_db()
-    now = datetime.utcnow().isoformat() + 'Z'
-    db.execute(
-        'UPDATE ip_ranges SET subnetId=?, startIP=?, endIP=?, purpose=?, name=?, description=?, updatedAt=? WHERE id=?',
-        (data.get('subnetId'), data.get('startIP'), data.get('endIP'),
-         data.get('purpose'), data.get('name'), data.get('description'), now, id)
-    )
-    db.commit()
-    return jsonify({'success': True, 'message': 'IP range updated'})
+    fields = ['subnetId', 'startIP', 'endIP', 'purpose', 'name', 'description']
+    values = versioning.changes(data, fields)
+    values['updatedAt'] = datetime.utcnow().isoformat() + 'Z'
+    return versioning.update(db, 'ip_ranges', id, values, 'IP range not found',
+                             {'success': True, 'message': 'IP range updated'})
 
 @bp.route('/ip_ranges/<id>', methods=['DELETE'])
 def delete_ip_range(id):
     db = get_db()
-    db.execute('DELETE FROM ip_ranges WHERE id = ?', (id,))
-    db.commit()
-    return jsonify({'success': True, 'message': 'IP range deleted'})
+    return versioning.delete(db, 'ip_ranges', id, 'IP range not found',
+                             {'success': True, 'message': 'IP range deleted'})
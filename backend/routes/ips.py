@@ -2,14 +2,18 @@ import uuid
 from datetime import datetime
 from flask import Blueprint, request, jsonify
 from database import get_db
+import formats
+import versioning
+import shards
 
 bp = Blueprint('ips', __name__)
 
 @bp.route('/ips', methods=['GET'])
 def list_ips():
-    db = get_db()
-    rows = db.execute('SELECT * FROM ips').fetchall()
-    return jsonify([dict(r) for r in rows])
+    if formats.columnar_requested():
+        return formats.respond(formats.columnar(shards.connections('ips'), 'ips'))
+    rows = shards.query('ips', 'SELECT * FROM ips')
+    return formats.respond([dict(r) for r in rows])
 
 @bp.route('/ips/<id>', methods=['GET'])
 def get_ip(id):
@@ -17,7 +21,7 @@ def get_ip(id):
     row = db.execute('SELECT * FROM ips WHERE id = ?', (id,)).fetchone()
     if not row:
         return jsonify({'error': 'IP not found'}), 404
-    return jsonify(dict(row))
+    return versioning.tagged(dict(row))
 
 @bp.route('/ips', methods=['POST'])
 def create_ip():
@@ -38,19 +42,14 @@ def create_ip():
 def update_ip(id):
     data = request.get_json()
     db = get_db()
-    now = datetime.utcnow().isoformat() + 'Z'
-    db.execute(
-        'UPDATE ips SET ipAddress=?, subnetId=?, hostId=?, status=?, reservationType=?, reservationDescription=?, dnsName=?, macAddress=?, updatedAt=? WHERE id=?',
-        (data.get('ipAddress'), data.get('subnetId'), data.get('hostId'), data.get('status'),
-         data.get('reservationType'), data.get('reservationDescription'), data.get('dnsName'),
-         data.get('macAddress'), now, id)
-    )
-    db.commit()
-    return jsonify({'success': True, 'message': 'IP updated'})
+    fields = ['ipAddress', 'subnetId', 'hostId', 'status', 'reservationType', 'reservationDescription',
+              'dnsName', 'macAddress']
+    values = versioning.changes(data, fields)
+    values['updatedAt'] = datetime.utcnow().isoformat() + 'Z'
+    return versioning.update(db, 'ips', id, values, 'IP not found',
+                             {'success': True, 'message': 'IP updated'})
 
 @bp.route('/ips/<id>', methods=['DELETE'])
 def delete_ip(id):
     db = get_db()
-    db.execute('DELETE FROM ips WHERE id = ?', (id,))
-    db.commit()
-    return jsonify({'success': True, 'message': 'IP deleted'})
+    return versioning.delete(db, 'ips', id, 'IP not found', {'success': True, 'message': 'IP deleted'})
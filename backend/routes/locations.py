@@ -2,10 +2,14 @@ import uuid
 from datetime import datetime
 from flask import Blueprint, request, jsonify
 from database import get_db
+import versioning
+import cache
+import shards
 
 bp = Blueprint('locations', __name__)
 
 @bp.route('/locations', methods=['GET'])
+@cache.cached('locations')
 def list_locations():
     db = get_db()
     rows = db.execute('SELECT * FROM locations').fetchall()
@@ -17,7 +21,7 @@ def get_location(id):
     row = db.execute('SELECT * FROM locations WHERE id = ?', (id,)).fetchone()
     if not row:
         return jsonify({'error': 'Location not found'}), 404
-    return jsonify(dict(row))
+    return versioning.tagged(dict(row))
 
 @bp.route('/locations', methods=['POST'])
 def create_location():
@@ -40,19 +44,21 @@ def create_location():
 def update_location(id):
     data = request.get_json()
     db = get_db()
-    now = datetime.utcnow().isoformat() + 'Z'
-    db.execute(
-        '''UPDATE locations SET type=?, name=?, datacenter=?, building=?, room=?, rackUnits=?, description=?, address=?, contactName=?, contactPhone=?, contactEmail=?, updatedAt=? WHERE id=?''',
-        (data.get('type'), data.get('name'), data.get('datacenter'), data.get('building'),
-         data.get('room'), data.get('rackUnits'), data.get('description'), data.get('address'),
-         data.get('contactName'), data.get('contactPhone'), data.get('contactEmail'), now, id)
-    )
-    db.commit()
-    return jsonify({'success': True, 'message': 'Location updated'})
+    fields = ['type', 'name', 'datacenter', 'building', 'room', 'rackUnits', 'description', 'address',
+              'contactName', 'contactPhone', 'contactEmail']
+    values = versioning.changes(data, fields)
+    values['updatedAt'] = datetime.utcnow().isoformat() + 'Z'
+    return versioning.update(db, 'locations', id, values, 'Location not found',
+                             {'success': True, 'message': 'Location updated'})
 
 @bp.route('/locations/<id>', methods=['DELETE'])
 def delete_location(id):
     db = get_db()
-    db.execute('DELETE FROM locations WHERE id = ?', (id,))
-    db.commit()
-    return jsonify({'success': True, 'message': 'Location deleted'})
+    mismatch = versioning.precondition(db, 'locations', id, 'Location not found')
+    if mismatch:
+        return mismatch
+    # ON DELETE of hosts.locationId (integrity.py): restricted, like LocationManager.delete()
+    if shards.query('hosts', 'SELECT 1 FROM hosts WHERE locationId = ? LIMIT 1', (id,)):
+        return jsonify({'error': 'Location still has hosts', 'tables': ['hosts']}), 409
+    return versioning.delete(db, 'locations', id, 'Location not found',
+                             {'success': True, 'message': 'Location deleted'})
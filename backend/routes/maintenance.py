@@ -3,24 +3,24 @@ import json
 from datetime import datetime
 from flask import Blueprint, request, jsonify
 from database import get_db
+import versioning
 
 bp = Blueprint('maintenance', __name__)
 
+def _decode(d):
+    for field in ('hostIds', 'subnetIds'):
+        if d.get(field):
+            try:
+                d[field] = json.loads(d[field])
+            except (json.JSONDecodeError, TypeError):
+                pass
+    return d
+
 @bp.route('/maintenance', methods=['GET'])
 def list_maintenance():
     db = get_db()
     rows = db.execute('SELECT * FROM maintenance_windows').fetchall()
-    results = []
-    for r in rows:
-        d = dict(r)
-        for field in ('hostIds', 'subnetIds'):
-            if d.get(field):
-                try:
-                    d[field] = json.loads(d[field])
-                except (json.JSONDecodeError, TypeError):
-                    pass
-        results.append(d)
-    return jsonify(results)
+    return jsonify([_decode(dict(r)) for r in rows])
 
 @bp.route('/maintenance/<id>', methods=['GET'])
 def get_maintenance(id):
@@ -28,14 +28,7 @@ def get_maintenance(id):
     row = db.execute('SELECT * FROM maintenance_windows WHERE id = ?', (id,)).fetchone()
     if not row:
         return jsonify({'error': 'Maintenance window not found'}), 404
-    d = dict(row)
-    for field in ('hostIds', 'subnetIds'):
-        if d.get(field):
-            try:
-                d[field] = json.loads(d[field])
-            except (json.JSONDecodeError, TypeError):
-                pass
-    return jsonify(d)
+    return versioning.tagged(_decode(dict(row)))
 
 @bp.route('/maintenance', methods=['POST'])
 def create_maintenance():
@@ -61,23 +54,21 @@ def create_maintenance():
 def update_maintenance(id):
     data = request.get_json()
     db = get_db()
-    now = datetime.utcnow().isoformat() + 'Z'
-    host_ids = json.dumps(data.get('hostIds', [])) if 'hostIds' in data else None
-    subnet_ids = json.dumps(data.get('subnetIds', [])) if 'subnetIds' in data else None
-    db.execute(
-        '''UPDATE maintenance_windows SET title=?, description=?, type=?, status=?, startTime=?, endTime=?, hostIds=?, subnetIds=?, impact=?, notifyBefore=?, recurring=?, recurringPattern=?, notes=?, statusNotes=?, statusUpdatedAt=?, completedAt=?, updatedAt=? WHERE id=?''',
-        (data.get('title'), data.get('description'), data.get('type'), data.get('status'),
-         data.get('startTime'), data.get('endTime'), host_ids, subnet_ids, data.get('impact'),
-         data.get('notifyBefore'), 1 if data.get('recurring') else 0,
-         data.get('recurringPattern'), data.get('notes'), data.get('statusNotes'),
-         data.get('statusUpdatedAt'), data.get('completedAt'), now, id)
-    )
-    db.commit()
-    return jsonify({'success': True, 'message': 'Maintenance window updated'})
+    fields = ['title', 'description', 'type', 'status', 'startTime', 'endTime', 'hostIds', 'subnetIds', 'impact',
+              'notifyBefore', 'recurring', 'recurringPattern', 'notes', 'statusNotes', 'statusUpdatedAt',
+              'completedAt']
+    values = versioning.changes(data, fields)
+    for field in ('hostIds', 'subnetIds'):
+        if field in values:
+            values[field] = json.dumps(values[field] or [])
+    if 'recurring' in values:
+        values['recurring'] = 1 if values['recurring'] else 0
+    values['updatedAt'] = datetime.utcnow().isoformat() + 'Z'
+    return versioning.update(db, 'maintenance_windows', id, values, 'Maintenance window not found',
+                             {'success': True, 'message': 'Maintenance window updated'}, _decode)
 
 @bp.route('/maintenance/<id>', methods=['DELETE'])
 def delete_maintenance(id):
     db = get_db()
-    db.execute('DELETE FROM maintenance_windows WHERE id = ?', (id,))
-    db.commit()
-    return jsonify({'success': True, 'message': 'Maintenance window deleted'})
+    return versioning.delete(db, 'maintenance_windows', id, 'Maintenance window not found',
+                             {'success': True, 'message': 'Maintenance window deleted'}, _decode)
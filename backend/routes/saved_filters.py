@@ -3,23 +3,27 @@ import uuid
 from datetime import datetime
 from flask import Blueprint, request, jsonify
 from database import get_db
+import filters
+import versioning
 
 bp = Blueprint('saved_filters', __name__)
 
+# Largest page of results returned at once
+MAX_RESULTS_LIMIT = 1000
+
+def _decode(d):
+    if d.get('filters'):
+        try:
+            d['filters'] = json.loads(d['filters'])
+        except (json.JSONDecodeError, TypeError):
+            pass
+    return d
+
 @bp.route('/saved_filters', methods=['GET'])
 def list_saved_filters():
     db = get_db()
     rows = db.execute('SELECT * FROM saved_filters ORDER BY createdAt DESC').fetchall()
-    results = []
-    for r in rows:
-        d = dict(r)
-        if d.get('filters'):
-            try:
-                d['filters'] = json.loads(d['filters'])
-            except (json.JSONDecodeError, TypeError):
-                pass
-        results.append(d)
-    return jsonify(results)
+    return jsonify([_decode(dict(r)) for r in rows])
 
 @bp.route('/saved_filters/<id>', methods=['GET'])
 def get_saved_filter(id):
@@ -27,18 +31,50 @@ def get_saved_filter(id):
     row = db.execute('SELECT * FROM saved_filters WHERE id = ?', (id,)).fetchone()
     if not row:
         return jsonify({'error': 'Saved filter not found'}), 404
-    d = dict(row)
-    if d.get('filters'):
+    return versioning.tagged(_decode(dict(row)))
+
+def _invalid(db, page, spec):
+    """Error message if a typed filter doesn't compile; page states saved by the browser are stored as-is."""
+    if isinstance(spec, str):
         try:
-            d['filters'] = json.loads(d['filters'])
-        except (json.JSONDecodeError, TypeError):
-            pass
-    return jsonify(d)
+            spec = json.loads(spec)
+        except json.JSONDecodeError:
+            return None
+    if not isinstance(spec, dict) or 'conditions' not in spec:
+        return None
+    try:
+        filters.compile_filter(db, page, spec)
+    except filters.FilterError as e:
+        return str(e)
+    return None
+
+@bp.route('/saved_filters/<id>/results', methods=['GET'])
+def saved_filter_results(id):
+    db = get_db()
+    row = db.execute('SELECT * FROM saved_filters WHERE id = ?', (id,)).fetchone()
+    if not row:
+        return jsonify({'error': 'Saved filter not found'}), 404
+    saved = _decode(dict(row))
+    limit = max(0, min(request.args.get('limit', 100, type=int), MAX_RESULTS_LIMIT))
+    offset = max(0, request.args.get('offset', 0, type=int))
+    try:
+        table, ids = filters.matching_ids(saved, request.args.get('sort') or None,
+                                          request.args.get('order') == 'desc')
+    except filters.FilterError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({
+        'id': saved['id'], 'name': saved['name'], 'page': saved['page'], 'table': table,
+        'total': len(ids), 'limit': limit, 'offset': offset,
+        'items': filters.fetch(table, ids[offset:offset + limit]),
+    })
 
 @bp.route('/saved_filters', methods=['POST'])
 def create_saved_filter():
     data = request.get_json()
     db = get_db()
+    error = _invalid(db, data.get('page'), data.get('filters'))
+    if error:
+        return jsonify({'error': error}), 400
     new_id = data.get('id', uuid.uuid4().hex[:12])
     now = datetime.utcnow().isoformat() + 'Z'
     filters_val = data.get('filters')
@@ -55,23 +91,21 @@ def create_saved_filter():
 def update_saved_filter(id):
     data = request.get_json()
     db = get_db()
-    row = db.execute('SELECT * FROM saved_filters WHERE id = ?', (id,)).fetchone()
-    if not row:
-        return jsonify({'error': 'Saved filter not found'}), 404
-    now = datetime.utcnow().isoformat() + 'Z'
-    filters_val = data.get('filters', row['filters'])
-    if filters_val is not None and not isinstance(filters_val, str):
-        filters_val = json.dumps(filters_val)
-    db.execute(
-        'UPDATE saved_filters SET name=?, page=?, filters=?, updatedAt=? WHERE id=?',
-        (data.get('name', row['name']), data.get('page', row['page']), filters_val, now, id)
-    )
-    db.commit()
-    return jsonify({'success': True})
+    values = versioning.changes(data, ['name', 'page', 'filters'])
+    if 'filters' in values:
+        page = values.get('page')
+        if page is None:
+            current = db.execute('SELECT page FROM saved_filters WHERE id = ?', (id,)).fetchone()
+            page = current['page'] if current else None
+        error = _invalid(db, page, values['filters'])
+        if error:
+            return jsonify({'error': error}), 400
+    if values.get('filters') is not None and not isinstance(values['filters'], str):
+        values['filters'] = json.dumps(values['filters'])
+    values['updatedAt'] = datetime.utcnow().isoformat() + 'Z'
+    return versioning.update(db, 'saved_filters', id, values, 'Saved filter not found', {'success': True}, _decode)
 
 @bp.route('/saved_filters/<id>', methods=['DELETE'])
 def delete_saved_filter(id):
     db = get_db()
-    db.execute('DELETE FROM saved_filters WHERE id = ?', (id,))
-    db.commit()
-    return jsonify({'success': True})
+    return versioning.delete(db, 'saved_filters', id, 'Saved filter not found', {'success': True}, _decode)
@@ -22,7 +22,8 @@ def update_settings():
     db = get_db()
     for key, value in data.items():
         db.execute(
-            'INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)',
+            'INSERT INTO settings (key, value) VALUES (?, ?) '
+            'ON CONFLICT (key) DO UPDATE SET value = excluded.value',
             (key, json.dumps(value))
         )
     db.commit()
@@ -1,14 +1,58 @@
 import uuid
+import ipaddress
 from datetime import datetime
 from flask import Blueprint, request, jsonify
 from database import get_db
+import versioning
+import cache
+import shards
 
 bp = Blueprint('subnets', __name__)
 
+
+def _network(network, cidr):
+    try:
+        return ipaddress.ip_network(f'{network}/{cidr}', strict=False)
+    except (TypeError, ValueError):
+        return None
+
+
+def _link_orphans(db, subnet_id, net, guard='1 = 1', guard_parameters=()):
+    """Attach IPs without a subnet that fall inside ``net`` to the subnet (one range UPDATE).
+
+    ``guard`` (versioning.update/delete) keeps the UPDATE from applying when the subnet write did not.
+    """
+    condition, parameters = db.address_in_network('ips', 'ipAddress', net)
+    return db.execute(
+        f"UPDATE ips SET subnetId = ?, version = version + 1 WHERE {condition} AND COALESCE(subnetId, '') = '' "
+        f'AND {guard}', [subnet_id, *parameters, *guard_parameters])
+
+
+def _rehome(db, subnet_id, net, keep=None, guard='1 = 1', guard_parameters=()):
+    """Move the subnet's IPs to the most specific other subnet containing them, or leave them orphaned.
+
+    IPs inside ``keep`` (the subnet's new network on an update) stay where they are.
+    Only subnets overlapping ``net`` can hold its addresses, so each of them gets one
+    range UPDATE, most specific first; whatever is left loses its subnet.
+    """
+    outside, outside_parameters = f' AND {guard}', [*guard_parameters]
+    if keep is not None:
+        condition, parameters = db.address_in_network('ips', 'ipAddress', keep)
+        outside, outside_parameters = f' AND ({condition}) IS NOT TRUE{outside}', [*parameters, *outside_parameters]
+    for row in db.overlapping_subnets(net):
+        parent = _network(row['network'], row['cidr'])
+        if row['id'] == subnet_id or parent is None:
+            continue
+        condition, parameters = db.address_in_network('ips', 'ipAddress', parent)
+        db.execute(f'UPDATE ips SET subnetId = ?, version = version + 1 WHERE subnetId = ? AND {condition}{outside}',
+                   [row['id'], subnet_id, *parameters, *outside_parameters])
+    db.execute(f'UPDATE ips SET subnetId = NULL, version = version + 1 WHERE subnetId = ?{outside}',
+               [subnet_id, *outside_parameters])
+
 @bp.route('/subnets', methods=['GET'])
+@cache.cached('subnets')
 def list_subnets():
-    db = get_db()
-    rows = db.execute('SELECT * FROM subnets').fetchall()
+    rows = shards.query('subnets', 'SELECT * FROM subnets')
     return jsonify([dict(r) for r in rows])
 
 @bp.route('/subnets/<id>', methods=['GET'])
@@ -17,7 +61,7 @@ def get_subnet(id):
     row = db.execute('SELECT * FROM subnets WHERE id = ?', (id,)).fetchone()
     if not row:
         return jsonify({'error': 'Subnet not found'}), 404
-    return jsonify(dict(row))
+    return versioning.tagged(dict(row))
 
 @bp.route('/subnets', methods=['POST'])
 def create_subnet():
@@ -30,25 +74,55 @@ def create_subnet():
         (new_id, data.get('companyId'), data.get('network'), data.get('cidr'), data.get('name'),
          data.get('description'), data.get('vlanId'), data.get('gateway'), data.get('dnsServers'), now, now)
     )
+    net = _network(data.get('network'), data.get('cidr'))
+    linked = _link_orphans(db, new_id, net) if net else None
     db.commit()
-    return jsonify({'success': True, 'id': new_id, 'message': 'Subnet created'}), 201
+    linked = max(linked.rowcount, 0) if linked else 0
+    message = f'Subnet created ({linked} existing IP{"s" if linked != 1 else ""} linked)' if linked else 'Subnet created'
+    return jsonify({'success': True, 'id': new_id, 'message': message, 'linked': linked}), 201
 
 @bp.route('/subnets/<id>', methods=['PUT'])
 def update_subnet(id):
     data = request.get_json()
     db = get_db()
-    now = datetime.utcnow().isoformat() + 'Z'
-    db.execute(
-        'UPDATE subnets SET companyId=?, network=?, cidr=?, name=?, description=?, vlanId=?, gateway=?, dnsServers=?, updatedAt=? WHERE id=?',
-        (data.get('companyId'), data.get('network'), data.get('cidr'), data.get('name'),
-         data.get('description'), data.get('vlanId'), data.get('gateway'), data.get('dnsServers'), now, id)
-    )
-    db.commit()
-    return jsonify({'success': True, 'message': 'Subnet updated'})
+    fields = ['companyId', 'network', 'cidr', 'name', 'description', 'vlanId', 'gateway', 'dnsServers']
+    values = versioning.changes(data, fields)
+    values['updatedAt'] = datetime.utcnow().isoformat() + 'Z'
+    old = new = None
+    if 'network' in values or 'cidr' in values:
+        mismatch = versioning.precondition(db, 'subnets', id, 'Subnet not found')
+        if mismatch:
+            return mismatch
+        row = db.execute('SELECT network, cidr FROM subnets WHERE id = ?', (id,)).fetchone()
+        old = _network(row['network'], row['cidr']) if row else None
+        new = _network(values.get('network', row and row['network']), values.get('cidr', row and row['cidr']))
+
+    def relink(guard, parameters):
+        if old and old != new:
+            _rehome(db, id, old, keep=new, guard=guard, guard_parameters=parameters)
+        if new and old != new:
+            _link_orphans(db, id, new, guard=guard, guard_parameters=parameters)
+
+    return versioning.update(db, 'subnets', id, values, 'Subnet not found',
+                             {'success': True, 'message': 'Subnet updated'}, then=relink)
 
 @bp.route('/subnets/<id>', methods=['DELETE'])
 def delete_subnet(id):
     db = get_db()
-    db.execute('DELETE FROM subnets WHERE id = ?', (id,))
-    db.commit()
-    return jsonify({'success': True, 'message': 'Subnet deleted'})
+    mismatch = versioning.precondition(db, 'subnets', id, 'Subnet not found')
+    if mismatch:
+        return mismatch
+    row = db.execute('SELECT network, cidr FROM subnets WHERE id = ?', (id,)).fetchone()
+    net = _network(row['network'], row['cidr']) if row else None
+
+    def release(guard, parameters):
+        if net:
+            _rehome(db, id, net, guard=guard, guard_parameters=parameters)
+        # ON DELETE of ip_ranges.subnetId and dhcp_scopes.subnetId (integrity.py): unlinked
+        now = datetime.utcnow().isoformat() + 'Z'
+        for table in ('ip_ranges', 'dhcp_scopes'):
+            db.execute(f'UPDATE {table} SET subnetId = NULL, version = version + 1, updatedAt = ? '
+                       f'WHERE subnetId = ? AND {guard}', [now, id, *parameters])
+
+    return versioning.delete(db, 'subnets', id, 'Subnet not found',
+                             {'success': True, 'message': 'Subnet deleted'}, then=release)
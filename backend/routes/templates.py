@@ -1,26 +1,34 @@
 import uuid
 import json
+import ipaddress
 from datetime import datetime
 from flask import Blueprint, request, jsonify
 from database import get_db
+import versioning
+import cache
+import ipmath
+import shards
 
 bp = Blueprint('templates', __name__)
 
+# Most subnets a single apply call may create
+MAX_APPLY_NETWORKS = 1000
+
+def _decode(d):
+    for field in ('ranges', 'reservations'):
+        if d.get(field):
+            try:
+                d[field] = json.loads(d[field])
+            except (json.JSONDecodeError, TypeError):
+                pass
+    return d
+
 @bp.route('/templates', methods=['GET'])
+@cache.cached('subnet_templates')
 def list_templates():
     db = get_db()
     rows = db.execute('SELECT * FROM subnet_templates').fetchall()
-    results = []
-    for r in rows:
-        d = dict(r)
-        for field in ('ranges', 'reservations'):
-            if d.get(field):
-                try:
-                    d[field] = json.loads(d[field])
-                except (json.JSONDecodeError, TypeError):
-                    pass
-        results.append(d)
-    return jsonify(results)
+    return jsonify([_decode(dict(r)) for r in rows])
 
 @bp.route('/templates/<id>', methods=['GET'])
 def get_template(id):
@@ -28,14 +36,7 @@ def get_template(id):
     row = db.execute('SELECT * FROM subnet_templates WHERE id = ?', (id,)).fetchone()
     if not row:
         return jsonify({'error': 'Template not found'}), 404
-    d = dict(row)
-    for field in ('ranges', 'reservations'):
-        if d.get(field):
-            try:
-                d[field] = json.loads(d[field])
-            except (json.JSONDecodeError, TypeError):
-                pass
-    return jsonify(d)
+    return versioning.tagged(_decode(dict(row)))
 
 @bp.route('/templates', methods=['POST'])
 def create_template():
@@ -57,17 +58,230 @@ def create_template():
 def update_template(id):
     data = request.get_json()
     db = get_db()
-    db.execute(
-        '''UPDATE subnet_templates SET name=?, description=?, cidr=?, vlanType=?, ranges=?, reservations=? WHERE id=?''',
-        (data.get('name'), data.get('description'), data.get('cidr'), data.get('vlanType'),
-         json.dumps(data.get('ranges', [])), json.dumps(data.get('reservations', [])), id)
-    )
-    db.commit()
-    return jsonify({'success': True, 'message': 'Template updated'})
+    values = versioning.changes(data, ['name', 'description', 'cidr', 'vlanType', 'ranges', 'reservations'])
+    for field in ('ranges', 'reservations'):
+        if field in values:
+            values[field] = json.dumps(values[field] or [])
+    return versioning.update(db, 'subnet_templates', id, values, 'Template not found',
+                             {'success': True, 'message': 'Template updated'}, _decode)
 
 @bp.route('/templates/<id>', methods=['DELETE'])
 def delete_template(id):
     db = get_db()
-    db.execute('DELETE FROM subnet_templates WHERE id = ?', (id,))
-    db.commit()
-    return jsonify({'success': True, 'message': 'Template deleted'})
+    return versioning.delete(db, 'subnet_templates', id, 'Template not found',
+                             {'success': True, 'message': 'Template deleted'}, _decode)
+
+class ApplyError(Exception):
+    def __init__(self, message, status=400, conflicts=None):
+        super().__init__(message)
+        self.status = status
+        self.conflicts = conflicts or []
+
+
+def _offsets(template):
+    """(ranges, reservations) of a template with integer offsets; built-in templates use start/end."""
+    ranges, reservations = [], []
+    for r in template.get('ranges') or []:
+        start, end = r.get('startOffset', r.get('start')), r.get('endOffset', r.get('end'))
+        try:
+            start, end = int(start), int(end)
+        except (TypeError, ValueError):
+            raise ApplyError(f'Template range {r.get("name") or r.get("description") or ""!r} has no offsets')
+        if start < 0 or end < start:
+            raise ApplyError(f'Template range {start}-{end} is not a valid offset range')
+        ranges.append((start, end, r))
+    for r in template.get('reservations') or []:
+        try:
+            offset = int(r.get('offset'))
+        except (TypeError, ValueError):
+            raise ApplyError('Template reservation has no offset')
+        if offset < 0:
+            raise ApplyError(f'Template reservation offset {offset} is negative')
+        reservations.append((offset, r))
+    return ranges, reservations
+
+
+def _requested(data, template):
+    """Subnets to create: one dict per network with a parsed ``net``."""
+    items = data.get('networks')
+    if items is None:
+        items = [data.get('network')] if data.get('network') else []
+    if not isinstance(items, list) or not items:
+        raise ApplyError('network or networks is required')
+    if len(items) > MAX_APPLY_NETWORKS:
+        raise ApplyError(f'At most {MAX_APPLY_NETWORKS} networks per call')
+    company = data.get('companyId')
+    subnets = []
+    for item in items:
+        item = dict(item) if isinstance(item, dict) else {'network': item}
+        text = str(item.get('network') or '')
+        cidr = item.get('cidr', template.get('cidr'))
+        if '/' not in text and cidr is not None:
+            if ':' in text and 'cidr' not in item:
+                # Template prefix lengths are IPv4 ones: 2001:db8::/24 is not what was meant
+                raise ApplyError(f'IPv6 network {text!r} needs its own prefix length')
+            text = f'{text}/{cidr}'
+        try:
+            item['net'] = ipaddress.ip_network(text, strict=False)
+        except ValueError:
+            raise ApplyError(f'Invalid network: {item.get("network")!r}')
+        if shards.ENABLED and item.get('companyId', company) != company:
+            # The call writes one database: the shard of the body's companyId
+            raise ApplyError('With company shards, every network of a call belongs to the body\'s companyId')
+        subnets.append(item)
+    return subnets
+
+
+def _network(row):
+    try:
+        return ipaddress.ip_network(f'{row["network"]}/{row["cidr"]}', strict=False)
+    except (TypeError, ValueError):
+        return None
+
+
+def _check_overlaps(db, subnets):
+    """Reject networks that already exist or are requested twice; nesting is fine.
+
+    CIDR blocks are either disjoint, nested or equal, so only equal ones
+    conflict. Each network costs one indexed range lookup per database
+    (Connection.overlapping_subnets). Returns the stored subnets of ``db``
+    overlapping each requested network: {index: [(row, network)]}.
+    """
+    conflicts, nearby, seen = [], {}, set()
+    for index, item in enumerate(subnets):
+        net = item['net']
+        if net in seen:
+            conflicts.append(f'{net} is requested twice')
+        seen.add(net)
+        for conn in shards.connections('subnets'):
+            rows = [(row, _network(row)) for row in conn.overlapping_subnets(net)]
+            conflicts.extend(f'{net} (requested) duplicates {row["network"]}/{row["cidr"]} '
+                             f'({row["name"] or row["id"]})' for row, other in rows if other == net)
+            if conn is db:
+                nearby[index] = [(row, other) for row, other in rows if other is not None]
+    if conflicts:
+        raise ApplyError('Networks duplicate existing or requested subnets', 409, conflicts)
+    return nearby
+
+
+def _claimed(db, subnets, nearby):
+    """IPs a requested network takes over: {index: {address int: row}}.
+
+    Those inside it without a stored subnet, and those of a subnet containing
+    it, unless a more specific requested or existing subnet also covers them.
+    Each network reads its addresses with one indexed range condition.
+    """
+    found = {}
+    for index, item in enumerate(subnets):
+        net = item['net']
+        parents = [row['id'] for row, other in nearby.get(index, []) if other != net and other.supernet_of(net)]
+        condition, parameters = db.address_in_network('ips', 'ipAddress', net)
+        owned = f' OR subnetId IN ({",".join("?" * len(parents))})' if parents else ''
+        rows = db.execute(f"SELECT id, ipAddress, status, hostId FROM ips WHERE {condition} AND "
+                          f"(COALESCE(subnetId, '') = '' OR NOT EXISTS "
+                          f"(SELECT 1 FROM subnets s WHERE s.id = ips.subnetId){owned})",
+                          [*parameters, *parents]).fetchall()
+        if not rows:
+            continue
+        # The narrowest of the requested networks and the stored ones nested in this one owns each address
+        ranges = [other for _, other in nearby.get(index, []) if other != net and net.supernet_of(other)]
+        ranges += [other['net'] for other in subnets if other['net'].version == net.version]
+        values, valid = ipmath.parse([row['ipAddress'] for row in rows], net.version)
+        owner = ipmath.locate(values, [int(r.network_address) for r in ranges],
+                              [int(r.broadcast_address) for r in ranges])
+        for row, value, ok, n in zip(rows, values, valid, owner):
+            if ok and n != -1 and ranges[n] == net:
+                found.setdefault(index, {})[int(value)] = row
+    return found
+
+
+def _expand(db, template, data, subnets):
+    """Rows for every table, plus the existing IPs to link, for the requested subnets."""
+    ranges, reservations = _offsets(template)
+    highest = max([end for _, end, _ in ranges] + [offset for offset, _ in reservations] + [0])
+    claimed = _claimed(db, subnets, _check_overlaps(db, subnets))
+    now = datetime.utcnow().isoformat() + 'Z'
+    rows = {'subnets': [], 'ip_ranges': [], 'ips': []}
+    link, reserve, conflicts = [], [], []
+    for index, item in enumerate(subnets):
+        net = item['net']
+        if highest >= net.num_addresses:
+            raise ApplyError(f'Template offsets reach .{highest}, beyond the end of {net}')
+        first = int(net.network_address)
+        subnet_id = uuid.uuid4().hex[:12]
+        rows['subnets'].append((
+            subnet_id, item.get('companyId', data.get('companyId')), str(net.network_address), net.prefixlen,
+            item.get('name', data.get('name')), item.get('description', data.get('description')),
+            item.get('vlanId', data.get('vlanId')), item.get('gateway', data.get('gateway')),
+            item.get('dnsServers', data.get('dnsServers')), now, now))
+        for start, end, r in ranges:
+            rows['ip_ranges'].append((
+                uuid.uuid4().hex[:12], subnet_id, str(net.network_address + start), str(net.network_address + end),
+                r.get('purpose'), r.get('name') or r.get('description'), r.get('description') or '', now, now))
+        existing = dict(claimed.get(index, {}))
+        for offset, r in reservations:
+            address = first + offset
+            row = existing.pop(address, None)
+            if row is None:
+                rows['ips'].append((uuid.uuid4().hex[:12], str(ipaddress.ip_address(address)), subnet_id, None,
+                                    'reserved', r.get('type'), r.get('description'), now, now))
+            elif row['status'] == 'assigned' or row['hostId']:
+                conflicts.append(f'{row["ipAddress"]} is assigned, but the template reserves it in {net}')
+            else:
+                reserve.append((subnet_id, r.get('type'), r.get('description'), now, row['id']))
+        link.extend((subnet_id, row['id']) for row in existing.values())
+    if conflicts:
+        raise ApplyError('Template reservations collide with assigned addresses', 409, conflicts)
+    return rows, link, reserve
+
+
+SUBNET_COLUMNS = ('id', 'companyId', 'network', 'cidr', 'name', 'description', 'vlanId', 'gateway', 'dnsServers',
+                  'createdAt', 'updatedAt')
+RANGE_COLUMNS = ('id', 'subnetId', 'startIP', 'endIP', 'purpose', 'name', 'description', 'createdAt', 'updatedAt')
+IP_COLUMNS = ('id', 'ipAddress', 'subnetId', 'hostId', 'status', 'reservationType', 'reservationDescription',
+              'createdAt', 'updatedAt')
+
+
+@bp.route('/templates/<id>/apply', methods=['POST'])
+def apply_template(id):
+    """Create subnets from a template, with its ranges and reserved IPs, in one transaction."""
+    data = request.get_json(silent=True)
+    if data is None:
+        data = {}
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Expected a JSON object'}), 400
+    db = get_db()
+    row = db.execute('SELECT * FROM subnet_templates WHERE id = ?', (id,)).fetchone()
+    if not row:
+        return jsonify({'error': 'Template not found'}), 404
+    template = _decode(dict(row))
+    try:
+        subnets = _requested(data, template)
+        rows, link, reserve = _expand(db, template, data, subnets)
+    except ApplyError as e:
+        body = {'error': str(e)}
+        if e.conflicts:
+            body['conflicts'] = e.conflicts
+        return jsonify(body), e.status
+    try:
+        db.bulk_insert('subnets', SUBNET_COLUMNS, rows['subnets'])
+        db.bulk_insert('ip_ranges', RANGE_COLUMNS, rows['ip_ranges'])
+        db.bulk_insert('ips', IP_COLUMNS, rows['ips'])
+        if reserve:
+            db.executemany("UPDATE ips SET subnetId = ?, status = 'reserved', reservationType = ?, "
+                           'reservationDescription = ?, updatedAt = ?, version = version + 1 WHERE id = ?', reserve)
+        if link:
+            db.executemany('UPDATE ips SET subnetId = ?, version = version + 1 WHERE id = ?', link)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return jsonify({
+        'success': True,
+        'message': f'Template applied: {len(rows["subnets"])} subnets, {len(rows["ip_ranges"])} ranges, '
+                   f'{len(rows["ips"]) + len(reserve)} reservations created',
+        'subnets': [{'id': r[0], 'network': r[2], 'cidr': r[3]} for r in rows['subnets']],
+        'ranges': len(rows['ip_ranges']),
+        'reservations': len(rows['ips']) + len(reserve),
+        'linked': len(link),
+    }), 201
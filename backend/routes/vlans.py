@@ -2,13 +2,16 @@ import uuid
 from datetime import datetime
 from flask import Blueprint, request, jsonify
 from database import get_db
+import versioning
+import cache
+import shards
 
 bp = Blueprint('vlans', __name__)
 
 @bp.route('/vlans', methods=['GET'])
+@cache.cached('vlans')
 def list_vlans():
-    db = get_db()
-    rows = db.execute('SELECT * FROM vlans').fetchall()
+    rows = shards.query('vlans', 'SELECT * FROM vlans')
     return jsonify([dict(r) for r in rows])
 
 @bp.route('/vlans/<id>', methods=['GET'])
@@ -17,7 +20,7 @@ def get_vlan(id):
     row = db.execute('SELECT * FROM vlans WHERE id = ?', (id,)).fetchone()
     if not row:
         return jsonify({'error': 'VLAN not found'}), 404
-    return jsonify(dict(row))
+    return versioning.tagged(dict(row))
 
 @bp.route('/vlans', methods=['POST'])
 def create_vlan():
@@ -37,18 +40,13 @@ def create_vlan():
 def update_vlan(id):
     data = request.get_json()
     db = get_db()
-    now = datetime.utcnow().isoformat() + 'Z'
-    db.execute(
-        'UPDATE vlans SET vlanId=?, name=?, description=?, type=?, companyId=?, updatedAt=? WHERE id=?',
-        (data.get('vlanId'), data.get('name'), data.get('description'),
-         data.get('type'), data.get('companyId'), now, id)
-    )
-    db.commit()
-    return jsonify({'success': True, 'message': 'VLAN updated'})
+    fields = ['vlanId', 'name', 'description', 'type', 'companyId']
+    values = versioning.changes(data, fields)
+    values['updatedAt'] = datetime.utcnow().isoformat() + 'Z'
+    return versioning.update(db, 'vlans', id, values, 'VLAN not found',
+                             {'success': True, 'message': 'VLAN updated'})
 
 @bp.route('/vlans/<id>', methods=['DELETE'])
 def delete_vlan(id):
     db = get_db()
-    db.execute('DELETE FROM vlans WHERE id = ?', (id,))
-    db.commit()
-    return jsonify({'success': True, 'message': 'VLAN deleted'})
+    return versioning.delete(db, 'vlans', id, 'VLAN not found', {'success': True, 'message': 'VLAN deleted'})
@@ -0,0 +1,219 @@
+"""Server-side session store: database table behind a bounded in-memory LRU cache.
+
+The browser only holds an opaque random session id; the user dict lives in the
+``sessions`` table (keyed by a SHA-256 of the id). Hot sessions are served from
+the LRU without touching the database. ``lastSeen`` is written back at most once
+per touch interval, and that write also revalidates the cached entry, so a logout
+on another worker is honoured within one interval.
+
+OPENIPAM_SESSION_BACKEND        'sqlite' (default; the sessions table of the configured
+                                database engine) or 'cookie' for Flask's signed cookies
+OPENIPAM_SESSION_IDLE_MIN       idle expiry in minutes (default 120)
+OPENIPAM_SESSION_CACHE_SIZE     max sessions held in memory (default 10000)
+"""
+import hashlib
+import json
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+import metrics
+import database
+
+SESSION_BACKEND = os.environ.get('OPENIPAM_SESSION_BACKEND', 'sqlite')
+IDLE_TIMEOUT = int(os.environ.get('OPENIPAM_SESSION_IDLE_MIN', 120)) * 60
+CACHE_SIZE = int(os.environ.get('OPENIPAM_SESSION_CACHE_SIZE', 10000))
+TOUCH_INTERVAL = 60
+SWEEP_INTERVAL = 300
+
+# Requests for these never need the session (see require_login in app.py)
+STATIC_PREFIXES = ('/modules/',)
+STATIC_EXTENSIONS = ('.css', '.js', '.png', '.jpg', '.svg', '.ico', '.woff', '.woff2', '.ttf', '.wasm')
+
+session_lookups = metrics.Counter('openipam_session_lookups_total', 'Session loads by source',
+                                  ('source',))
+
+
+def is_static_path(path):
+    return path.startswith(STATIC_PREFIXES) or path.endswith(STATIC_EXTENSIONS)
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None, created=None, skip=False):
+        def on_update(self):
+            self.modified = True
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.created = created or int(time.time())
+        self.new = sid is None
+        self.modified = False
+        self.skip = skip
+        self.had_user = bool(initial and initial.get('user'))
+
+
+class SessionStore:
+    """Persistence and LRU caching for session payloads."""
+
+    def __init__(self, engine, idle_timeout, absolute_timeout, cache_size):
+        self.engine = engine
+        self.idle_timeout = idle_timeout
+        self.absolute_timeout = absolute_timeout
+        self.cache_size = cache_size
+        self._cache = OrderedDict()   # sid -> [data, created, last_touch]
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._last_sweep = 0.0
+
+    def _db(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self.engine.standalone()
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _key(sid):
+        return hashlib.sha256(sid.encode()).hexdigest()
+
+    def _expired(self, created, last_seen, now):
+        return now - last_seen > self.idle_timeout or now - created > self.absolute_timeout
+
+    def load(self, sid):
+        now = int(time.time())
+        with self._lock:
+            entry = self._cache.get(sid)
+            if entry is not None:
+                self._cache.move_to_end(sid)
+        if entry is not None:
+            data, created, touched = entry
+            if self._expired(created, touched, now):
+                self.delete(sid)
+                return None
+            if now - touched < TOUCH_INTERVAL:
+                session_lookups.inc(('cache',))
+                return data, created
+            # Periodic touch doubles as revalidation against the shared table
+            cur = self._db().execute('UPDATE sessions SET lastSeen=? WHERE id=?', (now, self._key(sid)))
+            if cur.rowcount == 0:
+                self._evict(sid)
+                return None
+            entry[2] = now
+            session_lookups.inc(('touch',))
+            return data, created
+
+        row = self._db().execute('SELECT data, createdAt, lastSeen FROM sessions WHERE id=?',
+                                 (self._key(sid),)).fetchone()
+        session_lookups.inc(('db',))
+        if row is None:
+            return None
+        data, created, last_seen = json.loads(row[0]), row[1], row[2]
+        if self._expired(created, last_seen, now):
+            self.delete(sid)
+            return None
+        self._db().execute('UPDATE sessions SET lastSeen=? WHERE id=?', (now, self._key(sid)))
+        self._remember(sid, data, created, now)
+        return data, created
+
+    def save(self, sid, data, created):
+        now = int(time.time())
+        self._db().execute(
+            'INSERT INTO sessions (id, data, createdAt, lastSeen) VALUES (?, ?, ?, ?) '
+            'ON CONFLICT (id) DO UPDATE SET data = excluded.data, createdAt = excluded.createdAt, '
+            'lastSeen = excluded.lastSeen',
+            (self._key(sid), json.dumps(data), created, now))
+        self._remember(sid, data, created, now)
+
+    def delete(self, sid):
+        self._evict(sid)
+        self._db().execute('DELETE FROM sessions WHERE id=?', (self._key(sid),))
+
+    def _remember(self, sid, data, created, touched):
+        with self._lock:
+            self._cache[sid] = [data, created, touched]
+            self._cache.move_to_end(sid)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _evict(self, sid):
+        with self._lock:
+            self._cache.pop(sid, None)
+
+    def maybe_sweep(self):
+        now = time.time()
+        if now - self._last_sweep < SWEEP_INTERVAL:
+            return 0
+        self._last_sweep = now
+        return self.sweep()
+
+    def sweep(self):
+        """Delete idle and absolutely expired sessions. Returns the number removed."""
+        now = int(time.time())
+        cur = self._db().execute('DELETE FROM sessions WHERE lastSeen < ? OR createdAt < ?',
+                                 (now - self.idle_timeout, now - self.absolute_timeout))
+        with self._lock:
+            for sid in [s for s, e in self._cache.items() if self._expired(e[1], e[2], now)]:
+                del self._cache[sid]
+        return cur.rowcount
+
+
+class SQLiteSessionInterface(SessionInterface):
+    def __init__(self, store):
+        self.store = store
+
+    def open_session(self, app, request):
+        if is_static_path(request.path):
+            return ServerSession(skip=True)
+        self.store.maybe_sweep()
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            loaded = self.store.load(sid)
+            if loaded is not None:
+                data, created = loaded
+                return ServerSession(data, sid=sid, created=created)
+        return ServerSession()
+
+    def save_session(self, app, session, response):
+        if session.skip:
+            return
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if not session:
+            if session.sid and session.modified:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+        if not session.modified:
+            return
+
+        # Issue a fresh id when a user logs in so a pre-login id can't be fixated
+        if session.sid and session.get('user') and not session.had_user:
+            self.store.delete(session.sid)
+            session.sid = None
+        if session.sid is None:
+            session.sid = secrets.token_urlsafe(32)
+            session.created = int(time.time())
+        self.store.save(session.sid, dict(session), session.created)
+
+        expires = None
+        if session.permanent:
+            expires = datetime.fromtimestamp(session.created + self.store.absolute_timeout, timezone.utc)
+        response.set_cookie(name, session.sid, expires=expires, httponly=self.get_cookie_httponly(app),
+                            domain=domain, path=path, secure=self.get_cookie_secure(app),
+                            samesite=self.get_cookie_samesite(app))
+
+
+def init_app(app):
+    """Install the configured session backend on the app."""
+    if SESSION_BACKEND == 'cookie':
+        return
+    if SESSION_BACKEND != 'sqlite':
+        raise ValueError(f'Unknown OPENIPAM_SESSION_BACKEND: {SESSION_BACKEND}')
+    absolute = int(app.permanent_session_lifetime.total_seconds())
+    app.session_interface = SQLiteSessionInterface(SessionStore(database.engine, IDLE_TIMEOUT, absolute, CACHE_SIZE))
@@ -0,0 +1,451 @@
+"""Optional per-company SQLite shards for multi-tenant deployments.
+
+With OPENIPAM_SHARD_DIR set, the rows of the tenant tables (subnets, hosts,
+VLANs and everything hanging off a subnet or DHCP scope) live in one SQLite file
+per company, ``<dir>/company-<id>.db``. The main database keeps companies,
+settings, sessions, the audit log and other shared tables, plus any tenant rows
+that belong to no company.
+
+A request picks its shard with the X-OpenIPAM-Company header (or ?company=).
+get_db() then opens that shard with the main database attached as
+``global_db``, so shared tables resolve there and routes run unchanged, while
+the tenant's writes only lock the tenant's file. Unscoped requests on a single
+tenant row are routed to the shard holding it (or, for a new row, the shard
+of its company); lists, search, dashboard and the full backup fan out across
+every shard, and full-table imports and syncs are split by company.
+
+    python shards.py list
+    python shards.py split                 # move tenant rows out of the main database
+    python shards.py snapshot [COMPANY...]  # online snapshot of each shard
+"""
+import argparse
+import os
+import re
+import sqlite3
+import sys
+import threading
+
+from flask import g, has_request_context, jsonify, request
+
+import database
+import group_commit
+import integrity
+from database import CREATE_TABLES_SQL, SHARD_DIR, Connection, SQLiteEngine, get_db
+
+ENABLED = bool(SHARD_DIR)
+SCOPE_HEADER = 'X-OpenIPAM-Company'
+COMPANY_RE = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+SHARD_RE = re.compile(r'^company-([A-Za-z0-9_-]{1,64})\.db$')
+
+# Tenant table -> (column, parent table). A row belongs to the company named in the
+# column, or, when there is a parent, to the company owning the referenced parent row.
+TENANT_TABLES = {
+    'subnets': ('companyId', None),
+    'hosts': ('companyId', None),
+    'vlans': ('companyId', None),
+    'ips': ('subnetId', 'subnets'),
+    'ip_ranges': ('subnetId', 'subnets'),
+    'ip_history': ('subnetId', 'subnets'),
+    'dhcp_scopes': ('subnetId', 'subnets'),
+    'dhcp_options': ('scopeId', 'dhcp_scopes'),
+    'dhcp_leases': ('scopeId', 'dhcp_scopes'),
+    'dhcp_reservations': ('scopeId', 'dhcp_scopes'),
+}
+PARENT_TABLES = ('subnets', 'dhcp_scopes')
+# API resource (path under /api/v1) -> tenant table, for routing unscoped single-row requests
+ROUTE_TABLES = {
+    'subnets': 'subnets', 'hosts': 'hosts', 'vlans': 'vlans', 'ips': 'ips', 'ip_ranges': 'ip_ranges',
+    'ip_history': 'ip_history', 'dhcp/scopes': 'dhcp_scopes', 'dhcp/options': 'dhcp_options',
+    'dhcp/leases': 'dhcp_leases', 'dhcp/reservations': 'dhcp_reservations',
+}
+# Other POST routes creating tenant rows -> the table whose routing they follow
+CREATE_ROUTES = {'templates/<id>/apply': 'subnets'}
+API_PREFIX = '/api/v1/'
+
+_SCHEMA_TABLE_RE = re.compile(r'(?:TABLE IF NOT EXISTS|\bON)\s+(\w+)')
+SHARD_SCHEMA = [sql for sql in CREATE_TABLES_SQL if _SCHEMA_TABLE_RE.search(sql).group(1) in TENANT_TABLES]
+
+
+def request_scope():
+    """Company id the current request is scoped to, or None."""
+    if not ENABLED or not has_request_context():
+        return None
+    return (request.headers.get(SCOPE_HEADER) or request.args.get('company')
+            or g.get('_routed_company'))
+
+
+class ShardedEngine(SQLiteEngine):
+    """SQLite engine that routes company-scoped requests to per-company files."""
+
+    def __init__(self, path, directory):
+        super().__init__(path)
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._ready = set()
+
+    def shard_path(self, company):
+        return os.path.join(self.directory, f'company-{company}.db')
+
+    def shard_ids(self):
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(m.group(1) for m in map(SHARD_RE.match, os.listdir(self.directory)) if m)
+
+    def ensure_shard(self, company, registered=False):
+        """Create the shard of a registered company on first use. False for unknown companies.
+
+        ``registered`` skips the lookup in the companies table, for callers that
+        already resolved the company (e.g. from a backup being imported).
+        """
+        if company in self._ready:
+            return True
+        if not COMPANY_RE.match(company):
+            return False
+        path = self.shard_path(company)
+        if not registered and not os.path.exists(path):
+            db = sqlite3.connect(self.path)
+            try:
+                known = db.execute('SELECT 1 FROM companies WHERE id = ?', (company,)).fetchone()
+            finally:
+                db.close()
+            if not known:
+                return False
+        with self._lock:
+            if company not in self._ready:
+                os.makedirs(self.directory, exist_ok=True)
+                self._apply_schema(path, SHARD_SCHEMA)
+                self._ready.add(company)
+        return True
+
+    def open_shard(self, company):
+        db = sqlite3.connect(self.shard_path(company), factory=Connection)
+        db.row_factory = sqlite3.Row
+        db.execute('PRAGMA foreign_keys = ON')
+        db.execute('PRAGMA journal_mode = WAL')
+        return db
+
+    def _open_scoped(self, company):
+        db = self.open_shard(company)
+        db.execute('ATTACH DATABASE ? AS global_db', (self.path,))
+        return db
+
+    def connect_shard(self, company, scoped=False):
+        """Request connection to a shard, writing through the shard file's coordinator.
+
+        ``scoped`` attaches the main database as ``global_db``. The coordinator's
+        writer always has it attached, whichever connection creates it first.
+        """
+        db = self._open_scoped(company) if scoped else self.open_shard(company)
+        if group_commit.ENABLED:
+            return group_commit.BufferedConnection(
+                db, group_commit.coordinator(self.shard_path(company), lambda: self._open_scoped(company)))
+        return db
+
+    def connect(self):
+        company = request_scope()
+        if company is None:
+            return super().connect()
+        if not self.ensure_shard(company):
+            raise LookupError(f'Unknown company: {company}')
+        return self.connect_shard(company, scoped=True)
+
+    def init_schema(self):
+        super().init_schema()
+        for company in self.shard_ids():
+            self._ready.discard(company)
+            self.ensure_shard(company)
+
+
+# --- Fan-out over the main database and every shard ---
+
+def databases(table=None):
+    """(company, connection) pairs holding rows of ``table`` for this request.
+
+    Scoped requests (and unsharded deployments) only see their own connection;
+    unscoped requests visit the main database, plus every shard for tenant tables.
+    """
+    if not ENABLED or request_scope() is not None:
+        return [(request_scope(), get_db())]
+    pairs = [(None, get_db())]
+    if table is None or table in TENANT_TABLES:
+        pairs.extend((company, shard_db(company)) for company in database.engine.shard_ids())
+    return pairs
+
+
+def connections(table=None):
+    return [db for _, db in databases(table)]
+
+
+def query(table, sql, parameters=()):
+    """Run a read over every database holding ``table`` and concatenate the rows."""
+    rows = []
+    for db in connections(table):
+        rows.extend(db.execute(sql, parameters).fetchall())
+    return rows
+
+
+def shard_db(company):
+    """Request-scoped connection to one shard (the main database for None)."""
+    if company is None:
+        return get_db()
+    dbs = g.setdefault('_shard_dbs', {})
+    if company not in dbs:
+        database.engine.ensure_shard(company, registered=True)
+        dbs[company] = database.engine.connect_shard(company)
+    return dbs[company]
+
+
+def commit():
+    """Commit every shard connection opened by this request."""
+    for db in g.get('_shard_dbs', {}).values():
+        db.commit()
+
+
+def _close_shards(e=None):
+    for db in g.pop('_shard_dbs', {}).values():
+        db.close()
+
+
+# --- Splitting full-table writes by company ---
+
+class Partitioner:
+    """Assigns tenant rows to companies, following subnet and scope references."""
+
+    def __init__(self, companies, owners=None):
+        self.companies = set(companies)
+        self.owners = owners or {}   # parent table -> {row id: company}
+
+    @classmethod
+    def for_import(cls, data, tables):
+        """Resolve against a backup payload, which replaces everything at once."""
+        partitioner = cls(c.get('id') for c in data.get('companies', []) if isinstance(c, dict))
+        key_for = {table: key for key, table in tables.items()}
+        for table in PARENT_TABLES:
+            partitioner.learn(table, data.get(key_for[table], []))
+        return partitioner
+
+    @classmethod
+    def from_databases(cls):
+        """Resolve against what is stored now (single-table syncs)."""
+        companies = [r['id'] for r in get_db().execute('SELECT id FROM companies').fetchall()]
+        owners = {table: {} for table in PARENT_TABLES}
+        for company, db in databases('subnets'):
+            for table in PARENT_TABLES:
+                for row in db.execute(f'SELECT id FROM {table}').fetchall():
+                    owners[table][row['id']] = company
+        return cls(companies, owners)
+
+    def company(self, table, item):
+        column, parent = TENANT_TABLES[table]
+        value = item.get(column)
+        if parent is not None:
+            value = self.owners.get(parent, {}).get(value)
+        return value if value in self.companies and COMPANY_RE.match(value) else None
+
+    def learn(self, table, items):
+        if table in PARENT_TABLES:
+            self.owners[table] = {item.get('id'): self.company(table, item) for item in items}
+
+    def split(self, table, items):
+        parts = {}
+        for item in items:
+            parts.setdefault(self.company(table, item), []).append(item)
+        return parts
+
+
+def replace_table(table, items, insert, partitioner):
+    """Replace a tenant table in every database with the rows of that database's company."""
+    partitioner.learn(table, items)
+    parts = partitioner.split(table, items)
+    for company in {None} | set(database.engine.shard_ids()) | set(parts):
+        db = shard_db(company)
+        with integrity.replacing(db, table):
+            db.execute(f'DELETE FROM {table}')
+            if parts.get(company):
+                insert(db, table, parts[company])
+
+
+def _check_scope():
+    company = request_scope()
+    if company is not None and not database.engine.ensure_shard(company):
+        return jsonify({'error': f'Unknown company: {company}'}), 404
+    return None
+
+
+# (table, row id) -> company whose shard held the row when it was last looked up
+_owners = {}
+MAX_CACHED_OWNERS = 100000
+_MISSING = object()
+
+
+def _holds(company, table, row_id):
+    db = sqlite3.connect(database.engine.path if company is None else database.engine.shard_path(company))
+    try:
+        return db.execute(f'SELECT 1 FROM {table} WHERE id = ?', (row_id,)).fetchone() is not None
+    finally:
+        db.close()
+
+
+def _locate(table, row_id):
+    """Company whose shard holds the row (None for the main database), or _MISSING.
+
+    The last answer per row is cached and checked against that one database
+    first, so item requests only search every shard for rows they have not
+    seen (or that moved, e.g. with a sync in another worker process).
+    """
+    cached = _owners.get((table, row_id), _MISSING)
+    if cached is not _MISSING and _holds(cached, table, row_id):
+        return cached
+    for company in [None, *database.engine.shard_ids()]:
+        if company != cached and _holds(company, table, row_id):
+            if len(_owners) >= MAX_CACHED_OWNERS:
+                _owners.clear()
+            _owners[(table, row_id)] = company
+            return company
+    _owners.pop((table, row_id), None)
+    return _MISSING
+
+
+def _owner(table, row_id):
+    """Company whose shard holds the row, or None (main database, or nowhere)."""
+    if row_id is None:
+        return None
+    company = _locate(table, row_id)
+    return None if company is _MISSING else company
+
+
+def _receiver(table, item):
+    """Company whose shard a new row belongs in, like Partitioner.company() against the stored parents."""
+    column, parent = TENANT_TABLES[table]
+    value = item.get(column)
+    if parent is not None:
+        return _owner(parent, value)
+    if isinstance(value, str) and database.engine.ensure_shard(value):
+        return value
+    return None
+
+
+def _moves(table, company, item):
+    """True when an update would put the row in another database than ``company``'s.
+
+    Rows are not moved between shards: their dependents (a subnet's IPs,
+    ranges and DHCP scopes) would have to follow.
+    """
+    column, parent = TENANT_TABLES[table]
+    if column not in item:
+        return False
+    if parent is None:
+        return _receiver(table, item) != company
+    value = item[column]
+    return value is not None and _locate(parent, value) not in (company, _MISSING)
+
+
+def _route_unscoped():
+    """Send an unscoped request on one tenant row to the shard that holds it.
+
+    Item routes (/<resource>/<id>) follow the stored row; creates follow the
+    new row's companyId, or the owner of its parent subnet or DHCP scope. The
+    request then runs as if it were scoped to that company. Rows of no company
+    stay in the main database. Updates that would move a row to another
+    shard are refused, scoped or not.
+    """
+    if request.url_rule is None or not request.url_rule.rule.startswith(API_PREFIX):
+        return None
+    resource = request.url_rule.rule[len(API_PREFIX):]
+    item = resource.endswith('/<id>') and resource[:-len('/<id>')] in ROUTE_TABLES
+    company = request_scope()
+    if company is None:
+        if item:
+            company = _owner(ROUTE_TABLES[resource[:-len('/<id>')]], request.view_args.get('id'))
+        elif request.method == 'POST' and (resource in ROUTE_TABLES or resource in CREATE_ROUTES):
+            data = request.get_json(silent=True)
+            if isinstance(data, dict):
+                company = _receiver(ROUTE_TABLES.get(resource) or CREATE_ROUTES[resource], data)
+        if company is not None:
+            g._routed_company = company
+    if item and request.method == 'PUT':
+        data = request.get_json(silent=True)
+        table = ROUTE_TABLES[resource[:-len('/<id>')]]
+        if isinstance(data, dict) and _moves(table, company, data):
+            column = TENANT_TABLES[table][0]
+            return jsonify({'error': f'{column} would move the row to another company shard; '
+                                     'delete it and create it there instead'}), 409
+    return None
+
+
+def init_app(app):
+    """Validate the company scope of each request, route unscoped row requests and close fan-out connections."""
+    if not ENABLED:
+        return
+    app.before_request(_check_scope)
+    app.before_request(_route_unscoped)
+    app.teardown_appcontext(_close_shards)
+
+
+# --- Command line ---
+
+def split(engine):
+    """Move tenant rows from the main database into their companies' shards."""
+    main = sqlite3.connect(engine.path)
+    main.row_factory = sqlite3.Row
+    moved = {}
+    try:
+        companies = {r['id'] for r in main.execute('SELECT id FROM companies')}
+        partitioner = Partitioner(companies)
+        for table in TENANT_TABLES:
+            items = [dict(r) for r in main.execute(f'SELECT * FROM {table}')]
+            partitioner.learn(table, items)
+            for company, rows in partitioner.split(table, items).items():
+                if company is None or not engine.ensure_shard(company):
+                    continue
+                shard = engine.open_shard(company)
+                try:
+                    cols = shard.columns(table)
+                    shard.bulk_insert(table, cols, (tuple(row.get(c) for c in cols) for row in rows))
+                    shard.commit()
+                finally:
+                    shard.close()
+                main.executemany(f'DELETE FROM {table} WHERE id = ?', [(row['id'],) for row in rows])
+                moved[table] = moved.get(table, 0) + len(rows)
+        main.commit()
+    finally:
+        main.close()
+    return moved
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='OpenIPAM per-company shards')
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('list', help='list shards with their size')
+    sub.add_parser('split', help='move tenant rows from the main database into shards')
+    snap = sub.add_parser('snapshot', help='take an online snapshot of each shard')
+    snap.add_argument('companies', nargs='*', help='company ids (default: all shards)')
+    args = parser.parse_args(argv)
+
+    engine = database.engine
+    if not ENABLED:
+        print('Error: set OPENIPAM_SHARD_DIR to use shards', file=sys.stderr)
+        return 1
+    engine.init_schema()
+    if args.command == 'list':
+        for company in engine.shard_ids():
+            size = os.path.getsize(engine.shard_path(company))
+            print(f'{company:20s} {size / 1048576:9.1f} MB  {engine.shard_path(company)}')
+    elif args.command == 'split':
+        for table, count in split(engine).items():
+            print(f'{table:22s} {count:>10,} rows moved')
+    elif args.command == 'snapshot':
+        import snapshots
+        for company in args.companies or engine.shard_ids():
+            if not engine.ensure_shard(company):
+                print(f'Error: unknown company {company}', file=sys.stderr)
+                return 1
+            # One directory per shard so rotation keeps N snapshots of each
+            manifest = snapshots.create_snapshot(os.path.join(snapshots.SNAPSHOT_DIR, f'company-{company}'),
+                                                 source=engine.shard_path(company))
+            print(f'{company:20s} {manifest["name"]} {manifest["compressedBytes"]} bytes')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
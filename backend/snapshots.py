@@ -0,0 +1,378 @@
+"""Online hot snapshots of the SQLite database via the SQLite backup API.
+
+A snapshot is taken in page-sized chunks inside a single read transaction on
+the source connection, so it is a consistent point-in-time copy across all
+tables while writers keep going (WAL mode). Each copy is integrity-checked,
+gzip-compressed and recorded in a JSON manifest with its SHA-256.
+
+    python snapshots.py create
+    python snapshots.py list
+    python snapshots.py verify openipam-20260101T020000Z
+    python snapshots.py restore openipam-20260101T020000Z
+    python snapshots.py schedule --interval 60
+
+Environment:
+    OPENIPAM_SNAPSHOT_DIR           where snapshots are written (default backend/snapshots)
+    OPENIPAM_SNAPSHOT_KEEP          number of snapshots kept by rotation (default 7)
+    OPENIPAM_SNAPSHOT_INTERVAL_MIN  enables the in-process scheduler when set
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import re
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import database
+
+SNAPSHOT_DIR = os.environ.get('OPENIPAM_SNAPSHOT_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'snapshots'))
+SNAPSHOT_KEEP = int(os.environ.get('OPENIPAM_SNAPSHOT_KEEP', 7))
+PAGES_PER_STEP = 4096
+STEP_PAUSE = 0.002
+NAME_RE = re.compile(r'^[A-Za-z0-9_.-]+$')
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def _live_database():
+    if database.engine.name != 'sqlite':
+        raise SnapshotError('Online snapshots need the SQLite engine; use pg_dump for PostgreSQL')
+    return database.engine.path
+
+
+def _manifest_path(directory, name):
+    return os.path.join(directory, f'{name}.json')
+
+
+def _data_path(directory, name):
+    return os.path.join(directory, f'{name}.db.gz')
+
+
+def _sha256(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _check_name(name):
+    if not name or not NAME_RE.match(name):
+        raise SnapshotError(f'Invalid snapshot name: {name!r}')
+    return name
+
+
+def _integrity_check(path, quick=False):
+    db = sqlite3.connect(path)
+    try:
+        rows = db.execute('PRAGMA quick_check' if quick else 'PRAGMA integrity_check').fetchall()
+    finally:
+        db.close()
+    result = [r[0] for r in rows]
+    return result == ['ok'], result
+
+
+def _copy(src_path, dest_path, pages=PAGES_PER_STEP, pause=STEP_PAUSE):
+    """Copy src into dest with the backup API, holding one read transaction for a consistent view."""
+    src = sqlite3.connect(src_path, isolation_level=None)
+    dst = sqlite3.connect(dest_path)
+    try:
+        src.execute('BEGIN')
+        src.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()
+
+        def _progress(status, remaining, total):
+            if remaining and pause:
+                time.sleep(pause)
+
+        src.backup(dst, pages=pages, progress=_progress)
+        src.execute('COMMIT')
+        page_count = dst.execute('PRAGMA page_count').fetchone()[0]
+        user_version = dst.execute('PRAGMA user_version').fetchone()[0]
+        # Snapshots are single files, independent of the live database's WAL
+        dst.execute('PRAGMA journal_mode = DELETE')
+    finally:
+        dst.close()
+        src.close()
+    return page_count, user_version
+
+
+def create_snapshot(directory=None, source=None, keep=None, pages=PAGES_PER_STEP, pause=STEP_PAUSE):
+    """Take, verify, compress and rotate a snapshot. Returns its manifest."""
+    directory = directory or SNAPSHOT_DIR
+    source = source or _live_database()
+    os.makedirs(directory, exist_ok=True)
+    name = 'openipam-' + datetime.utcnow().strftime('%Y%m%dT%H%M%S%fZ')
+    started = time.perf_counter()
+
+    fd, raw_path = tempfile.mkstemp(prefix='.snapshot-', suffix='.db', dir=directory)
+    os.close(fd)
+    try:
+        page_count, user_version = _copy(source, raw_path, pages, pause)
+        ok, result = _integrity_check(raw_path)
+        if not ok:
+            raise SnapshotError(f'Integrity check failed: {result[:5]}')
+        raw_size = os.path.getsize(raw_path)
+        tmp_gz = raw_path + '.gz'
+        with open(raw_path, 'rb') as f_in, gzip.open(tmp_gz, 'wb', compresslevel=6) as f_out:
+            shutil.copyfileobj(f_in, f_out, 1 << 20)
+        os.replace(tmp_gz, _data_path(directory, name))
+    finally:
+        for leftover in (raw_path, raw_path + '.gz'):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+
+    data_path = _data_path(directory, name)
+    manifest = {
+        'name': name,
+        'createdAt': datetime.utcnow().isoformat() + 'Z',
+        'source': os.path.abspath(source),
+        'pageCount': page_count,
+        'schemaVersion': user_version,
+        'rawBytes': raw_size,
+        'compressedBytes': os.path.getsize(data_path),
+        'sha256': _sha256(data_path),
+        'integrity': 'ok',
+        'durationSeconds': round(time.perf_counter() - started, 3),
+    }
+    with open(_manifest_path(directory, name), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    rotate(directory, SNAPSHOT_KEEP if keep is None else keep)
+    return manifest
+
+
+def list_snapshots(directory=None):
+    """Manifests of all snapshots, newest first."""
+    directory = directory or SNAPSHOT_DIR
+    if not os.path.isdir(directory):
+        return []
+    manifests = []
+    for entry in os.listdir(directory):
+        if entry.endswith('.json') and entry.startswith('openipam-'):
+            try:
+                with open(os.path.join(directory, entry)) as f:
+                    manifests.append(json.load(f))
+            except (OSError, json.JSONDecodeError):
+                continue
+    manifests.sort(key=lambda m: m.get('name', ''), reverse=True)
+    return manifests
+
+
+def rotate(directory=None, keep=SNAPSHOT_KEEP):
+    """Delete all but the ``keep`` newest snapshots. Returns the removed names."""
+    directory = directory or SNAPSHOT_DIR
+    removed = []
+    for manifest in list_snapshots(directory)[keep:]:
+        name = manifest['name']
+        for path in (_data_path(directory, name), _manifest_path(directory, name)):
+            if os.path.exists(path):
+                os.remove(path)
+        removed.append(name)
+    return removed
+
+
+def _load_manifest(directory, name):
+    path = _manifest_path(directory, _check_name(name))
+    if not os.path.exists(path):
+        raise SnapshotError(f'Snapshot not found: {name}')
+    with open(path) as f:
+        return json.load(f)
+
+
+def _decompress(directory, name, manifest):
+    data_path = _data_path(directory, name)
+    if not os.path.exists(data_path):
+        raise SnapshotError(f'Snapshot data missing: {name}')
+    if _sha256(data_path) != manifest.get('sha256'):
+        raise SnapshotError(f'Checksum mismatch for {name}')
+    fd, raw_path = tempfile.mkstemp(prefix='.restore-', suffix='.db', dir=directory)
+    with os.fdopen(fd, 'wb') as f_out, gzip.open(data_path, 'rb') as f_in:
+        shutil.copyfileobj(f_in, f_out, 1 << 20)
+    return raw_path
+
+
+@contextmanager
+def extracted(name, directory=None):
+    """Path of a checksum-verified, decompressed copy of a snapshot, removed on exit."""
+    directory = directory or SNAPSHOT_DIR
+    raw_path = _decompress(directory, name, _load_manifest(directory, name))
+    try:
+        yield raw_path
+    finally:
+        os.remove(raw_path)
+
+
+def verify_snapshot(name, directory=None):
+    """Check the checksum and run a full integrity check on a decompressed copy."""
+    directory = directory or SNAPSHOT_DIR
+    manifest = _load_manifest(directory, name)
+    raw_path = _decompress(directory, name, manifest)
+    try:
+        ok, result = _integrity_check(raw_path)
+    finally:
+        os.remove(raw_path)
+    return {'name': name, 'ok': ok, 'integrity': result[:20]}
+
+
+def _schema_fingerprint(path):
+    db = sqlite3.connect(path)
+    try:
+        return db.execute('PRAGMA user_version').fetchone()[0]
+    finally:
+        db.close()
+
+
+def _layout(path):
+    """{table: column names} of a database file, for comparing schemas."""
+    db = sqlite3.connect(path)
+    try:
+        tables = [r[0] for r in db.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'")]
+        return {table: {r[1] for r in db.execute(f'PRAGMA table_info("{table}")')} for table in tables}
+    finally:
+        db.close()
+
+
+def _match_schema(raw_path, target, name):
+    """Bring a snapshot taken under an older schema up to the target's before it is swapped in.
+
+    The running processes only migrate on start, so restoring an older layout
+    as-is would leave them querying columns that are not there. Migrating
+    stamps the current fingerprint whatever the file held, so the migrated
+    tables and columns are compared with the target's instead: a snapshot from
+    a newer schema, or from another database, still differs and is refused.
+    """
+    if _schema_fingerprint(raw_path) == _schema_fingerprint(target):
+        return
+    database.init_db(raw_path)
+    if _layout(raw_path) != _layout(target):
+        raise SnapshotError(f'Snapshot {name} has a different schema than {os.path.basename(target)}')
+
+
+def restore_snapshot(name, directory=None, target=None):
+    """Restore a snapshot into the live database.
+
+    The verified copy is written over the target with a single backup step, so
+    the swap happens under one write lock and open connections see either the
+    old or the restored contents, never a mix. A snapshot from an older schema
+    is migrated first; one that still differs from the target is refused.
+    """
+    directory = directory or SNAPSHOT_DIR
+    target = target or _live_database()
+    manifest = _load_manifest(directory, name)
+    raw_path = _decompress(directory, name, manifest)
+    try:
+        ok, result = _integrity_check(raw_path, quick=True)
+        if not ok:
+            raise SnapshotError(f'Snapshot {name} failed integrity check: {result[:5]}')
+        _match_schema(raw_path, target, name)
+        src = sqlite3.connect(raw_path)
+        dst = sqlite3.connect(target, timeout=30)
+        try:
+            started = time.perf_counter()
+            src.backup(dst, pages=-1)
+            elapsed = time.perf_counter() - started
+        finally:
+            dst.close()
+            src.close()
+    finally:
+        os.remove(raw_path)
+    return {'name': name, 'restored': True, 'durationSeconds': round(elapsed, 3)}
+
+
+# --- Scheduled mode ---
+_scheduler = None
+
+
+def _acquire_scheduler_lock(directory):
+    """Only one process per snapshot directory runs the scheduler (multi-worker deployments)."""
+    try:
+        import fcntl
+    except ImportError:
+        return True
+    os.makedirs(directory, exist_ok=True)
+    handle = open(os.path.join(directory, '.scheduler.lock'), 'w')
+    try:
+        fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        handle.close()
+        return False
+    # Keep the handle open for the life of the process to hold the lock
+    _acquire_scheduler_lock.handle = handle
+    return True
+
+
+def start_scheduler(interval_minutes, directory=None, logger=None):
+    """Start a daemon thread that snapshots every ``interval_minutes``."""
+    global _scheduler
+    directory = directory or SNAPSHOT_DIR
+    if _scheduler is not None or not _acquire_scheduler_lock(directory):
+        return None
+
+    def _loop():
+        while True:
+            time.sleep(interval_minutes * 60)
+            try:
+                manifest = create_snapshot(directory)
+                if logger:
+                    logger.info(f'Snapshot {manifest["name"]} written ({manifest["compressedBytes"]} bytes)')
+            except Exception as e:
+                if logger:
+                    logger.error(f'Scheduled snapshot failed: {e}')
+
+    _scheduler = threading.Thread(target=_loop, name='openipam-snapshots', daemon=True)
+    _scheduler.start()
+    return _scheduler
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='OpenIPAM database snapshots')
+    parser.add_argument('--dir', default=SNAPSHOT_DIR, help='snapshot directory')
+    sub = parser.add_subparsers(dest='command', required=True)
+    create = sub.add_parser('create', help='take a snapshot now')
+    create.add_argument('--keep', type=int, default=SNAPSHOT_KEEP)
+    sub.add_parser('list', help='list snapshots')
+    verify = sub.add_parser('verify', help='verify checksum and integrity')
+    verify.add_argument('name')
+    restore = sub.add_parser('restore', help='restore a snapshot into the live database')
+    restore.add_argument('name')
+    schedule = sub.add_parser('schedule', help='take snapshots periodically (foreground)')
+    schedule.add_argument('--interval', type=float, default=60.0, help='minutes between snapshots')
+    schedule.add_argument('--keep', type=int, default=SNAPSHOT_KEEP)
+    args = parser.parse_args(argv)
+
+    try:
+        if args.command == 'create':
+            print(json.dumps(create_snapshot(args.dir, keep=args.keep), indent=2))
+        elif args.command == 'list':
+            for m in list_snapshots(args.dir):
+                print(f'{m["name"]}  {m["compressedBytes"] / 1048576:9.1f} MB  '
+                      f'(raw {m["rawBytes"] / 1048576:.1f} MB, {m["durationSeconds"]}s)')
+        elif args.command == 'verify':
+            result = verify_snapshot(args.name, args.dir)
+            print(json.dumps(result, indent=2))
+            return 0 if result['ok'] else 1
+        elif args.command == 'restore':
+            print(json.dumps(restore_snapshot(args.name, args.dir), indent=2))
+        elif args.command == 'schedule':
+            while True:
+                m = create_snapshot(args.dir, keep=args.keep)
+                print(f'{m["createdAt"]} {m["name"]} {m["compressedBytes"]} bytes', flush=True)
+                time.sleep(args.interval * 60)
+    except SnapshotError as e:
+        print(f'Error: {e}', file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,45 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# The modules read their configuration on import: point them at a scratch database first
+_scratch = tempfile.mkdtemp(prefix='openipam-tests-')
+os.environ['OPENIPAM_DB_PATH'] = os.path.join(_scratch, 'openipam.db')
+os.environ['OPENIPAM_SNAPSHOT_DIR'] = os.path.join(_scratch, 'snapshots')
+os.environ.pop('OPENIPAM_DB_URL', None)
+os.environ.pop('OPENIPAM_SHARD_DIR', None)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database  # noqa: E402
+
+
+@pytest.fixture
+def engine(tmp_path):
+    """A SQLite engine on a fresh database file with the full schema."""
+    engine = database.SQLiteEngine(str(tmp_path / 'test.db'))
+    engine.init_schema()
+    return engine
+
+
+@pytest.fixture
+def db(engine):
+    db = engine.connect()
+    yield db
+    engine.release(db)
+
+
+@pytest.fixture(scope='session')
+def app():
+    from app import create_app
+    return create_app()
+
+
+@pytest.fixture
+def client(app):
+    """Test client with a signed-in session."""
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['user'] = {'email': 'tester@example.com', 'displayName': 'Tester'}
+    return client
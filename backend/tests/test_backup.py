@@ -0,0 +1,58 @@
+def _seed(client):
+    host = client.post('/api/v1/hosts', json={'vmName': 'web-01', 'cpuCount': 4}).get_json()['id']
+    subnet = client.post('/api/v1/subnets', json={'network': '10.30.0.0', 'cidr': 24}).get_json()['id']
+    client.post('/api/v1/ips', json={'ipAddress': '10.30.0.5', 'status': 'assigned', 'hostId': host})
+    window = {'title': 'Patch', 'hostIds': [host], 'subnetIds': [subnet]}
+    client.post('/api/v1/maintenance', json=window)
+    return host, subnet
+
+
+def _tables(client):
+    backup = client.get('/api/v1/backup').get_json()
+    return {key: sorted(map(repr, value)) if isinstance(value, list) else value
+            for key, value in backup.items() if key != 'timestamp'}
+
+
+def test_columnar_backup_round_trips(client):
+    host, _ = _seed(client)
+    before = _tables(client)
+    backup = client.get('/api/v1/backup?format=columnar').get_json()
+    assert backup['format'] == 'columnar'
+    assert set(backup['hosts']) == {'columns', 'rows'}
+
+    response = client.post('/api/v1/backup', json=backup)
+    assert response.status_code == 200
+    assert _tables(client) == before
+    assert client.get(f'/api/v1/hosts/{host}').get_json()['cpuCount'] == 4
+
+
+def test_object_backup_round_trips(client):
+    _seed(client)
+    before = _tables(client)
+    assert client.post('/api/v1/backup', json=client.get('/api/v1/backup').get_json()).status_code == 200
+    assert _tables(client) == before
+
+
+def test_malformed_tables_are_refused_before_anything_is_replaced(client):
+    host, _ = _seed(client)
+    bad = [
+        {'subnets': [], 'hosts': {'columns': ['id'], 'rows': [['h1']]}},
+        {'subnets': [], 'hosts': [], 'ips': 'nope'},
+        {'subnets': [], 'hosts': [1, 2]},
+        {'format': 'columnar', 'subnets': [], 'hosts': {'columns': ['id', 'vmName'], 'rows': [['h1']]}},
+    ]
+    for backup in bad:
+        assert client.post('/api/v1/backup', json=backup).status_code == 400
+    assert client.post('/api/v1/backup', json=['subnets', 'hosts']).status_code == 400
+    assert client.get(f'/api/v1/hosts/{host}').status_code == 200
+
+
+def test_diff_reads_columnar_backups(client):
+    _seed(client)
+    backup = client.get('/api/v1/backup?format=columnar').get_json()
+    summary = client.post('/api/v1/backup/diff?summary=1', json={'to': {'backup': backup}}).get_json()
+    assert summary['total']['added'] == summary['total']['removed'] == summary['total']['changed'] == 0
+    assert summary['summary']['hosts']['unchanged'] >= 1
+
+    backup['ips'] = 'nope'
+    assert client.post('/api/v1/backup/diff?summary=1', json={'to': {'backup': backup}}).status_code == 400
@@ -0,0 +1,70 @@
+import random
+import sqlite3
+from contextlib import closing
+
+import backup_diff
+
+# Mixed case and digits: bytewise order differs from case-insensitive and numeric order
+IDS = ['a1', 'B2', 'b3', 'Z4', '10', '9', '_x', 'A5', 'z6', '0']
+
+
+def _database(path, rows):
+    with closing(sqlite3.connect(path)) as db:
+        db.execute('CREATE TABLE hosts (id TEXT PRIMARY KEY, vmName TEXT, state TEXT)')
+        db.executemany('INSERT INTO hosts VALUES (?, ?, ?)', rows)
+        db.commit()
+    return backup_diff.open_database(path)
+
+
+def _backup(rows):
+    return backup_diff.BackupSource({'hosts': [{'id': id, 'vmName': name, 'state': state}
+                                               for id, name, state in rows]}, {})
+
+
+def _diff(old, new):
+    *records, summary = backup_diff.diff(old, new, ['hosts'])
+    return records, summary['summary']['hosts']
+
+
+def test_backup_rows_are_read_in_id_order():
+    rows = [(id, f'vm-{id}', None) for id in IDS]
+    random.Random(1).shuffle(rows)
+    _, items = _backup(rows).rows('hosts')
+    assert [key for key, _ in items] == sorted(IDS)
+
+
+def test_shards_merge_into_one_id_ordered_stream(tmp_path):
+    rows = [(id, f'vm-{id}', 'running') for id in IDS]
+    main = _database(str(tmp_path / 'main.db'), rows[::2])
+    shard = _database(str(tmp_path / 'shard.db'), rows[1::2])
+    with closing(main), closing(shard):
+        source = backup_diff.DatabaseSource(lambda table: [main, shard])
+        columns, items = source.rows('hosts')
+        assert columns == ['vmName', 'state']
+        assert [key for key, _ in items] == sorted(IDS)
+
+        shuffled = list(rows)
+        random.Random(2).shuffle(shuffled)
+        records, counts = _diff(backup_diff.DatabaseSource(lambda table: [main, shard]), _backup(shuffled))
+    assert records == []
+    assert counts == {'added': 0, 'removed': 0, 'changed': 0, 'unchanged': len(IDS)}
+
+
+def test_changes_are_reported_in_id_order(tmp_path):
+    old_rows = [(id, f'vm-{id}', 'running') for id in IDS if id not in ('B2', 'z6')]
+    new_rows = [(id, f'vm-{id}', 'stopped' if id in ('9', 'a1') else 'running')
+                for id in IDS if id not in ('0', 'Z4')]
+    with closing(_database(str(tmp_path / 'old.db'), old_rows)) as old:
+        records, counts = _diff(backup_diff.DatabaseSource(lambda table: [old]), _backup(new_rows))
+    assert [(r['op'], r['id']) for r in records] == [
+        ('removed', '0'), ('changed', '9'), ('added', 'B2'), ('removed', 'Z4'), ('changed', 'a1'), ('added', 'z6')]
+    assert records[1]['changes'] == {'state': ['running', 'stopped']}
+    assert counts == {'added': 2, 'removed': 2, 'changed': 2, 'unchanged': 4}
+
+
+def test_ignored_columns_do_not_count_as_changes():
+    old = _backup([('a', 'vm', 'running')])
+    new = _backup([('a', 'vm', 'stopped')])
+    *records, summary = backup_diff.diff(old, new, ['hosts'], ignore=['state'])
+    assert records == []
+    assert summary['summary']['hosts']['unchanged'] == 1
@@ -0,0 +1,82 @@
+import csv
+import io
+import zipfile
+
+import pytest
+
+import xlsx
+from routes import export
+
+
+@pytest.fixture
+def company(client):
+    company = client.post('/api/v1/companies', json={'name': 'Export Co'}).get_json()['id']
+    subnet = client.post('/api/v1/subnets', json={'network': '10.42.7.0', 'cidr': 24, 'companyId': company}
+                         ).get_json()['id']
+    for n in range(5):
+        host = client.post('/api/v1/hosts', json={'vmName': f'export-{n:02d}', 'companyId': company,
+                                                  'cpuCount': n + 1, 'state': 'running' if n else 'stopped'}
+                           ).get_json()['id']
+        for address in (f'10.42.7.{10 + n}', f'10.42.7.{100 + n}')[:1 + n % 2]:
+            client.post('/api/v1/ips', json={'ipAddress': address, 'status': 'assigned', 'hostId': host,
+                                             'subnetId': subnet})
+    return company
+
+
+def _csv(client, query):
+    response = client.get(f'/api/v1/export/hosts.csv?{query}')
+    assert response.status_code == 200 and response.is_streamed
+    return list(csv.reader(io.StringIO(response.get_data(as_text=True))))
+
+
+def test_csv_streams_hosts_with_their_ips_and_names(client, company, monkeypatch):
+    monkeypatch.setattr(export, 'BATCH_ROWS', 2)
+    rows = _csv(client, f'companyId={company}&columns=vmName,ipAddresses,company,cpuCount')
+    assert rows[0] == ['VM Name', 'IP Addresses', 'Company', 'CPU Count']
+    by_name = {row[0]: row for row in rows[1:]}
+    assert sorted(by_name) == [f'export-{n:02d}' for n in range(5)]
+    assert sorted(by_name['export-01'][1].split(', ')) == ['10.42.7.101', '10.42.7.11']
+    assert by_name['export-00'][1:] == ['10.42.7.10', 'Export Co', '1']
+
+
+def test_default_columns_and_filters(client, company):
+    rows = _csv(client, f'companyId={company}&state=STOPPED')
+    assert rows[0] == [export.HOST_COLUMNS[c][0] for c in export.DEFAULT_COLUMNS]
+    assert [row[export.DEFAULT_COLUMNS.index('vmName')] for row in rows[1:]] == ['export-00']
+    assert len(_csv(client, f'companyId={company}&q=export-03&columns=id')) == 2
+
+
+def test_unknown_columns_are_refused(client):
+    response = client.get('/api/v1/export/hosts.csv?columns=vmName,password')
+    assert response.status_code == 400
+    assert 'password' in response.get_json()['error']
+
+
+def test_xlsx_is_a_workbook_with_one_row_per_host(client, company):
+    response = client.get(f'/api/v1/export/hosts.xlsx?companyId={company}&columns=vmName,cpuCount')
+    assert response.status_code == 200 and response.mimetype == xlsx.MIMETYPE
+    with zipfile.ZipFile(io.BytesIO(response.get_data())) as zf:
+        sheet = zf.read('xl/worksheets/sheet1.xml').decode()
+    assert sheet.count('<row>') == 6
+    assert '<t xml:space="preserve">export-04</t></is></c><c><v>5</v>' in sheet
+
+
+def test_xlsx_opens_in_openpyxl():
+    openpyxl = pytest.importorskip('openpyxl')
+    data = b''.join(xlsx.stream(['Name', 'Count'], [[['a & b', 1], ['c\x01', None]], [[None, 2.5]]]))
+    rows = list(openpyxl.load_workbook(io.BytesIO(data)).active.iter_rows(values_only=True))
+    assert rows == [('Name', 'Count'), ('a & b', 1), ('c', None), (None, 2.5)]
+
+
+def test_xlsx_yields_data_before_the_last_batch():
+    read = []
+
+    def batches():
+        for n in range(3):
+            read.append(n)
+            yield [[f'row-{n}-{i}', i] for i in range(20000)]
+
+    chunks = xlsx.stream(['Name', 'Count'], batches())
+    assert next(chunks)[:2] == b'PK'
+    assert read == [0]
+    assert len(list(chunks)) >= 2 and read == [0, 1, 2]
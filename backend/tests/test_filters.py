@@ -0,0 +1,46 @@
+import pytest
+
+import filters
+
+
+def _filter(*conditions, match='all'):
+    return {'match': match, 'conditions': [dict(zip(('field', 'op', 'value'), c)) for c in conditions]}
+
+
+def test_typed_conditions_compile(db):
+    table, where, parameters, tables = filters.compile_filter(db, 'hosts', _filter(
+        ('state', 'eq', 'running'), ('cpuCount', 'between', [2, '8']), ('vmName', 'in', ['web', 'db']),
+        ('ipAddress', 'in_cidr', '10.0.0.0/8')))
+    assert (table, tables) == ('hosts', {'hosts', 'ips'})
+    assert parameters[:5] == ['running', 2, 8, 'web', 'db']
+    db.execute(f'SELECT id FROM hosts t WHERE {where}', parameters).fetchall()
+
+
+@pytest.mark.parametrize('condition', [
+    ('state', 'eq', ['running']),
+    ('state', 'contains', {'a': 1}),
+    ('companyId', 'ne', ['c1', 'c2']),
+    ('cpuCount', 'gt', [4]),
+    ('ipAddress', 'in_cidr', ['10.0.0.0/8']),
+    ('warrantyExpiry', 'within_days', [30]),
+    ('state', 'eq', True),
+    ('vmName', 'in', [['web'], 'db']),
+    ('vmName', 'in', [{'a': 1}]),
+    ('search', 'contains', ['web']),
+])
+def test_non_scalar_values_are_refused(db, condition):
+    with pytest.raises(filters.FilterError):
+        filters.compile_filter(db, 'hosts', _filter(condition))
+
+
+def test_saved_filter_with_a_list_value_is_rejected(client):
+    response = client.post('/api/v1/saved_filters', json={
+        'name': 'Broken', 'page': 'hosts', 'filters': _filter(('state', 'eq', ['running']))})
+    assert response.status_code == 400
+
+    saved = client.post('/api/v1/saved_filters', json={'name': 'Running', 'page': 'hosts', 'filters': _filter(
+        ('state', 'eq', 'running'), ('vmName', 'in', ['filter-web-01', 'filter-db-01']))}).get_json()['id']
+    client.post('/api/v1/hosts', json={'vmName': 'filter-web-01', 'state': 'running'})
+    client.post('/api/v1/hosts', json={'vmName': 'filter-db-01', 'state': 'stopped'})
+    items = client.get(f'/api/v1/saved_filters/{saved}/results').get_json()['items']
+    assert [item['vmName'] for item in items] == ['filter-web-01']
@@ -0,0 +1,124 @@
+import sqlite3
+import threading
+
+import pytest
+
+import group_commit
+import shards
+
+
+def _count(engine, sql='SELECT COUNT(*) FROM companies'):
+    db = engine.standalone()
+    try:
+        return db.execute(sql).fetchone()[0]
+    finally:
+        db.close()
+
+
+def _insert(id, name='x'):
+    return ('INSERT INTO companies (id, name) VALUES (?, ?)', (id, name), False, group_commit.PendingCursor())
+
+
+def test_request_connections_buffer_writes(db):
+    assert isinstance(db, group_commit.BufferedConnection)
+
+
+def test_reads_do_not_see_buffered_writes_until_commit(engine, db):
+    db.execute("INSERT INTO companies (id, name) VALUES ('c1', 'Acme')")
+    assert db.in_transaction
+    assert db.execute("SELECT 1 FROM companies WHERE id = 'c1'").fetchone() is None
+    assert _count(engine) == 0
+
+    db.commit()
+    assert db.execute("SELECT name FROM companies WHERE id = 'c1'").fetchone()['name'] == 'Acme'
+    assert _count(engine) == 1
+
+
+def test_rowcount_is_known_after_commit(db):
+    db.executemany('INSERT INTO companies (id, name) VALUES (?, ?)', [('a', 'x'), ('b', 'x'), ('c', 'y')])
+    db.commit()
+    cur = db.execute("UPDATE companies SET name = 'z' WHERE name = 'x'")
+    with pytest.raises(RuntimeError):
+        cur.rowcount
+    db.commit()
+    assert cur.rowcount == 2
+
+
+def test_failing_unit_rolls_back_all_of_its_writes(engine, db):
+    db.execute("INSERT INTO companies (id, name) VALUES ('c1', 'Acme')")
+    db.commit()
+    db.execute("INSERT INTO companies (id, name) VALUES ('c2', 'Other')")
+    db.execute("INSERT INTO companies (id, name) VALUES ('c1', 'Duplicate')")
+    with pytest.raises(sqlite3.IntegrityError):
+        db.commit()
+    assert _count(engine) == 1
+    assert not db.in_transaction
+
+    # The connection stays usable
+    db.execute("INSERT INTO companies (id, name) VALUES ('c3', 'Third')")
+    db.commit()
+    assert _count(engine) == 2
+
+
+def test_units_in_one_batch_commit_or_fail_on_their_own(engine):
+    coordinator = group_commit.WriteCoordinator(engine._open)
+    db = engine._open()
+    db.isolation_level = None
+    good, bad, other = [_insert('a'), _insert('b')], [_insert('c'), _insert('a')], [_insert('d')]
+    batch = [group_commit._Unit(ops) for ops in (good, bad, other)]
+    coordinator._flush(db, batch)
+    db.close()
+
+    assert [unit.error is None for unit in batch] == [True, False, True]
+    assert isinstance(batch[1].error, sqlite3.IntegrityError)
+    assert _count(engine) == 3
+    assert _count(engine, "SELECT COUNT(*) FROM companies WHERE id = 'c'") == 0
+    assert [cursor.rowcount for *_, cursor in good + other] == [1, 1, 1]
+
+
+def test_queued_units_are_collected_into_one_batch(engine):
+    coordinator = group_commit.WriteCoordinator(engine._open, window=0, max_batch=3)
+    for i in range(5):
+        coordinator._queue.put(group_commit._Unit([_insert(f'c{i}')]))
+    assert len(coordinator._collect()) == 3
+    assert len(coordinator._collect()) == 2
+
+
+def test_concurrent_commits_all_land(engine):
+    errors = []
+
+    def worker(n):
+        db = engine.connect()
+        try:
+            for i in range(20):
+                db.execute('INSERT INTO companies (id, name) VALUES (?, ?)', (f'{n}-{i}', 'x'))
+                db.commit()
+        except Exception as e:
+            errors.append(e)
+        finally:
+            engine.release(db)
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    assert _count(engine) == 160
+
+
+def test_shard_connections_share_the_shard_writer(tmp_path):
+    engine = shards.ShardedEngine(str(tmp_path / 'main.db'), str(tmp_path / 'shards'))
+    engine.init_schema()
+    assert engine.ensure_shard('acme', registered=True)
+    fanout, scoped = engine.connect_shard('acme'), engine.connect_shard('acme', scoped=True)
+    try:
+        assert isinstance(fanout, group_commit.BufferedConnection)
+        assert fanout._coordinator is scoped._coordinator
+        fanout.execute("INSERT INTO hosts (id, vmName) VALUES ('h1', 'web')")
+        assert fanout.execute('SELECT COUNT(*) FROM hosts').fetchone()[0] == 0
+        fanout.commit()
+        assert scoped.execute("SELECT vmName FROM hosts WHERE id = 'h1'").fetchone()[0] == 'web'
+    finally:
+        fanout.close()
+        scoped.close()
@@ -0,0 +1,131 @@
+import pytest
+
+import host_metrics
+
+NOW = 1_700_000_000
+
+
+def _errors(samples):
+    rows, errors = host_metrics.parse(samples, now=NOW)
+    return rows, [error['error'] for error in errors]
+
+
+@pytest.mark.parametrize('ts', [float('nan'), float('inf'), 1e30, 10 ** 30, NOW + host_metrics.MAX_SKEW_SECONDS + 1,
+                                -1, '1700000000', True])
+def test_bad_timestamps_are_rejected(ts):
+    rows, errors = _errors([{'hostId': 'h1', 'ts': ts}])
+    assert rows == [] and len(errors) == 1
+
+
+@pytest.mark.parametrize('value', [float('nan'), float('-inf'), 1e400, 10 ** 20, '4', False])
+def test_bad_values_are_rejected(value):
+    rows, errors = _errors([{'hostId': 'h1', 'ts': NOW, 'memoryUsedGB': value}])
+    assert rows == [] and errors == ['memoryUsedGB must be a finite number']
+
+
+def test_valid_samples():
+    rows, errors = _errors([
+        {'hostId': 'h1', 'ts': NOW - 10.7, 'memoryUsedGB': 3.5, 'cpuCount': 4, 'state': 'running'},
+        {'hostId': 'h1', 'ts': NOW + host_metrics.MAX_SKEW_SECONDS},
+        {'hostId': 'h2'},
+        {'ts': NOW},
+    ])
+    assert [(row['hostId'], row['ts']) for row in rows] == [
+        ('h1', NOW - 11), ('h1', NOW + host_metrics.MAX_SKEW_SECONDS), ('h2', NOW)]
+    assert rows[0]['state'] == 'running' and rows[1]['memoryUsedGB'] is None
+    assert errors == ['hostId is required']
+
+
+def test_far_future_samples_do_not_reach_the_endpoint(client):
+    host = client.post('/api/v1/hosts', json={'vmName': 'metrics-01', 'memoryUsedGB': 1}).get_json()['id']
+    response = client.post('/api/v1/hosts/metrics', json={'samples': [
+        {'hostId': host, 'ts': float('inf'), 'memoryUsedGB': 9},
+        {'hostId': host, 'ts': 4102444800, 'memoryUsedGB': 9},
+        {'hostId': host, 'memoryUsedGB': float('nan')},
+    ]})
+    assert response.status_code == 200
+    assert (response.get_json()['accepted'], response.get_json()['rejected']) == (0, 3)
+
+    assert client.post('/api/v1/hosts/metrics', json={'samples': [{'hostId': host, 'memoryUsedGB': 2}]}
+                       ).get_json()['hostsUpdated'] == 1
+    assert client.get(f'/api/v1/hosts/{host}').get_json()['memoryUsedGB'] == 2
+
+
+HOUR = NOW // 3600 * 3600
+KEPT = {'raw': 3600, '1m': 6 * 3600, '1h': 30 * 86400, '1d': 3650 * 86400}
+
+
+@pytest.fixture
+def standalone(engine):
+    db = engine.standalone()
+    yield db
+    db.close()
+
+
+def _sample(ts, memory, host='h1', cpus=2):
+    return {'hostId': host, 'ts': ts, 'memoryUsedGB': memory, 'diskUsedGB': None, 'cpuCount': cpus}
+
+
+def _rows(db, table):
+    return db.execute(f'SELECT hostId, ts, samples, memoryUsedGB, memoryUsedGBMax FROM {table} ORDER BY hostId, ts'
+                      ).fetchall()
+
+
+def test_rollups_average_and_peak_each_bucket(standalone):
+    host_metrics.append(standalone, [_sample(HOUR + s, m) for s, m in ((0, 1), (20, 3), (65, 8), (70, 2))]
+                        + [_sample(HOUR + 5, 4, host='h2')])
+    written, _ = host_metrics.rollup(standalone, now=HOUR + 60 + host_metrics.GRACE_SECONDS, kept=KEPT)
+    assert written == {'1m': 2}
+    assert _rows(standalone, 'host_metrics_1m') == [('h1', HOUR, 2, 2.0, 3.0), ('h2', HOUR, 1, 4.0, 4.0)]
+
+    host_metrics.rollup(standalone, now=HOUR + 3600 + 120, kept=KEPT)
+    assert _rows(standalone, 'host_metrics_1m')[1] == ('h1', HOUR + 60, 2, 5.0, 8.0)
+    # Weighted by the samples behind each minute
+    assert _rows(standalone, 'host_metrics_1h')[0] == ('h1', HOUR, 4, 3.5, 8.0)
+
+
+def test_late_samples_roll_their_bucket_up_again(standalone):
+    host_metrics.append(standalone, [_sample(HOUR, 2)])
+    host_metrics.rollup(standalone, now=HOUR + 120, kept=KEPT)
+    host_metrics.append(standalone, [_sample(HOUR + 30, 6)])
+    host_metrics.rollup(standalone, now=HOUR + 180, kept=KEPT)
+    assert _rows(standalone, 'host_metrics_1m') == [('h1', HOUR, 2, 4.0, 6.0)]
+
+
+def test_retention_only_drops_rows_the_next_level_has(standalone):
+    host_metrics.append(standalone, [_sample(HOUR + 10, 1), _sample(HOUR + 3590, 1)])
+    _, deleted = host_metrics.rollup(standalone, now=HOUR + 2 * 3600, kept=KEPT)
+    assert deleted['raw'] == 2
+    assert standalone.execute('SELECT COUNT(*) FROM host_metrics_1m').fetchone()[0] == 2
+
+    host_metrics.append(standalone, [_sample(HOUR + 2 * 3600 + 10, 1)])
+    _, deleted = host_metrics.rollup(standalone, now=HOUR + 2 * 3600 + 20, kept=KEPT)
+    assert deleted['raw'] == 0
+
+
+def test_ingest_updates_hosts_only_with_newer_values(client, monkeypatch):
+    monkeypatch.setattr(host_metrics, 'start_scheduler', lambda **kwargs: None)
+    host = client.post('/api/v1/hosts', json={'vmName': 'metrics-02', 'memoryUsedGB': 1, 'state': 'running'}
+                       ).get_json()['id']
+    version = client.get(f'/api/v1/hosts/{host}').get_json()['version']
+    now = int(host_metrics.time.time())
+
+    def ingest(*samples):
+        return client.post('/api/v1/hosts/metrics', json={'samples': list(samples)}).get_json()
+
+    body = ingest({'hostId': host, 'ts': now - 20, 'memoryUsedGB': 3}, {'hostId': host, 'ts': now - 10,
+                                                                        'memoryUsedGB': 5, 'state': 'stopped'},
+                  {'hostId': 'missing', 'ts': now})
+    assert (body['accepted'], body['hostsUpdated'], body['rejected']) == (2, 1, 1)
+    stored = client.get(f'/api/v1/hosts/{host}').get_json()
+    assert (stored['memoryUsedGB'], stored['state'], stored['version']) == (5, 'stopped', version + 1)
+
+    # Older than what is stored, or the same values again: the hosts row is left alone
+    assert ingest({'hostId': host, 'ts': now - 15, 'memoryUsedGB': 9})['hostsUpdated'] == 0
+    assert ingest({'hostId': host, 'ts': now - 5, 'memoryUsedGB': 5})['hostsUpdated'] == 0
+    assert client.get(f'/api/v1/hosts/{host}').get_json()['version'] == version + 1
+
+    series = client.get(f'/api/v1/hosts/{host}/metrics?resolution=raw&from={now - 60}&to={now + 1}').get_json()
+    memory = series['columns'].index('memoryUsedGB')
+    assert [row[memory] for row in series['rows']] == [3, 9, 5, 5]
+    assert client.get('/api/v1/hosts/metrics?resolution=raw').status_code == 400
@@ -0,0 +1,102 @@
+import integrity
+
+
+def _findings(db):
+    return {(item['relation'], item['id']) for item in integrity.findings(db, 100)[1]}
+
+
+def _seed(db):
+    db.execute("INSERT INTO hosts (id, vmName) VALUES ('h1', 'web-01')")
+    db.execute("INSERT INTO ips (id, ipAddress, hostId) VALUES ('ip1', '10.0.0.1', 'h1')")
+    db.commit()
+
+
+def test_first_scan_is_full_then_incremental(db):
+    _seed(db)
+    assert integrity.scan(db) == 'full'
+    assert integrity.scan(db) == 'incremental'
+    assert integrity.scan(db, full=True) == 'full'
+    assert _findings(db) == set()
+
+
+def test_new_rows_are_checked_incrementally(db):
+    _seed(db)
+    integrity.scan(db)
+    db.execute("INSERT INTO ips (id, ipAddress, hostId) VALUES ('ip2', '10.0.0.2', 'gone')")
+    db.commit()
+    assert integrity.scan(db) == 'incremental'
+    assert _findings(db) == {('ips.hostId', 'ip2')}
+
+
+def test_changed_references_and_deleted_parents_are_journaled(db):
+    _seed(db)
+    db.execute("INSERT INTO ips (id, ipAddress) VALUES ('ip2', '10.0.0.2')")
+    db.commit()
+    integrity.scan(db)
+
+    db.execute("UPDATE ips SET hostId = 'gone' WHERE id = 'ip2'")
+    db.commit()
+    integrity.scan(db)
+    assert _findings(db) == {('ips.hostId', 'ip2')}
+
+    db.execute("DELETE FROM hosts WHERE id = 'h1'")
+    db.commit()
+    assert integrity.scan(db) == 'incremental'
+    assert _findings(db) == {('ips.hostId', 'ip1'), ('ips.hostId', 'ip2')}
+
+
+def test_findings_clear_when_the_parent_returns_or_the_child_goes(db):
+    _seed(db)
+    db.execute("DELETE FROM hosts WHERE id = 'h1'")
+    db.execute("INSERT INTO ips (id, ipAddress, hostId) VALUES ('ip2', '10.0.0.2', 'h2')")
+    db.commit()
+    integrity.scan(db)
+    assert _findings(db) == {('ips.hostId', 'ip1'), ('ips.hostId', 'ip2')}
+
+    db.execute("INSERT INTO hosts (id, vmName) VALUES ('h1', 'web-01')")
+    db.execute("DELETE FROM ips WHERE id = 'ip2'")
+    db.commit()
+    integrity.scan(db)
+    assert _findings(db) == set()
+
+
+def test_replaced_tables_are_checked_in_full(db):
+    _seed(db)
+    integrity.scan(db)
+    with integrity.replacing(db, 'ips'):
+        db.execute('DELETE FROM ips')
+        db.execute("INSERT INTO ips (id, ipAddress, hostId) VALUES ('ip1', '10.0.0.1', 'gone')")
+    db.commit()
+    assert db.execute('SELECT COUNT(*) FROM integrity_journal').fetchone()[0] == 0
+    integrity.scan(db)
+    assert _findings(db) == {('ips.hostId', 'ip1')}
+
+
+def test_repair_unlinks_or_deletes_by_relation(db):
+    db.execute("INSERT INTO ips (id, ipAddress, hostId, status) VALUES ('ip1', '10.0.0.1', 'gone', 'assigned')")
+    db.execute("INSERT INTO dhcp_leases (id, scopeId, ipAddress) VALUES ('l1', 'gone', '10.0.0.9')")
+    db.commit()
+    integrity.scan(db)
+    assert integrity.repair(db) == {'ips.hostId': 1, 'dhcp_leases.scopeId': 1}
+    ip = db.execute("SELECT hostId, status FROM ips WHERE id = 'ip1'").fetchone()
+    assert (ip['hostId'], ip['status']) == (None, 'available')
+    assert db.execute("SELECT 1 FROM dhcp_leases WHERE id = 'l1'").fetchone() is None
+    integrity.scan(db)
+    assert _findings(db) == set()
+
+
+def test_get_reads_stored_findings_and_post_scans(client):
+    def dangling(report):
+        return {item['id'] for item in report['findings'] if item['relation'] == 'ips.hostId'}
+
+    scanned = client.post('/api/v1/integrity/scan').get_json()
+    assert scanned['mode'] in ('full', 'incremental') and scanned['scannedAt']
+    client.post('/api/v1/ips', json={'ipAddress': '10.47.0.1', 'status': 'assigned', 'hostId': 'gone'})
+    ip = next(ip['id'] for ip in client.get('/api/v1/ips').get_json() if ip['ipAddress'] == '10.47.0.1')
+
+    stored = client.get('/api/v1/integrity').get_json()
+    assert ip not in dangling(stored) and 'mode' not in stored
+    assert client.get('/api/v1/integrity').get_json()['scannedAt'] == scanned['scannedAt']
+
+    assert ip in dangling(client.post('/api/v1/integrity/scan?full=1').get_json())
+    assert ip in dangling(client.get('/api/v1/integrity').get_json())
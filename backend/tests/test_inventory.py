@@ -0,0 +1,72 @@
+import io
+import json
+
+import inventory
+
+CLUSTER = [
+    {'type': 'qemu', 'name': 'inv-web-01', 'node': 'pve-a', 'maxmem': 8 * 1024 ** 3, 'mem': 2 * 1024 ** 3,
+     'maxcpu': 4, 'status': 'running', 'ostype': 'l26', 'ipAddresses': ['10.50.0.10']},
+    {'type': 'lxc', 'name': 'inv-ct-01', 'node': 'pve-a', 'status': 'stopped', 'ipAddresses': ['10.60.0.10']},
+    {'type': 'qemu', 'name': 'inv-template', 'template': 1},
+]
+
+
+def _import(client, files, query=''):
+    data = {f'file{i}': (io.BytesIO(content), name) for i, (name, content) in enumerate(files)}
+    return client.post(f'/api/v1/hosts/import{query}', data=data, content_type='multipart/form-data')
+
+
+def _hosts(client):
+    return {host['vmName']: host for host in client.get('/api/v1/hosts').get_json()}
+
+
+def test_import_on_a_database_without_subnets(client):
+    assert client.post('/api/v1/backup', json={'subnets': [], 'hosts': []}).status_code == 200
+    response = _import(client, [('cluster.json', json.dumps(CLUSTER).encode())])
+    assert response.status_code == 200
+    assert response.get_json()['counts']['added'] == 2
+    assert _hosts(client)['inv-web-01']['cpuCount'] == 4
+
+
+def test_addresses_land_in_their_subnets_and_reimports_are_unchanged(client):
+    subnet = client.post('/api/v1/subnets', json={'network': '10.51.0.0', 'cidr': 24}).get_json()['id']
+    cluster = json.dumps([dict(CLUSTER[0], name='inv-web-02', ipAddresses=['10.51.0.10']),
+                          dict(CLUSTER[1], name='inv-ct-02', ipAddresses='10.61.0.10')]).encode()
+    first = _import(client, [('cluster.json', cluster)]).get_json()
+    assert (first['counts']['added'], first['counts']['ipsAdded']) == (2, 2)
+    host = _hosts(client)['inv-web-02']
+    ips = {ip['ipAddress']: ip for ip in client.get('/api/v1/ips').get_json()}
+    assert (ips['10.51.0.10']['subnetId'], ips['10.51.0.10']['hostId']) == (subnet, host['id'])
+    assert ips['10.61.0.10']['subnetId'] is None
+
+    again = _import(client, [('cluster.json', cluster)]).get_json()
+    assert (again['counts']['added'], again['counts']['updated'], again['counts']['unchanged']) == (0, 0, 2)
+
+
+def test_dry_run_writes_nothing(client):
+    cluster = json.dumps([dict(CLUSTER[0], name='inv-dry-01')]).encode()
+    response = _import(client, [('cluster.json', cluster)], '?dryRun=1')
+    assert response.get_json()['counts']['added'] == 1
+    assert 'inv-dry-01' not in _hosts(client)
+
+
+def test_unreadable_files(client):
+    response = _import(client, [('cluster.json', b'{not json')])
+    assert response.status_code == 400
+    assert 'cluster.json' in response.get_json()['error']
+
+    cluster = json.dumps([dict(CLUSTER[0], name='inv-partial-01')]).encode()
+    response = _import(client, [('broken.json', b'{not json'), ('cluster.json', cluster)])
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['counts']['added'] == 1
+    assert body['errors'][0]['file'] == 'broken.json'
+    assert client.post('/api/v1/hosts/import', data=b'', content_type='text/csv').status_code == 400
+
+
+def test_pool_parses_in_spawned_workers(monkeypatch):
+    monkeypatch.setattr(inventory, 'POOL_MIN_BYTES', 0)
+    files = [(f'cluster{i}.json', json.dumps(CLUSTER).encode(), None) for i in range(2)] + [('x.json', b'[', None)]
+    parsed = inventory.parse_files(files, workers=2)
+    assert [len(result['vms']) for result in parsed] == [2, 2, 0]
+    assert [result['unreadable'] for result in parsed] == [False, False, True]
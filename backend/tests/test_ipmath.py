@@ -0,0 +1,100 @@
+import ipaddress
+
+import pytest
+
+import ipmath
+
+
+@pytest.fixture(params=['numpy', 'python'])
+def implementation(request, monkeypatch):
+    """Runs a test on the vectorized path (when NumPy is installed) and on the pure-Python one."""
+    if request.param == 'numpy':
+        if not ipmath.available():
+            pytest.skip('NumPy is not installed')
+    else:
+        monkeypatch.setattr(ipmath, 'np', None)
+    return request.param
+
+
+def ints(values):
+    return [int(v) for v in values]
+
+
+def bools(values):
+    return [bool(v) for v in values]
+
+
+def _ip(text):
+    return int(ipaddress.ip_address(text))
+
+
+def test_parse(implementation):
+    values, valid = ipmath.parse(['10.0.0.1', '255.255.255.255', '0.0.0.0', '10.0.0.256', '10.0.0', '01.2.3.4',
+                                  '1.2.3.4.5', 'host', '', '2001:db8::1'])
+    assert bools(valid) == [True, True, True, False, False, False, False, False, False, False]
+    assert ints(values) == [_ip('10.0.0.1'), 2 ** 32 - 1, 0, 0, 0, 0, 0, 0, 0, 0]
+
+
+def test_parse_ipv6(implementation):
+    values, valid = ipmath.parse(['2001:db8::1', '10.0.0.1'], version=6)
+    assert bools(valid) == [True, False]
+    assert ints(values) == [_ip('2001:db8::1'), 0]
+
+
+def test_networks(implementation):
+    starts, ends, prefixlens, valid = ipmath.networks(['10.0.0.0/8', '192.168.1.77/24', '10.1.2.3', '0.0.0.0/0'])
+    assert bools(valid) == [True] * 4
+    assert ints(starts) == [_ip('10.0.0.0'), _ip('192.168.1.0'), _ip('10.1.2.3'), 0]
+    assert ints(ends) == [_ip('10.255.255.255'), _ip('192.168.1.255'), _ip('10.1.2.3'), 2 ** 32 - 1]
+    assert ints(prefixlens) == [8, 24, 32, 0]
+
+
+def test_invalid_networks_have_zero_bounds(implementation):
+    starts, ends, prefixlens, valid = ipmath.networks(['10.1.2.3/33', '10.1.2.3/x', 'net/8', '10.1.2.3/'])
+    assert bools(valid) == [False] * 4
+    assert ints(starts) == ints(ends) == [0] * 4
+
+
+def test_locate_picks_the_narrowest_range(implementation):
+    starts, ends, _, _ = ipmath.networks(['10.0.0.0/8', '10.1.0.0/16', '10.1.2.0/24'])
+    values, _ = ipmath.parse(['10.1.2.3', '10.1.3.1', '10.2.0.1', '11.0.0.1'])
+    assert ints(ipmath.locate(values, starts, ends)) == [2, 1, 0, -1]
+
+
+def test_overlaps(implementation):
+    starts, ends, _, _ = ipmath.networks(['10.0.0.0/24', '10.0.1.0/24', '10.0.0.128/25', '10.0.2.0/23',
+                                          '10.0.3.0/24'])
+    other = ints(ipmath.overlaps(starts, ends))
+    assert other[1] == -1
+    assert (other[0], other[2]) == (2, 0)
+    assert (other[3], other[4]) == (4, 3)
+
+
+def test_summarize(implementation):
+    starts, ends, _, _ = ipmath.networks(['10.0.0.0/25', '10.0.0.128/25', '10.0.1.0/24', '10.0.3.0/24'])
+    blocks, prefixlens = ipmath.summarize(starts, ends)
+    assert ints(blocks) == [_ip('10.0.0.0'), _ip('10.0.3.0')]
+    assert ints(prefixlens) == [23, 24]
+
+
+def test_to_text(implementation):
+    values, _ = ipmath.parse(['10.0.0.1', '255.255.255.255', '0.0.0.0'])
+    assert [str(t) for t in ipmath.to_text(values)] == ['10.0.0.1', '255.255.255.255', '0.0.0.0']
+
+
+def test_empty_inputs(implementation):
+    values, valid = ipmath.parse([])
+    assert ints(values) == [] and bools(valid) == []
+    starts, ends, prefixlens, valid = ipmath.networks([])
+    assert ints(starts) == ints(ends) == ints(prefixlens) == [] and bools(valid) == []
+    assert ints(ipmath.locate([], starts, ends)) == []
+    assert ints(ipmath.locate(ipmath.parse(['10.0.0.1'])[0], starts, ends)) == [-1]
+    assert ints(ipmath.overlaps(starts, ends)) == []
+    blocks, prefixlens = ipmath.summarize(starts, ends)
+    assert ints(blocks) == ints(prefixlens) == []
+    assert list(ipmath.to_text([])) == []
+
+
+def test_unknown_version():
+    with pytest.raises(ValueError):
+        ipmath.parse(['10.0.0.1'], version=5)
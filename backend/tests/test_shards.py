@@ -0,0 +1,54 @@
+import pytest
+
+import database
+import shards
+
+
+@pytest.fixture
+def sharded(tmp_path, monkeypatch):
+    """Test client of an app whose tenant rows live in per-company shards."""
+    monkeypatch.setattr(shards, 'ENABLED', True)
+    monkeypatch.setattr(database, 'engine', shards.ShardedEngine(str(tmp_path / 'main.db'), str(tmp_path / 'shards')))
+    monkeypatch.setattr(shards, '_owners', {})
+    from app import create_app
+    client = create_app().test_client()
+    with client.session_transaction() as session:
+        session['user'] = {'email': 'tester@example.com', 'displayName': 'Tester'}
+    return client
+
+
+@pytest.fixture
+def companies(sharded):
+    return [sharded.post('/api/v1/companies', json={'name': name}).get_json()['id'] for name in ('Acme', 'Beta')]
+
+
+def test_item_requests_reuse_the_known_shard(sharded, companies, monkeypatch):
+    host = sharded.post('/api/v1/hosts', json={'vmName': 'web-01', 'companyId': companies[0]}).get_json()['id']
+    searched = []
+    holds = shards._holds
+    monkeypatch.setattr(shards, '_holds', lambda *args: searched.append(args[0]) or holds(*args))
+    assert sharded.get(f'/api/v1/hosts/{host}').status_code == 200
+    assert searched == [None, companies[0]]
+    searched.clear()
+    assert sharded.get(f'/api/v1/hosts/{host}').status_code == 200
+    assert searched == [companies[0]]
+
+    sharded.delete(f'/api/v1/hosts/{host}')
+    assert sharded.get(f'/api/v1/hosts/{host}').status_code == 404
+
+
+def test_updates_do_not_move_rows_between_shards(sharded, companies):
+    acme, beta = companies
+    host = sharded.post('/api/v1/hosts', json={'vmName': 'web-01', 'companyId': acme}).get_json()['id']
+    subnets = [sharded.post('/api/v1/subnets', json={'network': f'10.{i}.0.0', 'cidr': 24, 'companyId': company}
+                            ).get_json()['id'] for i, company in enumerate(companies)]
+    ip = sharded.post('/api/v1/ips', json={'ipAddress': '10.0.0.5', 'subnetId': subnets[0]}).get_json()['id']
+
+    assert sharded.put(f'/api/v1/hosts/{host}', json={'vmName': 'web-02', 'companyId': acme}).status_code == 200
+    assert sharded.put(f'/api/v1/hosts/{host}', json={'companyId': beta}).status_code == 409
+    assert sharded.put(f'/api/v1/hosts/{host}', json={'companyId': None}).status_code == 409
+    assert sharded.put(f'/api/v1/hosts/{host}', json={'companyId': beta},
+                       headers={shards.SCOPE_HEADER: acme}).status_code == 409
+    assert sharded.put(f'/api/v1/ips/{ip}', json={'subnetId': subnets[1]}).status_code == 409
+    assert sharded.put(f'/api/v1/ips/{ip}', json={'subnetId': None, 'status': 'available'}).status_code == 200
+    assert sharded.get(f'/api/v1/hosts/{host}').get_json()['companyId'] == acme
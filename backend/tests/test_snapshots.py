@@ -0,0 +1,56 @@
+import sqlite3
+from contextlib import closing
+
+import pytest
+
+import snapshots
+
+
+def _snapshot(tmp_path, path):
+    return snapshots.create_snapshot(str(tmp_path / 'snapshots'), source=path, pause=0)['name']
+
+
+def _restore(tmp_path, name, target):
+    return snapshots.restore_snapshot(name, str(tmp_path / 'snapshots'), target=target)
+
+
+def _execute(path, *statements):
+    with closing(sqlite3.connect(path)) as db:
+        for sql in statements:
+            db.execute(sql)
+        db.commit()
+
+
+def test_restore_brings_the_live_data_back(tmp_path, engine):
+    _execute(engine.path, "INSERT INTO companies (id, name) VALUES ('c1', 'Acme')")
+    name = _snapshot(tmp_path, engine.path)
+    _execute(engine.path, 'DELETE FROM companies')
+    assert _restore(tmp_path, name, engine.path)['restored']
+    with closing(sqlite3.connect(engine.path)) as db:
+        assert db.execute('SELECT name FROM companies').fetchall() == [('Acme',)]
+
+
+def test_older_snapshots_are_migrated(tmp_path, engine):
+    # The layout before audit_log recorded its user
+    old = str(tmp_path / 'old.db')
+    type(engine)(old).init_schema()
+    _execute(old, 'ALTER TABLE audit_log DROP COLUMN userId', 'ALTER TABLE audit_log DROP COLUMN userName',
+             "INSERT INTO audit_log (id, action) VALUES ('a1', 'create')", 'PRAGMA user_version = 1')
+    _restore(tmp_path, _snapshot(tmp_path, old), engine.path)
+    with closing(sqlite3.connect(engine.path)) as db:
+        assert db.execute('SELECT id, userId FROM audit_log').fetchall() == [('a1', None)]
+
+
+@pytest.mark.parametrize('change', [
+    'ALTER TABLE companies ADD COLUMN region TEXT',
+    'CREATE TABLE widgets (id TEXT PRIMARY KEY)',
+])
+def test_snapshots_from_another_schema_are_refused(tmp_path, engine, change):
+    other = str(tmp_path / 'other.db')
+    type(engine)(other).init_schema()
+    _execute(other, change, "INSERT INTO companies (id, name) VALUES ('c9', 'Other')", 'PRAGMA user_version = 7')
+    _execute(engine.path, "INSERT INTO companies (id, name) VALUES ('c1', 'Acme')")
+    with pytest.raises(snapshots.SnapshotError):
+        _restore(tmp_path, _snapshot(tmp_path, other), engine.path)
+    with closing(sqlite3.connect(engine.path)) as db:
+        assert db.execute('SELECT id FROM companies').fetchall() == [('c1',)]
@@ -0,0 +1,81 @@
+import pytest
+
+TEMPLATE = {
+    'name': 'Branch', 'cidr': 24,
+    'ranges': [{'name': 'DHCP', 'purpose': 'dhcp', 'startOffset': 100, 'endOffset': 199}],
+    'reservations': [{'offset': 1, 'type': 'gateway', 'description': 'Gateway'}],
+}
+
+
+@pytest.fixture
+def template(client):
+    return client.post('/api/v1/templates', json=TEMPLATE).get_json()['id']
+
+
+def _apply(client, template, body):
+    return client.post(f'/api/v1/templates/{template}/apply', json=body)
+
+
+def _subnet_ips(client, subnet):
+    return {ip['ipAddress']: ip for ip in client.get('/api/v1/ips').get_json() if ip['subnetId'] == subnet}
+
+
+def test_apply_on_a_database_without_subnets(client):
+    assert client.post('/api/v1/backup', json={'subnets': [], 'hosts': []}).status_code == 200
+    template = client.post('/api/v1/templates', json=TEMPLATE).get_json()['id']
+    response = _apply(client, template, {'networks': ['10.40.0.0', '10.40.1.0']})
+    assert response.status_code == 201
+    body = response.get_json()
+    assert [(s['network'], s['cidr']) for s in body['subnets']] == [('10.40.0.0', 24), ('10.40.1.0', 24)]
+    assert (body['ranges'], body['reservations']) == (2, 2)
+    ips = _subnet_ips(client, body['subnets'][0]['id'])
+    assert ips['10.40.0.1']['status'] == 'reserved'
+
+
+def test_duplicates_conflict_and_create_nothing(client, template):
+    _apply(client, template, {'network': '10.41.0.0'})
+    before = len(client.get('/api/v1/subnets').get_json())
+    response = _apply(client, template, {'networks': ['10.41.0.0', '10.41.1.0']})
+    assert response.status_code == 409
+    assert len(response.get_json()['conflicts']) == 1
+    assert _apply(client, template, {'networks': ['10.41.2.0', '10.41.2.0/24']}).status_code == 409
+    assert len(client.get('/api/v1/subnets').get_json()) == before
+
+
+def test_nested_networks_take_over_addresses_from_the_parent(client, template):
+    site = client.post('/api/v1/subnets', json={'network': '10.42.0.0', 'cidr': 16}).get_json()['id']
+    for address in ('10.42.3.1', '10.42.3.20', '10.42.4.20'):
+        client.post('/api/v1/ips', json={'ipAddress': address, 'status': 'available', 'subnetId': site})
+    client.post('/api/v1/ips', json={'ipAddress': '10.42.3.30', 'status': 'available'})
+
+    response = _apply(client, template, {'network': '10.42.3.0'})
+    assert response.status_code == 201
+    assert response.get_json()['linked'] == 2
+    branch = response.get_json()['subnets'][0]['id']
+    ips = _subnet_ips(client, branch)
+    assert set(ips) == {'10.42.3.1', '10.42.3.20', '10.42.3.30'}
+    assert ips['10.42.3.1']['status'] == 'reserved'
+    assert set(_subnet_ips(client, site)) == {'10.42.4.20'}
+
+
+def test_assigned_address_at_a_reserved_offset_conflicts(client, template):
+    client.post('/api/v1/ips', json={'ipAddress': '10.43.0.1', 'status': 'assigned'})
+    response = _apply(client, template, {'network': '10.43.0.0'})
+    assert response.status_code == 409
+    assert '10.43.0.1' in response.get_json()['conflicts'][0]
+
+
+def test_ipv6_networks_need_their_own_prefix(client, template):
+    assert _apply(client, template, {'network': '2001:db8::'}).status_code == 400
+    response = _apply(client, template, {'networks': [{'network': '2001:db8:1::', 'cidr': 64}]})
+    assert response.status_code == 201
+    subnet = response.get_json()['subnets'][0]
+    assert (subnet['network'], subnet['cidr']) == ('2001:db8:1::', 64)
+
+
+def test_bad_requests(client, template):
+    assert _apply(client, template, ['10.44.0.0']).status_code == 400
+    assert _apply(client, template, {}).status_code == 400
+    assert _apply(client, template, {'network': 'branch'}).status_code == 400
+    assert _apply(client, template, {'networks': [{'network': '10.44.0.0', 'cidr': 30}]}).status_code == 400
+    assert _apply(client, 'missing', {'network': '10.44.0.0'}).status_code == 404
@@ -0,0 +1,76 @@
+import versioning
+
+
+def _create(client, path, body):
+    response = client.post(f'/api/v1/{path}', json=body)
+    assert response.status_code == 201
+    return response.get_json()['id']
+
+
+def test_get_returns_the_version_as_etag(client):
+    host = _create(client, 'hosts', {'vmName': 'web-01'})
+    response = client.get(f'/api/v1/hosts/{host}')
+    assert response.get_json()['version'] == 1
+    assert response.headers['ETag'] == '"1"'
+    assert client.get(f'/api/v1/hosts/{host}', headers={'If-None-Match': '"1"'}).status_code == 304
+
+
+def test_put_with_matching_if_match_bumps_the_version(client):
+    host = _create(client, 'hosts', {'vmName': 'web-01'})
+    response = client.put(f'/api/v1/hosts/{host}', json={'state': 'running'}, headers={'If-Match': '"1"'})
+    assert response.status_code == 200
+    assert response.get_json()['version'] == 2
+    assert response.headers['ETag'] == '"2"'
+
+
+def test_put_with_stale_if_match_answers_412_with_the_current_row(client):
+    host = _create(client, 'hosts', {'vmName': 'web-01'})
+    client.put(f'/api/v1/hosts/{host}', json={'state': 'running'})
+    response = client.put(f'/api/v1/hosts/{host}', json={'state': 'stopped'}, headers={'If-Match': '"1"'})
+    assert response.status_code == 412
+    body = response.get_json()
+    assert body['version'] == 2
+    assert body['current']['state'] == 'running'
+    assert client.get(f'/api/v1/hosts/{host}').get_json()['state'] == 'running'
+
+
+def test_if_match_star_and_missing_row(client):
+    host = _create(client, 'hosts', {'vmName': 'web-01'})
+    assert client.put(f'/api/v1/hosts/{host}', json={'state': 'x'}, headers={'If-Match': '*'}).status_code == 200
+    assert client.put('/api/v1/hosts/missing', json={'state': 'x'}, headers={'If-Match': '"1"'}).status_code == 404
+
+
+def test_partial_put_leaves_absent_fields_alone(client):
+    host = _create(client, 'hosts', {'vmName': 'web-01', 'description': 'front end', 'cpuCount': 4})
+    assert client.put(f'/api/v1/hosts/{host}', json={'cpuCount': 8}).status_code == 200
+    row = client.get(f'/api/v1/hosts/{host}').get_json()
+    assert (row['vmName'], row['description'], row['cpuCount']) == ('web-01', 'front end', 8)
+
+
+def test_stale_delete_keeps_the_row_and_its_dependents(client):
+    host = _create(client, 'hosts', {'vmName': 'web-01'})
+    ip = _create(client, 'ips', {'ipAddress': '10.20.0.5', 'status': 'assigned', 'hostId': host})
+    assert client.delete(f'/api/v1/hosts/{host}', headers={'If-Match': '"7"'}).status_code == 412
+    assert client.get(f'/api/v1/ips/{ip}').get_json()['hostId'] == host
+
+    assert client.delete(f'/api/v1/hosts/{host}', headers={'If-Match': '"1"'}).status_code == 200
+    assert client.get(f'/api/v1/hosts/{host}').status_code == 404
+    released = client.get(f'/api/v1/ips/{ip}').get_json()
+    assert (released['hostId'], released['status']) == (None, 'available')
+
+
+def test_dependent_writes_follow_the_conditional_statement(client, monkeypatch):
+    """A version change between the up-front check and the UPDATE still leaves the IPs alone."""
+    subnet = _create(client, 'subnets', {'network': '10.21.0.0', 'cidr': 24})
+    ip = _create(client, 'ips', {'ipAddress': '10.21.0.9', 'status': 'assigned', 'subnetId': subnet})
+    monkeypatch.setattr(versioning, 'precondition', lambda *args, **kwargs: None)
+
+    response = client.put(f'/api/v1/subnets/{subnet}', json={'network': '10.22.0.0'}, headers={'If-Match': '"5"'})
+    assert response.status_code == 412
+    assert client.get(f'/api/v1/ips/{ip}').get_json()['subnetId'] == subnet
+    assert client.delete(f'/api/v1/subnets/{subnet}', headers={'If-Match': '"5"'}).status_code == 412
+    assert client.get(f'/api/v1/ips/{ip}').get_json()['subnetId'] == subnet
+
+    assert client.put(f'/api/v1/subnets/{subnet}', json={'network': '10.22.0.0'},
+                      headers={'If-Match': '"1"'}).status_code == 200
+    assert client.get(f'/api/v1/ips/{ip}').get_json()['subnetId'] is None
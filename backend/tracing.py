@@ -0,0 +1,98 @@
+"""Opt-in SQL tracing, slow-query logging and Server-Timing headers.
+
+OPENIPAM_SLOW_QUERY_MS   log statements slower than this many milliseconds,
+                         together with their EXPLAIN QUERY PLAN
+OPENIPAM_SQL_TRACE=1     additionally log every statement (with bound values)
+                         at DEBUG level through sqlite3's trace callback
+"""
+import os
+import logging
+from time import perf_counter
+from flask import g, request
+from flask.json.provider import DefaultJSONProvider
+
+logger = logging.getLogger('openipam.sql')
+
+_slow_ms = os.environ.get('OPENIPAM_SLOW_QUERY_MS')
+SLOW_QUERY_SECONDS = float(_slow_ms) / 1000.0 if _slow_ms else None
+TRACE_ALL = os.environ.get('OPENIPAM_SQL_TRACE') == '1'
+ENABLED = SLOW_QUERY_SECONDS is not None or TRACE_ALL
+
+_EXPLAINABLE = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH', 'REPLACE')
+
+
+def attach(conn):
+    """Install the trace callback on a freshly opened connection."""
+    if not ENABLED:
+        return
+
+    def _trace(statement):
+        conn.last_statement = statement
+        if TRACE_ALL:
+            logger.debug('SQL: %s', statement)
+
+    conn.set_trace_callback(_trace)
+
+
+def check_slow(conn, sql, parameters, elapsed):
+    """Log a statement that crossed the slow-query threshold, with its query plan."""
+    if SLOW_QUERY_SECONDS is None or elapsed < SLOW_QUERY_SECONDS:
+        return
+    plan = ''
+    if sql.lstrip()[:7].upper().startswith(_EXPLAINABLE):
+        try:
+            rows = conn.explain(sql, parameters)
+            plan = '\n'.join(f'  {"  " * _depth(rows, r)}{r[3]}' for r in rows)
+        except Exception as e:
+            plan = f'  (plan unavailable: {e})'
+    statement = getattr(conn, 'last_statement', None) or sql
+    endpoint = request.endpoint if request else None
+    if plan:
+        statement = f'{statement}\n{plan}'
+    logger.warning('Slow query (%.1f ms) in %s: %s', elapsed * 1000, endpoint, statement)
+
+
+def _depth(rows, row):
+    """Indentation level of an EXPLAIN QUERY PLAN row (rows are id, parent, notused, detail)."""
+    parents = {r[0]: r[1] for r in rows}
+    depth, parent = 0, row[1]
+    while parent in parents and depth < 16:
+        depth += 1
+        parent = parents[parent]
+    return depth
+
+
+class TimedJSONProvider(DefaultJSONProvider):
+    """JSON provider that accumulates encoding time for the serialize phase."""
+
+    def dumps(self, obj, **kwargs):
+        start = perf_counter()
+        try:
+            return super().dumps(obj, **kwargs)
+        finally:
+            if g:
+                g._serialize_time = g.get('_serialize_time', 0.0) + perf_counter() - start
+
+
+def _add_server_timing(response):
+    if not request.path.startswith('/api/'):
+        return response
+    start = g.get('_metrics_start')
+    if start is None:
+        return response
+    total = (perf_counter() - start) * 1000
+    db = g.get('db')
+    db_ms = db.db_time * 1000 if db is not None else 0.0
+    ser_ms = g.get('_serialize_time', 0.0) * 1000
+    app_ms = max(total - db_ms - ser_ms, 0.0)
+    response.headers['Server-Timing'] = (
+        f'db;dur={db_ms:.2f}, serialize;dur={ser_ms:.2f}, app;dur={app_ms:.2f}, total;dur={total:.2f}'
+    )
+    return response
+
+
+def init_app(app):
+    """Install the timed JSON provider and the Server-Timing response hook."""
+    app.json_provider_class = TimedJSONProvider
+    app.json = TimedJSONProvider(app)
+    app.after_request(_add_server_timing)
@@ -0,0 +1,119 @@
+"""Row versions and conditional writes (optimistic concurrency).
+
+Rows of the entity tables (database.VERSIONED_TABLES) carry a ``version`` that
+starts at 1 and is bumped by every update. Single-row GETs return it as the
+ETag; PUT and DELETE accept ``If-Match`` and only touch the row while its
+version still matches, answering 412 with the current row otherwise. The
+check is part of the UPDATE/DELETE statement itself, so two clients racing on
+the same row cannot both win.
+
+Writes to other rows that belong to the same change (releasing a deleted
+host's IPs, rehoming a subnet's addresses) go through ``then``: it runs after
+the conditional statement, in the same unit, and gets an SQL guard that is
+only true when that statement went through, so a 412 leaves them undone too.
+"""
+from flask import jsonify, request
+
+
+def tagged(item, status=200):
+    """JSON response for a single row, with its version as the ETag."""
+    response = jsonify(item)
+    response.status_code = status
+    if item.get('version') is not None:
+        response.set_etag(str(item['version']))
+        if request.method == 'GET':
+            # Answers If-None-Match revalidation with 304
+            response.make_conditional(request)
+    return response
+
+
+def changes(data, fields):
+    """The subset of ``fields`` present in a request body; absent fields are left untouched."""
+    return {f: data[f] for f in fields if f in data}
+
+
+def _expected():
+    """Versions accepted by If-Match: None when the header is absent or ``*``."""
+    if_match = request.if_match
+    if not if_match or if_match.star_tag:
+        return None
+    return [int(tag) for tag in if_match.as_set() if tag.isdigit()]
+
+
+def _condition(expected):
+    if expected is None:
+        return '', []
+    if not expected:
+        return ' AND 1 = 0', []
+    return f' AND version IN ({",".join("?" * len(expected))})', expected
+
+
+def _mismatch(db, table, id, not_found, decode=None):
+    row = db.execute(f'SELECT * FROM {table} WHERE id = ?', (id,)).fetchone()
+    if not row:
+        return jsonify({'error': not_found}), 404
+    current = decode(dict(row)) if decode else dict(row)
+    return tagged({'error': 'Precondition failed: the row was changed by someone else',
+                   'current': current, 'version': current.get('version')}, 412)
+
+
+def precondition(db, table, id, not_found, decode=None):
+    """Check If-Match up front, for writes that read or check other rows before this one."""
+    expected = _expected()
+    if expected is None:
+        return None
+    row = db.execute(f'SELECT version FROM {table} WHERE id = ?', (id,)).fetchone()
+    if not row or row['version'] not in expected:
+        return _mismatch(db, table, id, not_found, decode)
+    return None
+
+
+def _updated(table, id, values, expected):
+    """Guard that holds once the conditional UPDATE has applied ``values`` to the row."""
+    guard, parameters = f'SELECT 1 FROM {table} WHERE id = ?', [id]
+    if 'updatedAt' in values:
+        guard += ' AND updatedAt = ?'
+        parameters.append(values['updatedAt'])
+    if expected is not None:
+        condition, versions = _condition([version + 1 for version in expected])
+        guard += condition
+        parameters += versions
+    return f'EXISTS ({guard})', parameters
+
+
+def update(db, table, id, values, not_found, body, decode=None, then=None):
+    """Apply ``values`` to one row if If-Match allows it and bump its version.
+
+    Returns the response: ``body`` plus the new version on success, 404 for a
+    missing row and 412 with the current row on a version mismatch. ``decode``
+    turns a stored row back into its API form (JSON columns). ``then(guard,
+    parameters)`` queues the dependent writes, each with ``AND guard``.
+    """
+    expected = _expected()
+    condition, parameters = _condition(expected)
+    assignments = ''.join(f'{col}=?, ' for col in values)
+    cur = db.execute(f'UPDATE {table} SET {assignments}version=version+1 WHERE id=?{condition}',
+                     [*values.values(), id, *parameters])
+    if then:
+        then(*_updated(table, id, values, expected))
+    db.commit()
+    if cur.rowcount == 0:
+        return _mismatch(db, table, id, not_found, decode)
+    row = db.execute(f'SELECT version FROM {table} WHERE id = ?', (id,)).fetchone()
+    return tagged({**body, 'version': row['version'] if row else None})
+
+
+def delete(db, table, id, not_found, body, decode=None, then=None):
+    """Delete one row if If-Match allows it; 412 with the current row otherwise.
+
+    ``then(guard, parameters)`` queues the dependent writes, as for update().
+    """
+    expected = _expected()
+    condition, parameters = _condition(expected)
+    cur = db.execute(f'DELETE FROM {table} WHERE id = ?{condition}', [id, *parameters])
+    if then:
+        then(f'NOT EXISTS (SELECT 1 FROM {table} WHERE id = ?)', [id])
+    db.commit()
+    if cur.rowcount == 0 and expected is not None:
+        return _mismatch(db, table, id, not_found, decode)
+    return jsonify(body)
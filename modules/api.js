@@ -1,3 +1,153 @@
+// Minimal MessagePack codec for the backup, list and sync transfers (formats.py on the server)
+const MsgPack = {
+    MIME: 'application/msgpack',
+
+    decode(buffer) {
+        const bytes = new Uint8Array(buffer);
+        const view = new DataView(bytes.buffer, bytes.byteOffset, bytes.byteLength);
+        const text = new TextDecoder();
+        let pos = 0;
+
+        const str = (n) => {
+            const end = pos + n;
+            if (n <= 32) {
+                // Short ASCII strings (ids, names, addresses) are cheaper to build by hand than through TextDecoder
+                let i = pos;
+                while (i < end && bytes[i] < 0x80) i++;
+                if (i === end) {
+                    const s = String.fromCharCode.apply(null, bytes.subarray(pos, end));
+                    pos = end;
+                    return s;
+                }
+            }
+            const s = text.decode(bytes.subarray(pos, end));
+            pos = end;
+            return s;
+        };
+        const bin = (n) => {
+            const b = bytes.slice(pos, pos + n);
+            pos += n;
+            return b;
+        };
+        const array = (n) => {
+            const out = new Array(n);
+            for (let i = 0; i < n; i++) out[i] = read();
+            return out;
+        };
+        const map = (n) => {
+            const out = {};
+            for (let i = 0; i < n; i++) {
+                const key = read();
+                out[key] = read();
+            }
+            return out;
+        };
+        const read = () => {
+            const b = bytes[pos++];
+            if (b < 0x80) return b;
+            if (b < 0x90) return map(b & 0x0f);
+            if (b < 0xa0) return array(b & 0x0f);
+            if (b < 0xc0) return str(b & 0x1f);
+            if (b >= 0xe0) return b - 0x100;
+            let v;
+            switch (b) {
+                case 0xc0: return null;
+                case 0xc2: return false;
+                case 0xc3: return true;
+                case 0xc4: v = view.getUint8(pos); pos += 1; return bin(v);
+                case 0xc5: v = view.getUint16(pos); pos += 2; return bin(v);
+                case 0xc6: v = view.getUint32(pos); pos += 4; return bin(v);
+                case 0xca: v = view.getFloat32(pos); pos += 4; return v;
+                case 0xcb: v = view.getFloat64(pos); pos += 8; return v;
+                case 0xcc: v = view.getUint8(pos); pos += 1; return v;
+                case 0xcd: v = view.getUint16(pos); pos += 2; return v;
+                case 0xce: v = view.getUint32(pos); pos += 4; return v;
+                case 0xcf: v = Number(view.getBigUint64(pos)); pos += 8; return v;
+                case 0xd0: v = view.getInt8(pos); pos += 1; return v;
+                case 0xd1: v = view.getInt16(pos); pos += 2; return v;
+                case 0xd2: v = view.getInt32(pos); pos += 4; return v;
+                case 0xd3: v = Number(view.getBigInt64(pos)); pos += 8; return v;
+                case 0xd9: v = view.getUint8(pos); pos += 1; return str(v);
+                case 0xda: v = view.getUint16(pos); pos += 2; return str(v);
+                case 0xdb: v = view.getUint32(pos); pos += 4; return str(v);
+                case 0xdc: v = view.getUint16(pos); pos += 2; return array(v);
+                case 0xdd: v = view.getUint32(pos); pos += 4; return array(v);
+                case 0xde: v = view.getUint16(pos); pos += 2; return map(v);
+                case 0xdf: v = view.getUint32(pos); pos += 4; return map(v);
+            }
+            throw new Error(`MessagePack: unsupported type 0x${b.toString(16)} at ${pos - 1}`);
+        };
+        return read();
+    },
+
+    encode(value) {
+        let bytes = new Uint8Array(1 << 16);
+        let view = new DataView(bytes.buffer);
+        let pos = 0;
+        const text = new TextEncoder();
+
+        const reserve = (n) => {
+            if (pos + n <= bytes.length) return;
+            let size = bytes.length * 2;
+            while (size < pos + n) size *= 2;
+            const grown = new Uint8Array(size);
+            grown.set(bytes);
+            bytes = grown;
+            view = new DataView(bytes.buffer);
+        };
+        const header = (n, fix, fixMax, op16, op32) => {
+            reserve(5);
+            if (n <= fixMax) { bytes[pos++] = fix | n; }
+            else if (n < 0x10000) { bytes[pos++] = op16; view.setUint16(pos, n); pos += 2; }
+            else { bytes[pos++] = op32; view.setUint32(pos, n); pos += 4; }
+        };
+        const write = (v) => {
+            if (v == null) { reserve(1); bytes[pos++] = 0xc0; }
+            else if (v === false || v === true) { reserve(1); bytes[pos++] = v ? 0xc3 : 0xc2; }
+            else if (typeof v === 'number') {
+                reserve(9);
+                if (Number.isInteger(v) && v >= 0 && v < 0x80) { bytes[pos++] = v; }
+                else if (Number.isInteger(v) && v < 0 && v >= -32) { bytes[pos++] = v & 0xff; }
+                else if (Number.isInteger(v) && v >= -0x80000000 && v <= 0xffffffff) {
+                    if (v >= 0) { bytes[pos++] = 0xce; view.setUint32(pos, v); }
+                    else { bytes[pos++] = 0xd2; view.setInt32(pos, v); }
+                    pos += 4;
+                } else { bytes[pos++] = 0xcb; view.setFloat64(pos, v); pos += 8; }
+            } else if (typeof v === 'string') {
+                const n = v.length;
+                let ascii = true;
+                for (let i = 0; i < n; i++) {
+                    if (v.charCodeAt(i) > 0x7f) { ascii = false; break; }
+                }
+                // ASCII (nearly every value here) is copied inline; TextEncoder only for the rest
+                const encoded = ascii ? null : text.encode(v);
+                const length = ascii ? n : encoded.length;
+                if (length < 32) { reserve(1); bytes[pos++] = 0xa0 | length; }
+                else if (length < 0x100) { reserve(2); bytes[pos++] = 0xd9; bytes[pos++] = length; }
+                else header(length, 0, -1, 0xda, 0xdb);
+                reserve(length);
+                if (ascii) {
+                    for (let i = 0; i < n; i++) bytes[pos++] = v.charCodeAt(i);
+                } else {
+                    bytes.set(encoded, pos);
+                    pos += length;
+                }
+            } else if (Array.isArray(v)) {
+                header(v.length, 0x90, 15, 0xdc, 0xdd);
+                for (const item of v) write(item);
+            } else if (typeof v === 'object') {
+                const keys = Object.keys(v).filter(k => v[k] !== undefined);
+                header(keys.length, 0x80, 15, 0xde, 0xdf);
+                for (const k of keys) { write(k); write(v[k]); }
+            } else {
+                write(String(v));
+            }
+        };
+        write(value);
+        return bytes.subarray(0, pos);
+    }
+};
+
 const API = {
     _baseUrl: '/api/v1',
     _available: false,
@@ -22,11 +172,22 @@ const API = {
         return this._available;
     },
 
-    async _request(method, path, data = null) {
+    // Decodes a response body as MessagePack or JSON depending on what the server chose
+    async readBody(res) {
+        const type = res.headers.get('Content-Type') || '';
+        if (type.startsWith(MsgPack.MIME)) return MsgPack.decode(await res.arrayBuffer());
+        return res.json();
+    },
+
+    async _request(method, path, data = null, version = null) {
         const opts = {
             method,
-            headers: { 'Content-Type': 'application/json' }
+            headers: { 'Content-Type': 'application/json', 'Accept': `${MsgPack.MIME}, application/json` }
         };
+        // Conditional write: the server answers 412 if the row changed since `version`
+        if (version != null) {
+            opts.headers['If-Match'] = `"${version}"`;
+        }
         if (data && (method === 'POST' || method === 'PUT')) {
             opts.body = JSON.stringify(data);
         }
@@ -37,10 +198,14 @@ const API = {
         }
         if (!res.ok) {
             const err = await res.json().catch(() => ({ error: res.statusText }));
-            throw new Error(err.error || err.message || 'API request failed');
+            const error = new Error(err.error || err.message || 'API request failed');
+            error.status = res.status;
+            // On 412 the server sends the row as it is now, so callers can merge without a refetch
+            if (res.status === 412) error.current = err.current;
+            throw error;
         }
         if (res.status === 204) return null;
-        return res.json();
+        return this.readBody(res);
     },
 
     async getAll(entity) {
@@ -55,12 +220,12 @@ const API = {
         return this._request('POST', `/${entity}`, data);
     },
 
-    async update(entity, id, data) {
-        return this._request('PUT', `/${entity}/${id}`, data);
+    async update(entity, id, data, version = null) {
+        return this._request('PUT', `/${entity}/${id}`, data, version);
     },
 
-    async remove(entity, id) {
-        return this._request('DELETE', `/${entity}/${id}`);
+    async remove(entity, id, version = null) {
+        return this._request('DELETE', `/${entity}/${id}`, null, version);
     },
 
     async getDashboard() {
@@ -71,11 +236,75 @@ const API = {
         return this._request('GET', `/search?q=${encodeURIComponent(q)}`);
     },
 
+    async savedFilterResults(id, { limit = 100, offset = 0, sort = '', order = 'asc' } = {}) {
+        const params = new URLSearchParams({ limit, offset, order });
+        if (sort) params.set('sort', sort);
+        return this._request('GET', `/saved_filters/${encodeURIComponent(id)}/results?${params}`);
+    },
+
+    async applyTemplate(id, networks, { companyId = null, name, vlanId } = {}) {
+        return this._request('POST', `/templates/${encodeURIComponent(id)}/apply`, { networks, companyId, name, vlanId });
+    },
+
+    // Time series of one host, or of all hosts added up when id is null; from/to in Unix seconds
+    async hostMetrics(id, { from, to, resolution } = {}) {
+        const params = new URLSearchParams();
+        if (from !== undefined) params.set('from', from);
+        if (to !== undefined) params.set('to', to);
+        if (resolution) params.set('resolution', resolution);
+        const path = id ? `/hosts/${encodeURIComponent(id)}/metrics` : '/hosts/metrics';
+        return this._request('GET', `${path}?${params}`);
+    },
+
+    async integrity({ limit } = {}) {
+        const params = new URLSearchParams();
+        if (limit !== undefined) params.set('limit', limit);
+        return this._request('GET', `/integrity?${params}`);
+    },
+
+    async scanIntegrity({ full = false, limit } = {}) {
+        const params = new URLSearchParams();
+        if (full) params.set('full', '1');
+        if (limit !== undefined) params.set('limit', limit);
+        return this._request('POST', `/integrity/scan?${params}`);
+    },
+
+    async repairIntegrity(relations) {
+        return this._request('POST', '/integrity/repair', relations ? { relations } : {});
+    },
+
     async exportBackup() {
         return this._request('GET', '/backup');
     },
 
     async importBackup(data) {
         return this._request('POST', '/backup', data);
+    },
+
+    // Summary of what importing `data` would change: {summary: {table: {added, removed, changed, unchanged}}, total}
+    async diffBackup(data) {
+        return this._request('POST', '/backup/diff?summary=1', { to: { backup: data } });
+    },
+
+    // Reconcile hosts with Proxmox / RVTools / inventory CSV export files (File objects):
+    // {counts: {added, updated, unchanged, skipped, missing, ipsAdded, ipsUpdated, locationsAdded}, changes, errors}
+    async importInventory(files, { companyId, dryRun = false, updateExisting = true } = {}) {
+        const params = new URLSearchParams({ dryRun: dryRun ? '1' : '0', updateExisting: updateExisting ? '1' : '0' });
+        if (companyId) params.set('companyId', companyId);
+        const form = new FormData();
+        for (const file of files) form.append('files', file, file.name);
+        // Multipart upload, so not through _request(), which sends JSON
+        const res = await fetch(`${this._baseUrl}/hosts/import?${params}`, { method: 'POST', body: form });
+        if (res.status === 401) {
+            window.location.href = '/auth/saml/login';
+            throw new Error('Authentication required');
+        }
+        if (!res.ok) {
+            const err = await res.json().catch(() => ({ error: res.statusText }));
+            const error = new Error(err.error || 'Inventory import failed');
+            error.status = res.status;
+            throw error;
+        }
+        return this.readBody(res);
     }
 };
@@ -29,6 +29,11 @@ const DB = {
     _backendAvailable: false,
     _refreshTimer: null,
     _syncing: false,
+    _events: null,
+    _eventDebounce: null,
+    _msgpack: false, // server answered with MessagePack, so sync bodies use it too
+    // Identifies this tab's own writes in the change stream so they don't trigger a reload
+    _clientId: Math.random().toString(36).slice(2) + Date.now().toString(36),
 
     _tableMap: {
         'ipdb_companies': 'companies',
@@ -890,13 +895,17 @@ const DB = {
 
     async _loadFromBackend() {
         try {
-            const res = await fetch('/api/v1/backup');
+            const res = await fetch('/api/v1/backup?format=columnar', {
+                headers: { 'Accept': `${MsgPack.MIME}, application/json` }
+            });
             if (res.status === 401) {
                 window.location.href = '/auth/saml/login';
                 return;
             }
             if (!res.ok) throw new Error(`HTTP ${res.status}`);
-            const backup = await res.json();
+            // A MessagePack answer means the server can also take MessagePack sync bodies
+            this._msgpack = (res.headers.get('Content-Type') || '').startsWith(MsgPack.MIME);
+            const backup = await API.readBody(res);
             this._applyBackupToLocal(backup);
             console.log('OpenIPAM: Server data loaded into local cache');
         } catch(e) {
@@ -912,12 +921,15 @@ const DB = {
         try {
             for (const [backupKey, dbKey] of Object.entries(this._backupKeyMap)) {
                 const items = backup[backupKey];
-                if (!Array.isArray(items)) continue;
+                // Arrays of objects, or {columns, rows} from ?format=columnar
+                if (!Array.isArray(items) && !(items && Array.isArray(items.rows))) continue;
                 const table = this._tableMap[dbKey];
                 if (!table) continue;
 
                 if (this._blobTables.has(table)) {
                     this._setBlobTable(table, items);
+                } else if (items && Array.isArray(items.columns) && Array.isArray(items.rows)) {
+                    this._loadColumnarTable(table, items);
                 } else {
                     const jsonCols = this._jsonColumns[table] || [];
                     try {
@@ -979,17 +991,48 @@ const DB = {
         this._persist();
     },
 
+    _loadColumnarTable(table, data) {
+        // One prepared INSERT per table; JSON columns already arrive as stored strings
+        let stmt = null;
+        try {
+            this._db.run('BEGIN TRANSACTION');
+            this._db.run(`DELETE FROM ${table}`);
+            const tableInfo = this._db.exec(`PRAGMA table_info(${table})`);
+            const validColumns = new Set(tableInfo[0].values.map(r => r[1]));
+            const cols = data.columns.filter(col => validColumns.has(col));
+            const indexes = cols.map(col => data.columns.indexOf(col));
+            if (cols.length > 0) {
+                stmt = this._db.prepare(
+                    `INSERT INTO ${table} (${cols.join(',')}) VALUES (${cols.map(() => '?').join(',')})`
+                );
+                for (const row of data.rows) {
+                    stmt.run(indexes.map(i => row[i] ?? null));
+                }
+            }
+            this._db.run('COMMIT');
+        } catch(e) {
+            try { this._db.run('ROLLBACK'); } catch(re) {}
+            console.error(`Failed to load ${table} from backend:`, e);
+        } finally {
+            if (stmt) stmt.free();
+        }
+    },
+
     async _refreshFromBackend() {
         if (!this._backendAvailable || this._syncing) return;
         this._syncing = true;
         try {
-            const res = await fetch('/api/v1/backup');
+            const res = await fetch('/api/v1/backup?format=columnar', {
+                headers: { 'Accept': `${MsgPack.MIME}, application/json` }
+            });
             if (res.status === 401) {
                 window.location.href = '/auth/saml/login';
                 return;
             }
             if (!res.ok) throw new Error(`HTTP ${res.status}`);
-            const backup = await res.json();
+            // A MessagePack answer means the server can also take MessagePack sync bodies
+            this._msgpack = (res.headers.get('Content-Type') || '').startsWith(MsgPack.MIME);
+            const backup = await API.readBody(res);
             this._applyBackupToLocal(backup);
             // Re-render current page to show updated data
             if (typeof refreshCurrentPage === 'function') {
@@ -1003,10 +1046,42 @@ const DB = {
     },
 
     _startAutoRefresh() {
+        // Refresh on window focus in every mode
+        window.addEventListener('focus', () => this._refreshFromBackend());
+        if (typeof EventSource === 'undefined') {
+            this._startPolling();
+            return;
+        }
+        // Server pushes one 'change' event per batch of committed tables
+        const source = new EventSource('/api/v1/events');
+        this._events = source;
+        source.addEventListener('change', (e) => {
+            let change;
+            try { change = JSON.parse(e.data); } catch(err) { return; }
+            const foreign = change.anonymous || change.origins.some(o => o !== this._clientId);
+            if (foreign) this._scheduleRefresh();
+        });
+        // Events were missed (server restart or history overflow): reload everything
+        source.addEventListener('reset', () => this._scheduleRefresh());
+        source.onerror = () => {
+            // EventSource reconnects on its own unless the server refused the stream
+            if (source.readyState === EventSource.CLOSED) {
+                this._events = null;
+                this._startPolling();
+            }
+        };
+    },
+
+    _startPolling() {
+        if (this._refreshTimer) return;
         // Poll every 30 seconds
         this._refreshTimer = setInterval(() => this._refreshFromBackend(), 30000);
-        // Also refresh on window focus
-        window.addEventListener('focus', () => this._refreshFromBackend());
+    },
+
+    _scheduleRefresh() {
+        // Collapse bursts of events into a single reload
+        clearTimeout(this._eventDebounce);
+        this._eventDebounce = setTimeout(() => this._refreshFromBackend(), 250);
     },
 
     _pushToBackend(tableName, data) {
@@ -1014,8 +1089,11 @@ const DB = {
         const body = { data: data };
         fetch(`/api/v1/sync/${tableName}`, {
             method: 'PUT',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify(body)
+            headers: {
+                'Content-Type': this._msgpack ? MsgPack.MIME : 'application/json',
+                'X-OpenIPAM-Client': this._clientId
+            },
+            body: this._msgpack ? MsgPack.encode(body) : JSON.stringify(body)
         }).catch(e => {
             console.warn(`OpenIPAM: Failed to push ${tableName} to backend:`, e);
         });
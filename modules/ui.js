@@ -1023,6 +1023,15 @@ function processCSVFile(file) {
     reader.readAsText(file);
 }
 function exportToCSV() {
+    if (DB.useBackend()) {
+        // The server streams the file straight to disk instead of building it in memory here
+        const a = document.createElement('a');
+        a.href = `${API._baseUrl}/export/hosts.csv`;
+        a.download = 'ip_database_export.csv';
+        a.click();
+        showToast('CSV export started', 'success');
+        return;
+    }
     const csv = CSVManager.export();
     downloadFile(csv, 'ip_database_export.csv', 'text/csv');
     showToast('CSV exported successfully', 'success');